@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import math
+import operator
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+# (service, index, prompt version, index generation)
+BucketKey = tuple[str, str, str, str]
+
+
+@dataclass
+class CachedAnswer:
+    vector: array
+    answer: dict[str, Any]
+    created: float
+
+
+@dataclass
+class AnswerCacheSlot:
+    bucket_key: BucketKey
+    question: str
+    vector: array
+
+
+class AnswerCache:
+    """
+    Semantic cache of first-turn `/chat` answers.
+
+    Answers are bucketed by service, search index, prompt version and the index's generation. A question hits
+    when its normalized text was seen before or its embedding is within `similarity_threshold` (cosine) of a
+    cached question. Generations are shared between workers through `generation_loader` / `generation_bumper`,
+    so bumping an index after ingestion retires its cached answers everywhere.
+    """
+
+    def __init__(
+        self,
+        generation_loader: Callable[[str], Awaitable[str]],
+        generation_bumper: Callable[[str], Awaitable[str]],
+        similarity_threshold: float = 0.97,
+        max_entries_per_bucket: int = 256,
+        ttl: float = 24 * 60 * 60,
+    ):
+        self.generation_loader = generation_loader
+        self.generation_bumper = generation_bumper
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_bucket = max_entries_per_bucket
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._generations: dict[str, str] = {}
+        self._buckets: dict[BucketKey, OrderedDict[str, CachedAnswer]] = {}
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        return " ".join(question.split()).casefold().rstrip("?.! ")
+
+    @staticmethod
+    def make_prompt_version(
+        service_prompt: Optional[str], overrides: dict[str, Any], search_filter: Optional[str]
+    ) -> str:
+        # The search filter carries the user's security filters, answers are only shared between equal access
+        payload = json.dumps([service_prompt, overrides, search_filter], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def unit_vector(vector: list[float]) -> array:
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return array("f", (x / norm for x in vector))
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": sum(len(bucket) for bucket in self._buckets.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def lookup(
+        self, service: str, index: str, prompt_version: str, question: str, vector: list[float]
+    ) -> tuple[Optional[dict[str, Any]], AnswerCacheSlot]:
+        """
+        Returns the cached answer, if any, and the slot to `store` a freshly generated answer in.
+        """
+        generation = await self._current_generation(index)
+        slot = AnswerCacheSlot(
+            bucket_key=(service.casefold(), index, prompt_version, generation),
+            question=self.normalize_question(question),
+            vector=self.unit_vector(vector),
+        )
+        bucket = self._buckets.get(slot.bucket_key)
+        if bucket:
+            now = time.time()
+            for expired in [key for key, cached in bucket.items() if now - cached.created > self.ttl]:
+                del bucket[expired]
+            cached = bucket.get(slot.question) or self._most_similar(bucket, slot.vector)
+            if cached is not None:
+                self.hits += 1
+                return cached.answer, slot
+        self.misses += 1
+        return None, slot
+
+    def store(self, slot: AnswerCacheSlot, answer: dict[str, Any]):
+        # A generation bumped while the answer was being generated leaves it in a bucket that is never read again
+        if self._generations.get(slot.bucket_key[1]) != slot.bucket_key[3]:
+            return
+        bucket = self._buckets.setdefault(slot.bucket_key, OrderedDict())
+        bucket[slot.question] = CachedAnswer(vector=slot.vector, answer=answer, created=time.time())
+        bucket.move_to_end(slot.question)
+        while len(bucket) > self.max_entries_per_bucket:
+            bucket.popitem(last=False)
+
+    async def bump_generation(self, index: str):
+        self._set_generation(index, await self.generation_bumper(index))
+
+    async def _current_generation(self, index: str) -> str:
+        try:
+            generation = await self.generation_loader(index)
+        except Exception:
+            # Without the shared generation nothing can be proven fresh, so use a value no bucket has
+            logging.exception("Failed to load generation of index %s", index)
+            generation = f"unavailable-{time.time_ns()}"
+        self._set_generation(index, generation)
+        return generation
+
+    def _set_generation(self, index: str, generation: str):
+        if self._generations.get(index) != generation:
+            self._generations[index] = generation
+            for bucket_key in [key for key in self._buckets if key[1] == index]:
+                del self._buckets[bucket_key]
+
+    def _most_similar(self, bucket: OrderedDict[str, CachedAnswer], vector: array) -> Optional[CachedAnswer]:
+        best, best_similarity = None, self.similarity_threshold
+        for cached in bucket.values():
+            similarity = sum(map(operator.mul, cached.vector, vector))
+            if similarity >= best_similarity:
+                best, best_similarity = cached, similarity
+        return best
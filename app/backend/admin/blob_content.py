@@ -0,0 +1,158 @@
+import mimetypes
+from datetime import datetime
+from typing import AsyncGenerator, Callable, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob.aio import BlobClient
+from quart import Response, current_app, request
+from quart.wrappers.response import IterableBody, ResponseBody
+from werkzeug.http import http_date, unquote_etag
+from werkzeug.sansio.http import is_resource_modified
+
+from admin.citation_cache import CacheEntry, CitationCache
+
+
+def content_type_for(mime_type: Optional[str], file_name: str) -> str:
+    if not mime_type or mime_type == "application/octet-stream":
+        mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    return mime_type
+
+
+def is_modified(etag: str, last_modified) -> bool:
+    return is_resource_modified(
+        http_if_modified_since=request.headers.get("If-Modified-Since"),
+        http_if_none_match=request.headers.get("If-None-Match"),
+        etag=etag,
+        last_modified=last_modified,
+    )
+
+
+def if_range_matches(etag: str, last_modified) -> bool:
+    if "If-Range" not in request.headers:
+        return True
+    return not is_resource_modified(
+        http_range=request.headers.get("Range"),
+        http_if_range=request.headers.get("If-Range"),
+        etag=etag,
+        last_modified=last_modified,
+        ignore_if_range=False,
+    )
+
+
+def requested_byte_range(size: int, etag: str, last_modified) -> Optional[tuple[int, int]]:
+    """
+    Returns the (start, stop) offsets of a satisfiable single byte range, `(0, size)` when the whole blob
+    should be sent (no Range header, or an If-Range that no longer matches), or None when the range
+    cannot be satisfied.
+    """
+    if request.range is None or not if_range_matches(etag, last_modified):
+        return 0, size
+    return request.range.range_for_length(size)
+
+
+async def stream_chunks(blob_client: BlobClient, start: int, length: int, etag: str) -> AsyncGenerator[bytes, None]:
+    # Pin the download to the ETag the headers were built from, so a blob replaced mid-request fails instead of
+    # splicing two versions together
+    downloader = await blob_client.download_blob(
+        offset=start, length=length, etag=etag, match_condition=MatchConditions.IfNotModified
+    )
+    async for chunk in downloader.chunks():
+        yield chunk
+
+
+def content_response(
+    file_name: str,
+    content_type: Optional[str],
+    etag: str,
+    last_modified: datetime,
+    size: int,
+    body: Callable[[int, int], ResponseBody],
+) -> Response:
+    """
+    Builds the response for one version of a document, answering `If-None-Match` / `If-Modified-Since` with 304
+    and a single `Range: bytes=...` request (honouring `If-Range`) with 206 or 416.
+    `body(start, stop)` is only called for the bytes that are actually sent.
+    """
+    etag = unquote_etag(etag)[0] or etag
+    headers = {
+        "Content-Type": content_type_for(content_type, file_name),
+        "Content-Disposition": f'inline; filename="{file_name}"',
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{etag}"',
+        "Last-Modified": http_date(last_modified),
+    }
+    response_class = current_app.response_class
+
+    if not is_modified(etag, last_modified):
+        return response_class(b"", 304, headers)
+
+    byte_range = requested_byte_range(size, etag, last_modified)
+    if byte_range is None:
+        headers["Content-Range"] = f"bytes */{size}"
+        return response_class(b"", 416, headers)
+
+    start, stop = byte_range
+    status = 200
+    if (start, stop) != (0, size):
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    headers["Content-Length"] = str(stop - start)
+    if start == stop:
+        return response_class(b"", status, headers)
+
+    response = response_class(body(start, stop), status, headers)
+    # Large manuals can take longer than the default response timeout to send
+    response.timeout = None
+    return response
+
+
+def cached_file_body(entry: CacheEntry) -> Callable[[int, int], ResponseBody]:
+    def body(start: int, stop: int) -> ResponseBody:
+        file_body = current_app.response_class.file_body_class(entry.path)
+        file_body.begin, file_body.end = start, stop
+        return file_body
+
+    return body
+
+
+def blob_stream_body(blob_client: BlobClient, etag: str) -> Callable[[int, int], ResponseBody]:
+    def body(start: int, stop: int) -> ResponseBody:
+        return IterableBody(stream_chunks(blob_client, start, stop - start, etag))
+
+    return body
+
+
+async def blob_content_response(
+    blob_client: BlobClient, file_name: str, citation_cache: Optional[CitationCache] = None
+) -> Optional[Response]:
+    """
+    Sends a blob without buffering it in memory: from the local citation cache when one is configured and
+    the blob fits, otherwise streamed chunk by chunk from Blob Storage. Returns None if the blob does not exist.
+    """
+    try:
+        if citation_cache is None:
+            properties = await blob_client.get_blob_properties()
+        else:
+            entry, current_properties = await citation_cache.lookup(blob_client)
+            if entry is None:
+                # Without a current entry the lookup returns the blob's properties
+                assert current_properties is not None
+                properties = current_properties
+                if citation_cache.fits(properties.size):
+                    entry = await citation_cache.fetch(blob_client, properties)
+            if entry is not None:
+                return content_response(
+                    file_name, entry.content_type, entry.etag, entry.last_modified, entry.size, cached_file_body(entry)
+                )
+    except ResourceNotFoundError:
+        return None
+
+    return content_response(
+        file_name,
+        properties.content_settings.content_type,
+        properties.etag,
+        properties.last_modified,
+        properties.size,
+        blob_stream_body(blob_client, properties.etag),
+    )
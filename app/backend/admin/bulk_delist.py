@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents.aio import SearchClient
+from azure.storage.blob.aio import ContainerClient
+
+from admin.citation_cache import CitationCache
+
+# Documents per delete_documents call, the most a single indexing batch accepts
+DELETE_BATCH_SIZE = 1000
+# Source files per search.in filter, keeps each filter far below the request size limit
+MAX_FILTER_FILES = 100
+
+
+@dataclass
+class DelistResult:
+    file: str
+    documents: int = 0
+    blobs: int = 0
+    error: Optional[str] = None
+
+
+FileDelisted = Callable[[DelistResult], Awaitable[None]]
+
+
+def sourcefile_filter(files: list[str]) -> str:
+    # Replace ' with '' to escape the single quote for the filter
+    values = [file.replace("'", "''") for file in files]
+    # search.in splits on a delimiter, pick one that none of the file names contain
+    for delimiter in ("|", ",", ";", "~", "^", "`"):
+        if not any(delimiter in value for value in values):
+            return f"search.in(sourcefile, '{delimiter.join(values)}', '{delimiter}')"
+    return " or ".join(f"sourcefile eq '{value}'" for value in values)
+
+
+class BulkDelister:
+    """
+    Removes many files from a search index and its blob container at once.
+
+    The ids of all the files' documents are collected with one `search.in` filter per `MAX_FILTER_FILES` files,
+    and deleted in batches of `DELETE_BATCH_SIZE`, `max_concurrency` batches at a time. Blobs of the files are
+    deleted concurrently as well. Deletions take a moment to show up in search results, so instead of waiting
+    after every batch, the index is searched again once everything is deleted, and only while that search
+    still returns documents is there a wait of `settle_delay` seconds between checks.
+    """
+
+    def __init__(
+        self,
+        search_client: SearchClient,
+        blob_container: ContainerClient,
+        max_concurrency: int = 4,
+        settle_delay: float = 1,
+        max_rounds: int = 10,
+        citation_cache: Optional[CitationCache] = None,
+    ):
+        self.search_client = search_client
+        self.blob_container = blob_container
+        self.settle_delay = settle_delay
+        self.max_rounds = max_rounds
+        self.citation_cache = citation_cache
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def delist(self, files: list[str], on_file_delisted: Optional[FileDelisted] = None) -> list[DelistResult]:
+        """
+        Removes the documents whose `sourcefile` is one of `files`, and their blobs. `on_file_delisted` is awaited
+        with each file's result once the file is gone from the index and the container.
+        """
+        results = {file: DelistResult(file) for file in files}
+        if not results:
+            return []
+
+        async def delist_blobs(result: DelistResult):
+            try:
+                result.blobs = await self.delete_blobs(result.file)
+            except Exception as e:
+                logging.exception("Failed to delete the blobs of %s", result.file)
+                result.error = str(e)
+
+        blob_tasks = [asyncio.create_task(delist_blobs(result)) for result in results.values()]
+        try:
+            await self.delete_documents(results)
+        except Exception as e:
+            logging.exception("Failed to delete documents of %d files from the index", len(results))
+            for result in results.values():
+                result.error = result.error or str(e)
+        await asyncio.gather(*blob_tasks)
+
+        for result in results.values():
+            if on_file_delisted is not None:
+                await on_file_delisted(result)
+        return list(results.values())
+
+    async def delete_documents(self, results: dict[str, DelistResult]):
+        deleted_ids: set[str] = set()
+        for _ in range(self.max_rounds):
+            ids_by_file = await self.find_documents(list(results))
+            if not ids_by_file:
+                return
+            pending = [(file, id) for file, ids in ids_by_file.items() for id in ids if id not in deleted_ids]
+            if not pending:
+                # Only documents that were already deleted, the index has not caught up yet
+                await asyncio.sleep(self.settle_delay)
+                continue
+            batches = [pending[i : i + DELETE_BATCH_SIZE] for i in range(0, len(pending), DELETE_BATCH_SIZE)]
+            await asyncio.gather(*(self._delete_batch(batch) for batch in batches))
+            for file, id in pending:
+                deleted_ids.add(id)
+                results[file].documents += 1
+            logging.info("Deleted %d documents of %d files from the index", len(pending), len(results))
+        raise RuntimeError(f"Documents were still in the index after {self.max_rounds} rounds of deletes")
+
+    async def find_documents(self, files: list[str]) -> dict[str, list[str]]:
+        async def find(group: list[str]) -> list[tuple[str, str]]:
+            async with self._slots:
+                # Only the fields needed to delete and count are returned, results are paged by the SDK
+                results = await self.search_client.search(
+                    search_text="", filter=sourcefile_filter(group), select=["id", "sourcefile"], top=100000
+                )
+                return [(document["sourcefile"], document["id"]) async for document in results]
+
+        groups = [files[i : i + MAX_FILTER_FILES] for i in range(0, len(files), MAX_FILTER_FILES)]
+        ids_by_file: dict[str, list[str]] = {}
+        for found in await asyncio.gather(*(find(group) for group in groups)):
+            for file, id in found:
+                ids_by_file.setdefault(file, []).append(id)
+        return ids_by_file
+
+    async def _delete_batch(self, batch: list[tuple[str, str]]):
+        async with self._slots:
+            await self.search_client.delete_documents(documents=[{"id": id} for _, id in batch])
+
+    async def delete_blobs(self, file: str) -> int:
+        if file.startswith("http"):
+            # URLs are ingested without uploading a blob
+            return 0
+        prefix = os.path.splitext(os.path.basename(file))[0]
+        pattern = re.compile(rf"{re.escape(prefix)}-\d+\.pdf")
+        blob_names = [
+            name async for name in self.blob_container.list_blob_names(name_starts_with=prefix) if pattern.match(name)
+        ]
+
+        async def delete(name: str):
+            async with self._slots:
+                try:
+                    await self.blob_container.delete_blob(name)
+                except ResourceNotFoundError:
+                    pass
+            if self.citation_cache is not None:
+                self.citation_cache.invalidate(self.blob_container.container_name, name)
+
+        await asyncio.gather(*(delete(name) for name in blob_names))
+        return len(blob_names)
@@ -0,0 +1,171 @@
+import asyncio
+import contextlib
+import json
+import logging
+from collections import defaultdict
+from typing import Any, Optional
+
+from azure.data.tables.aio import TableClient
+
+from admin.table_storage import mark_previous_process_entries_deleted
+
+# Azure Table transactions accept at most 100 entities and 4 MiB, all within one partition
+TABLE_BATCH_MAX_ENTITIES = 100
+TABLE_BATCH_MAX_BYTES = 4 * 1024 * 1024 - 64 * 1024
+
+
+class ChatLogWriter:
+    """
+    Write-behind sink for chat log entities.
+
+    Entities are put on a bounded queue and written by a background task as Table batch transactions,
+    grouped by PartitionKey. A flush happens when `flush_size` entities are waiting or `flush_interval`
+    seconds after the first one arrived. When the queue is full, `submit` waits up to `enqueue_timeout`
+    seconds for room (back-pressure) and then drops the entity. A partition whose entries can not be written
+    is dropped and counted in `failed`, so a failing table never makes the waiting entries pile up.
+    """
+
+    def __init__(
+        self,
+        table_client: TableClient,
+        max_queue_size: int = 10000,
+        flush_size: int = TABLE_BATCH_MAX_ENTITIES,
+        flush_interval: float = 2.0,
+        enqueue_timeout: float = 0.1,
+    ):
+        self.table_client = table_client
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=max_queue_size)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_pending = max_queue_size
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self._pending: list[dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self.queue.qsize() + len(self._pending),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "overflowed": self.overflowed,
+            "dropped": self.dropped,
+        }
+
+    async def submit(self, entity: dict[str, Any]) -> bool:
+        try:
+            self.queue.put_nowait(entity)
+        except asyncio.QueueFull:
+            self.overflowed += 1
+            try:
+                await asyncio.wait_for(self.queue.put(entity), timeout=self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                logging.warning("Chat log queue is full, dropped entry %s", entity.get("RowKey"))
+                return False
+        self.enqueued += 1
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        # Drain whatever is still queued, including a batch interrupted mid-write (upserts are idempotent)
+        while not self.queue.empty():
+            self._add_pending(self.queue.get_nowait())
+        if self._pending:
+            await self._write_pending()
+        logging.info("Chat log writer stopped: %s", self.stats())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._add_pending(await self.queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._pending) < self.flush_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._add_pending(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write_pending()
+            except Exception:
+                logging.exception("Failed to write chat log batch")
+
+    def _add_pending(self, entity: dict[str, Any]):
+        if len(self._pending) >= self.max_pending:
+            dropped = self._pending.pop(0)
+            self.dropped += 1
+            logging.warning("Too many chat log entries waiting, dropped entry %s", dropped.get("RowKey"))
+        self._pending.append(entity)
+
+    async def _write_pending(self):
+        entities = self._pending
+        partitions: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        for entity in entities:
+            partitions[entity["PartitionKey"]].append(entity)
+
+        await asyncio.gather(*(self._write_partition(partition_entities) for partition_entities in partitions.values()))
+        # Only a cancelled write leaves the entries pending, for `stop` to write them
+        self._pending = []
+
+    async def _write_partition(self, entities: list[dict[str, Any]]):
+        try:
+            await self._supersede_process_entries(entities)
+        except Exception:
+            # The entries are still written, earlier process entries of their files stay active
+            logging.exception("Failed to supersede process entries of %s", entities[0]["PartitionKey"])
+        for batch in self._split_batches(entities):
+            await self._submit_batch(batch)
+
+    async def _supersede_process_entries(self, entities: list[dict[str, Any]]):
+        process_entities = [entity for entity in entities if entity["ApiFunction"] == "process"]
+        latest_by_file: dict[str, dict[str, Any]] = {}
+        for entity in process_entities:
+            # Within the batch only the newest entry for a file stays active
+            if previous := latest_by_file.get(entity["ChatHistory"]):
+                previous["IsDeleted"] = 1
+            latest_by_file[entity["ChatHistory"]] = entity
+        for entity in latest_by_file.values():
+            await mark_previous_process_entries_deleted(self.table_client, entity)
+
+    def _split_batches(self, entities: list[dict[str, Any]]):
+        batch: list[dict[str, Any]] = []
+        batch_bytes = 0
+        for entity in entities:
+            entity_bytes = len(json.dumps(entity, default=str).encode("utf-8"))
+            if batch and (len(batch) == TABLE_BATCH_MAX_ENTITIES or batch_bytes + entity_bytes > TABLE_BATCH_MAX_BYTES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(entity)
+            batch_bytes += entity_bytes
+        if batch:
+            yield batch
+
+    async def _submit_batch(self, batch: list[dict[str, Any]]):
+        try:
+            await self.table_client.submit_transaction([("upsert", entity) for entity in batch])
+            self.written += len(batch)
+        except Exception:
+            logging.exception("Chat log batch of %s entities failed, writing them one by one", len(batch))
+            for entity in batch:
+                try:
+                    await self.table_client.upsert_entity(entity=entity)
+                    self.written += 1
+                except Exception:
+                    self.failed += 1
+                    logging.exception("Failed to write chat log entry %s", entity.get("RowKey"))
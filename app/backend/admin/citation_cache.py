@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import BlobProperties
+from azure.storage.blob.aio import BlobClient
+
+
+@dataclass
+class CacheEntry:
+    container: str
+    blob_name: str
+    etag: str
+    path: Path
+    size: int
+    content_type: Optional[str]
+    last_modified: datetime
+
+
+class CitationCache:
+    """
+    Size-capped LRU cache of citation blobs on local disk, keyed by (container, blob name, ETag).
+
+    A cached entry is revalidated on every use with a conditional HEAD (`If-None-Match: <etag>`), so only
+    blob properties travel over the network while the blob is unchanged. The index lives in memory, so each
+    worker process keeps its files in its own `worker-<pid>` subdirectory of `directory`: a worker that starts
+    (or is recycled) only wipes its own files and those of workers that are gone, never files another worker
+    may still be serving.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory) / f"worker-{os.getpid()}"
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        self._downloads: dict[tuple[str, str, str], asyncio.Task] = {}
+        self.remove_stale_directories(self.directory.parent)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def remove_stale_directories(directory: Path):
+        """Removes the subdirectories of worker processes that no longer run."""
+        for path in directory.glob("worker-*"):
+            try:
+                # Signal 0 only checks that the process exists
+                os.kill(int(path.name.removeprefix("worker-")), 0)
+            except ProcessLookupError:
+                shutil.rmtree(path, ignore_errors=True)
+            except (ValueError, PermissionError):
+                continue
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def fits(self, size: int) -> bool:
+        return 0 < size <= self.max_bytes
+
+    async def lookup(self, blob_client: BlobClient) -> tuple[Optional[CacheEntry], Optional[BlobProperties]]:
+        """
+        Returns `(entry, None)` when the cached copy is still current, otherwise `(None, properties)` with the
+        blob's current properties. Raises ResourceNotFoundError if the blob is gone.
+        """
+        key = (blob_client.container_name, blob_client.blob_name)
+        entry = self._entries.get(key)
+        try:
+            if entry is None:
+                properties = await blob_client.get_blob_properties()
+            else:
+                properties = await blob_client.get_blob_properties(
+                    etag=entry.etag, match_condition=MatchConditions.IfModified
+                )
+        except ResourceNotFoundError:
+            self.invalidate(*key)
+            raise
+        except HttpResponseError as error:
+            # The storage SDK re-wraps the 304 of a conditional HEAD as a plain HttpResponseError
+            if error.status_code != 304:
+                raise
+            # A file removed from under the cache is a miss, not a response that fails once it starts streaming
+            if self._entries.get(key) is entry and entry is not None and entry.path.exists():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, None
+            properties = await blob_client.get_blob_properties()
+        self.misses += 1
+        if entry is not None:
+            self.invalidate(*key)
+        return None, properties
+
+    async def fetch(self, blob_client: BlobClient, properties: BlobProperties) -> Optional[CacheEntry]:
+        """
+        Downloads the blob version described by `properties` into the cache. Concurrent requests for the same
+        version share one download. Returns None if the blob could not be cached.
+        """
+        key = (blob_client.container_name, blob_client.blob_name, properties.etag)
+        if (task := self._downloads.get(key)) is None:
+            task = asyncio.create_task(self._download(blob_client, properties))
+            self._downloads[key] = task
+            task.add_done_callback(lambda _: self._downloads.pop(key, None))
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            logging.exception("Failed to cache blob %s/%s", blob_client.container_name, blob_client.blob_name)
+            return None
+
+    def invalidate(self, container: str, blob_name: str):
+        if (entry := self._entries.pop((container, blob_name), None)) is not None:
+            self._remove_file(entry)
+
+    def _path_for(self, container: str, blob_name: str, etag: str) -> Path:
+        return self.directory / hashlib.sha256(f"{container}\n{blob_name}\n{etag}".encode()).hexdigest()
+
+    async def _download(self, blob_client: BlobClient, properties: BlobProperties) -> CacheEntry:
+        container, blob_name = blob_client.container_name, blob_client.blob_name
+        if (entry := self._entries.get((container, blob_name))) is not None and entry.etag == properties.etag:
+            return entry
+        path = self._path_for(container, blob_name, properties.etag)
+        partial_path = path.with_suffix(".partial")
+        downloader = await blob_client.download_blob(
+            etag=properties.etag, match_condition=MatchConditions.IfNotModified
+        )
+        try:
+            with open(partial_path, "wb") as file:
+                async for chunk in downloader.chunks():
+                    await asyncio.to_thread(file.write, chunk)
+            os.replace(partial_path, path)
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+
+        entry = CacheEntry(
+            container=container,
+            blob_name=blob_name,
+            etag=properties.etag,
+            path=path,
+            size=properties.size,
+            content_type=properties.content_settings.content_type,
+            last_modified=properties.last_modified,
+        )
+        self.invalidate(container, blob_name)
+        self._entries[(container, blob_name)] = entry
+        self.size += entry.size
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._remove_file(entry)
+            self.evictions += 1
+
+    def _remove_file(self, entry: CacheEntry):
+        self.size -= entry.size
+        # A response already streaming this file keeps its open handle, unlinking does not cut it short
+        entry.path.unlink(missing_ok=True)
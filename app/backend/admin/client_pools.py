@@ -0,0 +1,67 @@
+from typing import Generic, Optional, TypeVar, Union
+
+import aiohttp
+from azure.core.credentials import AzureKeyCredential
+from azure.core.credentials_async import AsyncTokenCredential
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.search.documents.aio import SearchClient
+from azure.storage.blob.aio import ContainerClient
+
+_T = TypeVar("_T", SearchClient, ContainerClient)
+
+
+def create_shared_session() -> aiohttp.ClientSession:
+    # Same session settings the Azure SDK uses when it owns the session
+    return aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar(), auto_decompress=False, trust_env=True)
+
+
+class ClientPool(Generic[_T]):
+    """
+    Long-lived Azure SDK clients keyed by name (index or container).
+
+    All clients of a pool share one credential and one aiohttp session, so connections and TLS sessions
+    to the service are reused across requests and across clients.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._clients: dict[str, _T] = {}
+
+    def create_client(self, name: str, transport: AioHttpTransport) -> _T:
+        raise NotImplementedError
+
+    def get(self, name: str) -> _T:
+        if (client := self._clients.get(name)) is None:
+            if self._session is None:
+                self._session = create_shared_session()
+            client = self.create_client(name, AioHttpTransport(session=self._session, session_owner=False))
+            self._clients[name] = client
+        return client
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class SearchClientPool(ClientPool[SearchClient]):
+    def __init__(self, endpoint: str, credential: Union[AsyncTokenCredential, AzureKeyCredential]):
+        super().__init__()
+        self.endpoint = endpoint
+        self.credential = credential
+
+    def create_client(self, name: str, transport: AioHttpTransport) -> SearchClient:
+        return SearchClient(endpoint=self.endpoint, index_name=name, credential=self.credential, transport=transport)
+
+
+class BlobContainerClientPool(ClientPool[ContainerClient]):
+    def __init__(self, account_url: str, credential: Union[AsyncTokenCredential, str]):
+        super().__init__()
+        self.account_url = account_url
+        self.credential = credential
+
+    def create_client(self, name: str, transport: AioHttpTransport) -> ContainerClient:
+        return ContainerClient(self.account_url, name, credential=self.credential, transport=transport)
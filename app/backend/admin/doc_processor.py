@@ -1,59 +1,23 @@
-import os
-import shutil
-import asyncio
-import ast
-
-# Function to run a shell command and capture its output
 import asyncio
-import re
-
-def extract_filenames(stdout_lines):
-    pattern = r"Filename processed: (.+?), Status: (True|False)(?:, Error: (.+))?"  # Regex to match filename and status
-    processed_files = []
-    
-    for line in stdout_lines:
-        match = re.search(pattern, line)
-        if match:
-            filename = match.group(1)
-            status = match.group(2) == "True"  # Convert status to boolean
-            processed_files.append([filename, status])
-    
-    return {
-        "processed_files": processed_files
-    }
-
-
-async def run_command(command):
-    try:
-        process = await asyncio.create_subprocess_shell(
-            command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-
-        stdout_lines = []
-        while True:
-            stdout_line = await process.stdout.readline()
-            stderr_line = await process.stderr.readline()
-            if not stdout_line and not stderr_line:
-                break  # Exit the loop when there's no more output
-            if stdout_line:
-                print(f"STDOUT: {stdout_line.decode().strip()}")
-                stdout_lines.append(stdout_line.decode().strip())
-            if stderr_line:
-                print(f"STDERR: {stderr_line.decode().strip()}")
-        
-        returncode = await process.wait()
-
-        if returncode != 0:
-            raise Exception(f"Error running command: {command}\nReturn code: {returncode}")
-
-    except Exception as e:
-        print(f"Error: {e}")
-        exit(1)
-
-
-    return stdout_lines
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Optional, cast
+
+from azure.core.credentials import AccessToken
+from azure.core.credentials_async import AsyncTokenCredential
+
+from prepdocs import (
+    clean_key_if_exists,
+    setup_blob_manager,
+    setup_embeddings_service,
+    setup_file_processors,
+    setup_image_embeddings_service,
+    setup_list_file_strategy,
+    setup_search_info,
+)
+from prepdocslib.filestrategy import FileStrategy
+from prepdocslib.strategy import DocumentAction
 
 # Loading .env file from current environment if not already loaded
 if "AZURE_STORAGE_ACCOUNT" not in os.environ:
@@ -61,40 +25,190 @@ if "AZURE_STORAGE_ACCOUNT" not in os.environ:
     env_values = os.popen("azd env get-values").read()
     # Parsing and exporting environment variables
     for line in env_values.splitlines():
-        key, value = line.split('=', 1)  
+        key, value = line.split('=', 1)
         value = value.strip('"')
         os.environ[key] = value
 
-async def prepdocs_processor(files_dir, container, index, max_depth, url=None):
-    # Running "prepdocs.py" with user-provided values
-    print('Running "prepdocs.py"')
-    storage_key = os.getenv("AZURE_STORAGE_KEY")
-    search_service = os.getenv("AZURE_SEARCH_SERVICE")
-    search_key = os.getenv("AZURE_SEARCH_KEY")
-    document_intelligence_key = os.getenv("AZURE_FORMRECOGNIZER_KEY")
-
-    # Now, check if keys exist in environment variables or .env file
-    if storage_key and search_service and search_key and document_intelligence_key:
-        if url:
-            command = f'python ./prepdocs.py "{url}" --url "{url}" --max_depth {max_depth} --storagekey "{storage_key}" --container "{container}" --searchservice "{search_service}" --searchkey "{search_key}" --index "{index}" --documentintelligencekey "{document_intelligence_key}" -v'
-            stdout_lines = await run_command(command)
-        else:
-            command = f'python ./prepdocs.py "{files_dir}/*" --storagekey "{storage_key}" --container "{container}" --searchservice "{search_service}" --searchkey "{search_key}" --index "{index}" --documentintelligencekey "{document_intelligence_key}" -v'
-            stdout_lines = await run_command(command)
-
-
-    filename = extract_filenames(stdout_lines)
-    return filename
-
-    # print("STDOUT OUTPUT:", stdout_lines)  # Print full output for debugging
-
-    # if len(stdout_lines) < 2:
-    #     raise ValueError("Unexpected output format from prepdocs.py. Output too short.")
-
-    # try:
-    #     return ast.literal_eval(stdout_lines[-2])  # Ensure it's a valid Python literal
-    # except Exception as e:
-    #     raise ValueError(f"Error parsing prepdocs output: {e}. Raw output: {stdout_lines[-2]}")
-
-    # return ast.literal_eval(stdout_lines[-2])
+# Indexes whose schema was already created or updated by this worker
+indexes_set_up: set[str] = set()
+# Ingestion runs on an event loop of its own in a worker thread, so parsing and embedding files does not hold up
+# the requests served by the web worker's loop
+ingestion_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_ingestion_loop() -> asyncio.AbstractEventLoop:
+    global ingestion_loop
+    if ingestion_loop is None:
+        ingestion_loop = asyncio.new_event_loop()
+        threading.Thread(target=ingestion_loop.run_forever, name="ingestion", daemon=True).start()
+    return ingestion_loop
+
+
+async def run_on_loop(coroutine: Awaitable[Any], loop: asyncio.AbstractEventLoop) -> Any:
+    # Cancelling the caller cancels the coroutine on the other loop too
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+
+class LoopBoundCredential(AsyncTokenCredential):
+    """Gets tokens from a credential on the event loop it belongs to, for clients running on another loop."""
+
+    def __init__(self, credential: AsyncTokenCredential, loop: asyncio.AbstractEventLoop):
+        self.credential = credential
+        self.loop = loop
+
+    async def get_token(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        return await run_on_loop(self.credential.get_token(*scopes, **kwargs), self.loop)
+
+    async def close(self):
+        # The credential is shared with the web worker, which closes it
+        pass
+
+    async def __aexit__(self, *args: Any):
+        pass
+
+
+def create_file_processors(azure_credential: AsyncTokenCredential):
+    return setup_file_processors(
+        azure_credential=azure_credential,
+        document_intelligence_service=os.getenv("AZURE_DOCUMENTINTELLIGENCE_SERVICE"),
+        document_intelligence_key=clean_key_if_exists(os.getenv("AZURE_FORMRECOGNIZER_KEY")),
+        local_pdf_parser=os.getenv("USE_LOCAL_PDF_PARSER") == "true",
+        local_html_parser=os.getenv("USE_LOCAL_HTML_PARSER") == "true",
+        search_images=os.getenv("USE_GPT4V", "").lower() == "true",
+        use_content_understanding=os.getenv("USE_MEDIA_DESCRIBER_AZURE_CU", "").lower() == "true",
+        content_understanding_endpoint=os.getenv("AZURE_CONTENTUNDERSTANDING_ENDPOINT"),
+    )
+
+
+def native_file_extensions() -> set[str]:
+    # Files in these formats have a parser and are ingested as they are, without converting them to PDF
+    # Only the keys are used, the processors are never run
+    return set(create_file_processors(cast(AsyncTokenCredential, None)).keys())
+
+
+async def create_file_strategy(
+    azure_credential: AsyncTokenCredential,
+    files_dir: str,
+    container: str,
+    index: str,
+    max_depth,
+    url: Optional[str] = None,
+    on_file_processed: Optional[Callable[[str, bool, Optional[str]], Awaitable[None]]] = None,
+) -> FileStrategy:
+    # Same setup as running "prepdocs.py" with the keys from the environment, without starting a new interpreter
+    use_gptvision = os.getenv("USE_GPT4V", "").lower() == "true"
+    use_content_understanding = os.getenv("USE_MEDIA_DESCRIBER_AZURE_CU", "").lower() == "true"
+    search_info = await setup_search_info(
+        search_service=os.environ["AZURE_SEARCH_SERVICE"],
+        index_name=index,
+        azure_credential=azure_credential,
+        search_key=clean_key_if_exists(os.getenv("AZURE_SEARCH_KEY")),
+    )
+    blob_manager = setup_blob_manager(
+        azure_credential=azure_credential,
+        storage_account=os.environ["AZURE_STORAGE_ACCOUNT"],
+        storage_container=container,
+        storage_resource_group=os.getenv("AZURE_STORAGE_RESOURCE_GROUP", ""),
+        subscription_id=os.getenv("AZURE_SUBSCRIPTION_ID", ""),
+        search_images=use_gptvision,
+        storage_key=clean_key_if_exists(os.getenv("AZURE_STORAGE_KEY")),
+    )
+    list_file_strategy = setup_list_file_strategy(
+        azure_credential=azure_credential,
+        local_files=f"{files_dir}/*",
+        datalake_storage_account=None,
+        datalake_filesystem=None,
+        datalake_path=None,
+        datalake_key=None,
+    )
+    openai_host = os.getenv("OPENAI_HOST", "azure")
+    openai_key = None
+    if os.getenv("AZURE_OPENAI_API_KEY_OVERRIDE"):
+        openai_key = os.getenv("AZURE_OPENAI_API_KEY_OVERRIDE")
+    elif not openai_host.startswith("azure") and os.getenv("OPENAI_API_KEY"):
+        openai_key = os.getenv("OPENAI_API_KEY")
+    embeddings_service = setup_embeddings_service(
+        azure_credential=azure_credential,
+        openai_host=openai_host,
+        openai_model_name=os.getenv("AZURE_OPENAI_EMB_MODEL_NAME", "text-embedding-ada-002"),
+        openai_service=os.getenv("AZURE_OPENAI_SERVICE"),
+        openai_custom_url=os.getenv("AZURE_OPENAI_CUSTOM_URL"),
+        openai_deployment=os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT"),
+        openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION") or "2024-06-01",
+        openai_dimensions=int(os.getenv("AZURE_OPENAI_EMB_DIMENSIONS") or 1536),
+        openai_key=clean_key_if_exists(openai_key),
+        openai_org=os.getenv("OPENAI_ORGANIZATION"),
+        disable_vectors=os.getenv("USE_VECTORS", "").lower() == "false",
+    )
+    file_processors = create_file_processors(azure_credential)
+    image_embeddings_service = setup_image_embeddings_service(
+        azure_credential=azure_credential,
+        vision_endpoint=os.getenv("AZURE_VISION_ENDPOINT"),
+        search_images=use_gptvision,
+    )
+    return FileStrategy(
+        search_info=search_info,
+        list_file_strategy=list_file_strategy,
+        blob_manager=blob_manager,
+        file_processors=file_processors,
+        document_action=DocumentAction.Add,
+        embeddings=embeddings_service,
+        image_embeddings=image_embeddings_service,
+        search_analyzer_name=os.getenv("AZURE_SEARCH_ANALYZER_NAME"),
+        use_acls=os.getenv("AZURE_ADLS_GEN2_STORAGE_ACCOUNT") is not None,
+        use_content_understanding=use_content_understanding,
+        content_understanding_endpoint=os.getenv("AZURE_CONTENTUNDERSTANDING_ENDPOINT"),
+        url=url,
+        max_depth=max_depth,
+        on_file_processed=on_file_processed,
+    )
+
+
+async def prepdocs_processor(
+    files_dir,
+    container,
+    index,
+    max_depth,
+    url=None,
+    *,
+    azure_credential: AsyncTokenCredential,
+    on_file_processed: Optional[Callable[[str, bool, Optional[str]], Awaitable[None]]] = None,
+):
+    """
+    Ingests the files in `files_dir` (and `url`, if given) into `index` and `container` by running FileStrategy
+    in this process, on the ingestion loop. `on_file_processed(filename, success, error)` is awaited after each
+    file, on the caller's loop.
+    """
+    loop = asyncio.get_running_loop()
+    processed_files = []
 
+    async def report(filename: str, success: bool, error: Optional[str] = None):
+        processed_files.append([filename, success])
+        if on_file_processed is not None:
+            await run_on_loop(on_file_processed(filename, success, error), loop)
+
+    async def ingest():
+        strategy = await create_file_strategy(
+            LoopBoundCredential(azure_credential, loop),
+            files_dir,
+            container,
+            index,
+            max_depth,
+            url=url,
+            on_file_processed=report,
+        )
+        try:
+            if index not in indexes_set_up:
+                await strategy.setup()
+                indexes_set_up.add(index)
+            logging.info("Ingesting %s into index %s", url or files_dir, index)
+            await strategy.run()
+        finally:
+            # The search and blob clients are closed after each use, the embeddings client is kept for the run
+            if strategy.embeddings is not None:
+                await strategy.embeddings.close()
+
+    await run_on_loop(ingest(), get_ingestion_loop())
+    return {
+        "processed_files": processed_files
+    }
@@ -0,0 +1,340 @@
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+from azure.data.tables.aio import TableClient
+
+JOB_PARTITION = "ingestion"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+UNFINISHED_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+FILE_PENDING = "pending"
+FILE_PROCESSED = "processed"
+FILE_FAILED = "failed"
+FILE_SKIPPED = "skipped"
+
+# Errors are cut short, a table string property holds at most 32K characters
+MAX_ERROR_LENGTH = 300
+# Per-file progress is kept in rows of its own, one partition per job, so a job can have any number of files
+JOB_FILES_PARTITION_PREFIX = "files-"
+# A transaction holds at most 100 operations
+FILE_BATCH_SIZE = 100
+
+
+@dataclass
+class IngestionJob:
+    job_id: str
+    service: str
+    container: str
+    index: str
+    files_dir: str
+    url: Optional[str] = None
+    max_depth: int = 2
+    status: str = JOB_QUEUED
+    # Upload name -> {"status": ..., "error": ...}
+    files: dict[str, dict[str, Optional[str]]] = field(default_factory=dict)
+    error: Optional[str] = None
+    owner: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def to_entity(self) -> dict[str, Any]:
+        return {
+            "PartitionKey": JOB_PARTITION,
+            "RowKey": self.job_id,
+            "Service": self.service,
+            "Container": self.container,
+            "Index": self.index,
+            "FilesDir": self.files_dir,
+            "Url": self.url,
+            "MaxDepth": self.max_depth,
+            "Status": self.status,
+            "Error": self.error,
+            "Owner": self.owner,
+            "CreatedAt": self.created_at,
+            "UpdatedAt": self.updated_at,
+        }
+
+    def file_entity(self, position: int, name: str) -> dict[str, Any]:
+        # Rows are keyed by position, file names may hold characters keys can not
+        progress = self.files[name]
+        return {
+            "PartitionKey": JOB_FILES_PARTITION_PREFIX + self.job_id,
+            "RowKey": f"{position:06d}",
+            "File": name,
+            "Status": progress["status"],
+            "Error": progress["error"],
+        }
+
+    def file_entities(self) -> list[dict[str, Any]]:
+        return [self.file_entity(position, name) for position, name in enumerate(self.files)]
+
+    @classmethod
+    def from_entity(cls, entity: dict[str, Any], file_entities: Iterable[dict[str, Any]] = ()) -> "IngestionJob":
+        job = cls(
+            job_id=entity["RowKey"],
+            service=entity["Service"],
+            container=entity["Container"],
+            index=entity["Index"],
+            files_dir=entity["FilesDir"],
+            url=entity.get("Url"),
+            max_depth=int(entity.get("MaxDepth") or 2),
+            status=entity["Status"],
+            error=entity.get("Error"),
+            owner=entity.get("Owner"),
+            created_at=float(entity.get("CreatedAt") or 0),
+            updated_at=float(entity.get("UpdatedAt") or 0),
+        )
+        for file_entity in sorted(file_entities, key=lambda file_entity: file_entity["RowKey"]):
+            job.files[file_entity["File"]] = {"status": file_entity["Status"], "error": file_entity.get("Error")}
+        return job
+
+    def set_file_status(self, name: str, status: str, error: Optional[str] = None):
+        self.files[name] = {"status": status, "error": error[:MAX_ERROR_LENGTH] if error else None}
+
+    def summary(self) -> dict[str, Any]:
+        counts = {status: 0 for status in (FILE_PENDING, FILE_PROCESSED, FILE_FAILED, FILE_SKIPPED)}
+        for progress in self.files.values():
+            status = progress["status"] or FILE_PENDING
+            counts[status] = counts.get(status, 0) + 1
+        return {
+            "job_id": self.job_id,
+            "service": self.service,
+            "status": self.status,
+            "error": self.error,
+            "url": self.url,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "progress": counts,
+            "files": [{"file": name, **progress} for name, progress in self.files.items()],
+        }
+
+
+# Reports (upload name, status, error) while a job runs
+JobProgress = Callable[[str, str, Optional[str]], Awaitable[None]]
+JobRunner = Callable[[IngestionJob, JobProgress], Awaitable[None]]
+
+
+class IngestionJobQueue:
+    """
+    In-process queue of `/process` ingestion jobs.
+
+    Each job runs as a background task, at most `workers_per_service` at a time per service. Job state is
+    persisted to a table and refreshed every `lease_seconds / 3` while the job runs, per-file progress is saved
+    in a row per file as it changes.
+    A job whose owner stopped refreshing it for `lease_seconds` (a worker that crashed or was restarted) is
+    claimed by the next worker on the same host that scans the table, and resumed with the files that are
+    still pending.
+    """
+
+    def __init__(
+        self,
+        table_client: TableClient,
+        runner: JobRunner,
+        workers_per_service: int = 1,
+        lease_seconds: float = 300,
+        app=None,
+    ):
+        self.table_client = table_client
+        self.runner = runner
+        self.workers_per_service = workers_per_service
+        self.lease_seconds = lease_seconds
+        # Runs the jobs inside this Quart app's context, they outlive the request that submitted them
+        self.app = app
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.resumed = 0
+        self._jobs: dict[str, IngestionJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._slots: dict[str, asyncio.Semaphore] = {}
+        self._scanner: Optional[asyncio.Task] = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "jobs": len(self._jobs),
+            "running": sum(1 for job in self._jobs.values() if job.status == JOB_RUNNING),
+            "queued": sum(1 for job in self._jobs.values() if job.status == JOB_QUEUED),
+            "resumed": self.resumed,
+        }
+
+    def start(self):
+        if self._scanner is None:
+            self._scanner = asyncio.create_task(self._scan())
+
+    async def stop(self):
+        tasks = [task for task in (self._scanner, *self._tasks.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._scanner = None
+        # Hand the unfinished jobs back right away instead of waiting for their lease to run out
+        for job in list(self._jobs.values()):
+            if job.status in UNFINISHED_JOB_STATUSES:
+                job.owner = None
+                await self._save(job)
+        logging.info("Ingestion job queue stopped: %s", self.stats())
+        self._jobs.clear()
+
+    async def submit(
+        self,
+        service: str,
+        container: str,
+        index: str,
+        files_dir: str,
+        file_names: list[str],
+        url: Optional[str] = None,
+        max_depth: int = 2,
+    ) -> IngestionJob:
+        job = IngestionJob(
+            job_id=uuid.uuid4().hex,
+            service=service,
+            container=container,
+            index=index,
+            files_dir=files_dir,
+            url=url,
+            max_depth=max_depth,
+            owner=self.owner,
+        )
+        for name in file_names:
+            job.set_file_status(name, FILE_PENDING)
+        if url:
+            job.set_file_status(url, FILE_PENDING)
+        await self._save_files(job)
+        await self.table_client.upsert_entity(entity=job.to_entity())
+        self._launch(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        if (job := self._jobs.get(job_id)) is not None:
+            return job
+        try:
+            entity = await self.table_client.get_entity(partition_key=JOB_PARTITION, row_key=job_id)
+        except ResourceNotFoundError:
+            return None
+        return IngestionJob.from_entity(entity, await self._load_files(job_id))
+
+    async def _load_files(self, job_id: str) -> list[dict[str, Any]]:
+        file_entities = self.table_client.query_entities(
+            query_filter="PartitionKey eq @partition", parameters={"partition": JOB_FILES_PARTITION_PREFIX + job_id}
+        )
+        return [file_entity async for file_entity in file_entities]
+
+    async def _save_files(self, job: IngestionJob):
+        file_entities = job.file_entities()
+        for i in range(0, len(file_entities), FILE_BATCH_SIZE):
+            await self.table_client.submit_transaction(
+                [("upsert", file_entity) for file_entity in file_entities[i : i + FILE_BATCH_SIZE]]
+            )
+
+    def _launch(self, job: IngestionJob):
+        self._jobs[job.job_id] = job
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._finished(job))
+
+    def _finished(self, job: IngestionJob):
+        self._tasks.pop(job.job_id, None)
+        if job.status not in UNFINISHED_JOB_STATUSES:
+            self._jobs.pop(job.job_id, None)
+
+    async def _run(self, job: IngestionJob):
+        slots = self._slots.setdefault(job.service.casefold(), asyncio.Semaphore(self.workers_per_service))
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            async with slots:
+                job.status = JOB_RUNNING
+                await self._save(job)
+
+                positions = {name: position for position, name in enumerate(job.files)}
+
+                async def progress(name: str, status: str, error: Optional[str] = None):
+                    job.set_file_status(name, status, error)
+                    # A file the job did not list yet is added after the others, as in `files`
+                    position = positions.setdefault(name, len(positions))
+                    try:
+                        await self.table_client.upsert_entity(entity=job.file_entity(position, name))
+                    except Exception:
+                        logging.exception("Failed to save progress of %s in ingestion job %s", name, job.job_id)
+                    await self._save(job)
+
+                try:
+                    if self.app is not None:
+                        async with self.app.app_context():
+                            await self.runner(job, progress)
+                    else:
+                        await self.runner(job, progress)
+                    job.status = JOB_SUCCEEDED
+                except Exception as e:
+                    logging.exception("Ingestion job %s failed", job.job_id)
+                    job.status = JOB_FAILED
+                    job.error = str(e)[:MAX_ERROR_LENGTH]
+                await self._save(job)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job: IngestionJob):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self._save(job)
+
+    async def _save(self, job: IngestionJob):
+        job.updated_at = time.time()
+        try:
+            await self.table_client.upsert_entity(entity=job.to_entity())
+        except Exception:
+            logging.exception("Failed to save state of ingestion job %s", job.job_id)
+
+    async def _scan(self):
+        while True:
+            try:
+                await self.resume_abandoned_jobs()
+            except Exception:
+                logging.exception("Failed to scan for abandoned ingestion jobs")
+            await asyncio.sleep(self.lease_seconds / 2)
+
+    async def resume_abandoned_jobs(self):
+        now = time.time()
+        # The SDK only substitutes parameters that are separate words, hence the spaces inside the parentheses
+        entities = self.table_client.query_entities(
+            query_filter="PartitionKey eq @partition and ( Status eq @queued or Status eq @running )",
+            parameters={"partition": JOB_PARTITION, "queued": JOB_QUEUED, "running": JOB_RUNNING},
+        )
+        async for entity in entities:
+            job = IngestionJob.from_entity(entity)
+            if job.job_id in self._jobs or job.status not in UNFINISHED_JOB_STATUSES:
+                continue
+            if job.owner and now - job.updated_at < self.lease_seconds:
+                continue
+            # The uploaded files only exist on the host that received them
+            if not os.path.isdir(job.files_dir):
+                continue
+            job = IngestionJob.from_entity(entity, await self._load_files(job.job_id))
+            job.owner = self.owner
+            job.updated_at = now
+            try:
+                await self.table_client.update_entity(
+                    entity=job.to_entity(),
+                    mode=UpdateMode.REPLACE,
+                    etag=entity.metadata["etag"],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            except ResourceModifiedError:
+                # Another worker claimed it first
+                continue
+            logging.info("Resuming ingestion job %s", job.job_id)
+            self.resumed += 1
+            self._launch(job)
@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import signal
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class PdfConversionPool:
+    """
+    Converts documents to PDF with headless LibreOffice on `workers` parallel workers.
+
+    Each worker owns a LibreOffice user profile, so concurrent conversions never share (and lock) the same
+    profile. Profiles are created by a warm-up conversion when the worker starts, which takes LibreOffice's
+    first-start cost off the upload path. A conversion that runs past `timeout` is killed together with its
+    office process, and the worker starts over on a fresh profile. LibreOffice comes with the image, whether it
+    is installed is checked once, when the pool starts.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        timeout: float = 120,
+        profiles_dir: Optional[str] = None,
+        soffice: str = "soffice",
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.soffice = soffice
+        self.profiles_dir = Path(profiles_dir or tempfile.mkdtemp(prefix="soffice-profiles-"))
+        self.conversions = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.installed: Optional[bool] = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "conversions": self.conversions,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+        }
+
+    def start(self):
+        if self.installed is None:
+            self.installed = shutil.which(self.soffice) is not None
+            if not self.installed:
+                logging.warning("%s is not installed, documents can not be converted to PDF", self.soffice)
+        if self.installed and not self._tasks:
+            self._tasks = [asyncio.create_task(self._work(index)) for index in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        logging.info("PDF conversion pool stopped: %s", self.stats())
+
+    async def convert(self, doc_path: str, output_dir: str) -> tuple[bool, str]:
+        """
+        Queues `doc_path` for conversion into `output_dir`. Returns (True, pdf path) or (False, error).
+        """
+        self.start()
+        if not self.installed:
+            self.failures += 1
+            return False, f"Conversion failed. Error: {self.soffice} is not installed"
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((doc_path, output_dir, future))
+        return await future
+
+    async def _work(self, index: int):
+        profile = self.profiles_dir / f"worker{index}"
+        while True:
+            if not profile.exists():
+                await self._warm_up(profile)
+            doc_path, output_dir, future = await self._queue.get()
+            if future.done():
+                continue
+            try:
+                result = await self._convert(profile, doc_path, output_dir)
+            except Exception as e:
+                result = (False, f"An error occurred: {str(e)}")
+            if not result[0]:
+                self.failures += 1
+            if not future.done():
+                future.set_result(result)
+
+    async def _warm_up(self, profile: Path):
+        warm_up_dir = Path(tempfile.mkdtemp(prefix="soffice-warm-up-"))
+        try:
+            (warm_up_dir / "warm-up.txt").write_text("warm-up")
+            success, error = await self._convert(profile, str(warm_up_dir / "warm-up.txt"), str(warm_up_dir))
+            if not success:
+                logging.warning("LibreOffice warm-up failed: %s", error)
+        except Exception:
+            logging.exception("LibreOffice warm-up failed")
+        finally:
+            shutil.rmtree(warm_up_dir, ignore_errors=True)
+
+    async def _convert(self, profile: Path, doc_path: str, output_dir: str) -> tuple[bool, str]:
+        process = await asyncio.create_subprocess_exec(
+            self.soffice,
+            f"-env:UserInstallation={profile.as_uri()}",
+            "--headless",
+            "--norestore",
+            "--nologo",
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            output_dir,
+            doc_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # soffice hands the work to a child soffice.bin, the whole group is killed on timeout
+            start_new_session=True,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._restart(process, profile)
+            await process.wait()
+            return False, f"Conversion timed out after {self.timeout} seconds"
+        except asyncio.CancelledError:
+            self._restart(process, profile)
+            raise
+
+        pdf_path = os.path.join(output_dir, Path(doc_path).stem + ".pdf")
+        # soffice exits with 0 for some documents it could not load, so the output is checked too
+        if process.returncode == 0 and os.path.exists(pdf_path):
+            self.conversions += 1
+            return True, pdf_path
+        return False, f"Conversion failed. Error: {stderr.decode()}"
+
+    def _restart(self, process: asyncio.subprocess.Process, profile: Path):
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGKILL)
+        # A killed office can leave its profile locked or half written
+        shutil.rmtree(profile, ignore_errors=True)
+        self.restarts += 1
@@ -0,0 +1,112 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class ServiceRegistry:
+    """
+    In-process view of the SERVICES configuration.
+
+    The SERVICES JSON (from the environment, overridden by the `apiConfiguration` table) is parsed once,
+    indexed by lowercased service name and refreshed in the background every `refresh_interval` seconds.
+    A refresh only re-parses when the content fingerprint (etag) changes, and every change bumps `version`.
+    Routes that write the configuration call `invalidate()` so the handling worker sees the change immediately,
+    other workers pick it up on their next refresh.
+    """
+
+    def __init__(
+        self,
+        config_loader: Callable[[], Awaitable[dict[str, Any]]],
+        prompt_loader: Callable[[dict[str, Any]], Awaitable[dict[str, Any]]],
+        refresh_interval: float = 300,
+        default_services: Optional[str] = None,
+    ):
+        self.config_loader = config_loader
+        self.prompt_loader = prompt_loader
+        self.refresh_interval = refresh_interval
+        self.default_services = default_services if default_services is not None else os.getenv("SERVICES", "[]")
+        self.services: list[dict[str, Any]] = []
+        self.version = 0
+        self.etag: Optional[str] = None
+        self.last_refreshed: Optional[float] = None
+        self._services_by_name: dict[str, dict[str, Any]] = {}
+        self._prompts: dict[str, dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def get(self, service: Any) -> Optional[dict[str, Any]]:
+        if not isinstance(service, str):
+            return None
+        return self._services_by_name.get(service.lower())
+
+    async def get_prompt(self, service: str) -> dict[str, Any]:
+        prompt = self._prompts.get(service)
+        if prompt is None:
+            prompt = await self.prompt_loader({"service": service})
+            # Don't cache lookup failures, the next request should try again
+            if "error" not in prompt:
+                self._prompts[service] = prompt
+        return prompt
+
+    def invalidate_prompt(self, service: Any):
+        if not isinstance(service, str):
+            return
+        for cached_service in [s for s in self._prompts if s.lower() == service.lower()]:
+            del self._prompts[cached_service]
+
+    async def refresh(self) -> bool:
+        """
+        Reloads the configuration, returns True if the set of services changed
+        """
+        async with self._lock:
+            api_configuration = await self.config_loader()
+            if "error" in api_configuration:
+                logging.warning("Keeping service registry version %s: %s", self.version, api_configuration["error"])
+                return False
+            self.last_refreshed = time.monotonic()
+            # Prompts are stored separately from SERVICES, so cached prompts live at most one refresh interval
+            self._prompts.clear()
+
+            services_json = api_configuration.get("SERVICES") or self.default_services
+            etag = hashlib.sha256(services_json.encode("utf-8")).hexdigest()
+            if etag == self.etag:
+                return False
+            try:
+                services = json.loads(services_json.replace("\\", ""))
+            except json.JSONDecodeError:
+                logging.exception("Keeping service registry version %s, SERVICES is not valid JSON", self.version)
+                return False
+
+            self.services = services
+            self._services_by_name = {service["service"].lower(): service for service in services}
+            self.etag = etag
+            self.version += 1
+            logging.info("Loaded service registry version %s with %s services", self.version, len(services))
+            return True
+
+    async def invalidate(self) -> bool:
+        return await self.refresh()
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._refresh_task
+            self._refresh_task = None
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logging.exception("Failed to refresh service registry")
@@ -1,27 +1,93 @@
 from quart import current_app
+import asyncio
+import base64
+import heapq
+import itertools
 import logging
+import re
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import AsyncGenerator, Optional, cast
 import json
+from azure.core.async_paging import AsyncPageIterator
+from azure.core.exceptions import ResourceNotFoundError
 from azure.data.tables import UpdateMode
+from azure.data.tables.aio import TableClient, TableServiceClient
 CHATLOG_TABLE = 'chatLog'
 
 CONFIG_TABLE_SERVICE_CLIENT = 'table_service_client'
+CONFIG_TABLE_CLIENTS = 'table_clients'
+CONFIG_CHATLOG_WRITER = 'chatlog_writer'
+CONFIG_CHATLOG_PARTITIONS = 'chatlog_partitions'
 PROMPT_TABLE = 'servicePrompts'
 FEEDBACK_TABLE = 'feedbackTable'
 APICONFIGURATION_TABLE = 'apiConfiguration'
+INDEX_GENERATION_TABLE = 'indexGenerations'
+INGESTION_JOB_TABLE = 'ingestionJobs'
+TABLES = [
+    CHATLOG_TABLE, PROMPT_TABLE, FEEDBACK_TABLE, APICONFIGURATION_TABLE, INDEX_GENERATION_TABLE, INGESTION_JOB_TABLE
+]
+
+# Newest first RowKeys are "<MAX_ROW_KEY_MILLISECONDS - milliseconds since epoch, 13 digits>_<uuid>" and start with
+# "3" or above until the year 2191, keys of older entries start with their "%Y%m%d%H%M%S" timestamp
+MAX_ROW_KEY_MILLISECONDS = 10**13 - 1
+NEWEST_FIRST_ROW_KEY_START = '3'
+# Table storage returns at most 1000 entities per request
+MAX_QUERY_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 50
+# Listing the services of the chat log takes a query per service, the list is reused for this long
+CHATLOG_PARTITIONS_TTL_SECONDS = 300
+# Older entries are read newest first in windows of their keys' time range, doubling from this one
+LEGACY_WINDOW = timedelta(days=1)
+LEGACY_KEYS_START = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# A transaction holds at most 100 operations, each migrated entry takes two
+MIGRATION_BATCH_SIZE = 50
+CHATLOG_LIST_FIELDS = [
+    'PartitionKey', 'RowKey', 'EntryId', 'Timestamp', 'CreatedAt', 'UserName', 'ApiFunction', 'IsDeleted'
+]
+CHATLOG_CRITERIA_KEYS = {
+    "user_name": "UserName",
+    "is_deleted": "IsDeleted",
+    "api_function": "ApiFunction"
+}
+CHATLOG_QUERY_OPTIONS = (
+    'start_date', 'end_date', 'service', 'top', 'page_size', 'continuation_token', 'include_chat_history'
+)
+FEEDBACK_LIST_FIELDS = ['PartitionKey', 'RowKey', 'Timestamp', 'UserName', 'FeedbackFlag', 'Feedback', 'IsDeleted']
+FEEDBACK_CRITERIA_KEYS = {
+    "feedback_flag": "FeedbackFlag",
+    "user_name": "UserName",
+    "is_deleted": "IsDeleted"
+}
+FEEDBACK_QUERY_OPTIONS = CHATLOG_QUERY_OPTIONS
+# Criteria are filtered on by property name, parameters of our own start with "_" so they never collide
+PROPERTY_NAME_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+
+
+async def setup_table_clients(table_service_client: TableServiceClient) -> dict[str, TableClient]:
+    # Create the tables once per worker and keep one client per table, sharing the service client's transport
+    table_clients = await asyncio.gather(
+        *(table_service_client.create_table_if_not_exists(table_name) for table_name in TABLES)
+    )
+    return dict(zip(TABLES, table_clients))
+
+
+def get_table_client(table_name) -> TableClient:
+    return current_app.config[CONFIG_TABLE_CLIENTS][table_name]
 
 
 async def upsert_api_configuration(key, value):
     try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(APICONFIGURATION_TABLE)
+        table_client = get_table_client(APICONFIGURATION_TABLE)
         entity = {
             'PartitionKey': 'api',
             'RowKey': key,
             'Value': value,
         }
         # Insert or update the entity
-        table_client.upsert_entity(entity=entity)
+        await table_client.upsert_entity(entity=entity)
         return {"message": "Configuration stored or updated successfully"}
     except Exception as e:
             error_message = f"An error occurred while adding or updating the value '{value}'."
@@ -31,13 +97,13 @@ async def upsert_api_configuration(key, value):
 
 async def get_api_configuration():
     try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(APICONFIGURATION_TABLE)
+        table_client = get_table_client(APICONFIGURATION_TABLE)
 
         # Retrieve entities from the Azure table
-        entities = table_client.query_entities(query_filter=None)
+        entities = table_client.list_entities()
 
         api_configuration = {}
-        for entity in entities:
+        async for entity in entities:
             api_configuration[entity['RowKey']] = entity['Value']
 
         return api_configuration
@@ -48,16 +114,33 @@ async def get_api_configuration():
     
 async def delete_api_configuration(key):
     try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(APICONFIGURATION_TABLE)
-        table_client.delete_entity(partition_key='api', row_key=key)            
+        table_client = get_table_client(APICONFIGURATION_TABLE)
+        await table_client.delete_entity(partition_key='api', row_key=key)            
         return {"message": f"'{key}' deleted successfully"}
     except Exception as e:
         error_message = f"An error occurred while deleting the API configuration with key '{key}'."
         logging.exception(error_message)
         return {"error": error_message, "details": str(e)}
 
+async def get_index_generation(index) -> str:
+    try:
+        entity = await get_table_client(INDEX_GENERATION_TABLE).get_entity(partition_key='index', row_key=index)
+        return entity['Generation']
+    except ResourceNotFoundError:
+        return '0'
+
+
+async def bump_index_generation(index) -> str:
+    # A fresh timestamp instead of a read-increment-write, concurrent bumps only need to produce a new value
+    generation = str(time.time_ns())
+    await get_table_client(INDEX_GENERATION_TABLE).upsert_entity(
+        entity={'PartitionKey': 'index', 'RowKey': index, 'Generation': generation}
+    )
+    return generation
+
+
 async def upsert_prompt_entity(service, user_intent_classifier_prompt, document_rag_prompt, sql_agent_prompt):
-    table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(PROMPT_TABLE)
+    table_client = get_table_client(PROMPT_TABLE)
 
     entity = {
         'PartitionKey': 'service',
@@ -68,69 +151,118 @@ async def upsert_prompt_entity(service, user_intent_classifier_prompt, document_
     }
 
     # Insert or update the entity
-    table_client.upsert_entity(entity=entity)
+    await table_client.upsert_entity(entity=entity)
 
     return {"message": "Prompt stored or updated successfully"}
 
-async def get_feedback_entries(search_criteria):
-    try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(FEEDBACK_TABLE)
-
-        start_date = search_criteria.get('start_date', None)
-        end_date = search_criteria.get('end_date', None)
-        service = search_criteria.get('service', None)
-        user_name = search_criteria.get('user_name', None)
-        is_deleted = search_criteria.get('is_deleted', 0)
-        key_mapping = {
-                        "feedback_flag": "FeedbackFlag",
-                        "user_name": "UserName",
-                        "is_deleted": "IsDeleted"
-                        }
-        for old_key, new_key in key_mapping.items():
-            if old_key in search_criteria:
-                search_criteria[new_key] = search_criteria.pop(old_key)
-                
-        query_filters = []
-        for key, value in search_criteria.items():
-            if key not in ['start_date', 'end_date', 'service']:
-                if isinstance(value, int):
-                    query_filters.append(f"{key} eq {value}")
-                else:
-                    query_filters.append(f"{key} eq '{value}'")
-
-        if start_date:
-            query_filters.append(f"Timestamp ge datetime'{start_date}'")
-        if end_date:
-            query_filters.append(f"Timestamp le datetime'{end_date}'")
+def feedback_query(search_criteria: dict) -> tuple[str, dict]:
+    query_filters, parameters = criteria_query(search_criteria, FEEDBACK_CRITERIA_KEYS, FEEDBACK_QUERY_OPTIONS)
+    if start_date := search_criteria.get('start_date'):
+        query_filters.append("Timestamp ge @_start_date")
+        parameters['_start_date'] = parse_criteria_date(start_date)
+    if end_date := search_criteria.get('end_date'):
+        query_filters.append("Timestamp le @_end_date")
+        parameters['_end_date'] = parse_criteria_date(end_date)
+    return " and ".join(query_filters), parameters
+
+
+def feedback_entry(entity, include_chat_history: bool) -> dict:
+    entry = {
+        'Service': entity.get('PartitionKey'),
+        'RowKey': entity['RowKey'],
+        'TimeStamp': entity._metadata["timestamp"],
+        'UserName': entity.get('UserName'),
+        'FeedbackFlag': entity.get('FeedbackFlag'),
+        'Feedback': entity.get('Feedback'),
+        'IsDeleted': entity.get('IsDeleted')
+    }
+    if include_chat_history:
+        entry['ChatHistory'] = json.loads(entity['ChatHistory'])
+    return entry
 
-        if service:
-            query_filters.append(f"PartitionKey eq '{service}'")
-        query_filter = " and ".join(query_filters)
-        # Retrieve entities from the Azure table
-        entities = table_client.query_entities(query_filter=query_filter)
 
-        feedback_list = []
-        for entity in entities:
-            feedback = {
-                'TimeStamp': entity._metadata["timestamp"],
-                'UserName': entity['UserName'],
-                'FeedbackFlag': entity['FeedbackFlag'],
-                'Feedback': entity['Feedback'],
-                'ChatHistory': json.loads(entity['ChatHistory']),
-                'IsDeleted': entity['IsDeleted']
-            }
-            feedback_list.append(feedback)
+async def get_feedback_entries(search_criteria):
+    """
+    Returns the feedback entries matching `search_criteria`.
 
-        return feedback_list
+    With `page_size` (or a `continuation_token`) a page of summaries without chat histories is returned as
+    {"entries": [...], "continuation_token": ...}, a chat history is fetched with get_feedback_entry. Without,
+    the list of all entries is returned, with their chat histories unless `include_chat_history` is false.
+    """
+    try:
+        table_client = get_table_client(FEEDBACK_TABLE)
+
+        page_size = search_criteria.get('page_size')
+        continuation_token = search_criteria.get('continuation_token')
+        paged = page_size is not None or continuation_token is not None
+        include_chat_history = search_criteria.get('include_chat_history', not paged)
+        limit = int(page_size or DEFAULT_PAGE_SIZE) if paged else search_criteria.get('top')
+
+        query_filter, parameters = feedback_query(search_criteria)
+        select = FEEDBACK_LIST_FIELDS + (['ChatHistory'] if include_chat_history else [])
+        token: Optional[dict] = decode_continuation_token(continuation_token) if continuation_token else {}
+        entities: list[dict] = []
+        while token is not None and (limit is None or len(entities) < limit):
+            page, next_page = await query_page(
+                table_client,
+                query_filter,
+                parameters,
+                select,
+                None if limit is None else limit - len(entities),
+                token.get('next'),
+            )
+            entities.extend(page)
+            token = {'next': next_page} if next_page else None
+
+        feedback_list = [feedback_entry(entity, include_chat_history) for entity in entities]
+        if not paged:
+            return feedback_list
+        return {
+            'entries': feedback_list,
+            'continuation_token': encode_continuation_token(token) if token is not None else None
+        }
 
     except Exception as e:
         error_message = "An error occurred while retrieving feedback entries."
         logging.exception(error_message)
         return {"error": error_message, "details": str(e)}
 
+
+async def get_feedback_entry(service, row_key):
+    try:
+        entity = await get_table_client(FEEDBACK_TABLE).get_entity(partition_key=service, row_key=row_key)
+    except ResourceNotFoundError:
+        return None
+    return feedback_entry(entity, include_chat_history=True)
+
+
+def export_feedback_entries(search_criteria) -> AsyncGenerator[str, None]:
+    """
+    Returns a generator of one JSON line per matching feedback entry. Invalid criteria raise ValueError here,
+    before anything is streamed. Stored chat histories are already JSON and are passed through without decoding.
+    """
+    table_client = get_table_client(FEEDBACK_TABLE)
+    query_filter, parameters = feedback_query(search_criteria)
+    select = FEEDBACK_LIST_FIELDS + ['ChatHistory']
+
+    async def export_lines():
+        next_page = None
+        while True:
+            page, next_page = await query_page(
+                table_client, query_filter, parameters, select, MAX_QUERY_PAGE_SIZE, next_page
+            )
+            for entity in page:
+                summary = json.dumps(feedback_entry(entity, include_chat_history=False), default=str)
+                yield f'{summary[:-1]}, "ChatHistory": {entity.get("ChatHistory") or "null"}}}\n'
+            if not next_page:
+                break
+
+    return export_lines()
+
+
 async def get_prompt_entity(search_criteria):
     try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(PROMPT_TABLE)
+        table_client = get_table_client(PROMPT_TABLE)
         service = search_criteria.get('service', None)
         query_filter = f"RowKey eq '{service}'"
 
@@ -138,7 +270,7 @@ async def get_prompt_entity(search_criteria):
         entities = table_client.query_entities(query_filter=query_filter)
 
         # Iterate over the entities (assuming you are expecting one entity)
-        for entity in entities:
+        async for entity in entities:
             document_rag_prompt = entity['DocumentRAGPrompt']
             sql_agent_prompt = entity['SQLAgentPrompt']
             user_intent_classifier_prompt = entity['UserIntentClassifierPrompt']
@@ -155,7 +287,7 @@ async def get_prompt_entity(search_criteria):
         return {"error": error_message, "details": str(e)}
 
 async def upsert_feedback_entity(service, user_name, feedback_flag, feedback, chat_history, is_deleted):
-    table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(FEEDBACK_TABLE)
+    table_client = get_table_client(FEEDBACK_TABLE)
 
     unique_id = str(uuid.uuid4())
     timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -171,142 +303,417 @@ async def upsert_feedback_entity(service, user_name, feedback_flag, feedback, ch
     }
 
     # Insert or update the entity
-    table_client.upsert_entity(entity=entity)
+    await table_client.upsert_entity(entity=entity)
 
     return {"message": "Feedback stored successfully"}
 
-async def upsert_chatlog_entity(selected_service, user_name, api_function, chat_history, is_deleted):
-    table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(CHATLOG_TABLE)
-
+def build_chatlog_entity(selected_service, user_name, api_function, chat_history, is_deleted):
     unique_id = str(uuid.uuid4())
-    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    created_at = datetime.now(timezone.utc)
 
-    row_key = f'{timestamp}_{unique_id}'
-    entity = {
+    row_key = newest_first_row_key(created_at, unique_id)
+    return {
         'PartitionKey': selected_service,
         'RowKey': row_key,
         'UserName': user_name,
         'ApiFunction': api_function,
         'ChatHistory': json.dumps(chat_history),
-        'IsDeleted': is_deleted
+        'IsDeleted': is_deleted,
+        'CreatedAt': created_at
     }
 
-    if api_function == 'process':
-        query_filter = f"PartitionKey eq '{selected_service}' and ApiFunction eq 'process' and IsDeleted eq 0"
-        matching_entities = table_client.query_entities(query_filter=query_filter)
 
-        for existing_entity in matching_entities:
-            existing_chat_history = json.loads(existing_entity['ChatHistory'])
-            if existing_chat_history == chat_history:
-                # Update the previous entry
-                existing_entity['IsDeleted'] = 1
-                table_client.update_entity(mode=UpdateMode.MERGE, entity=existing_entity)
+async def mark_previous_process_entries_deleted(table_client, entity):
+    # A file processed again supersedes the earlier 'process' entries for the same file
+    query_filter = "PartitionKey eq @service and ApiFunction eq 'process' and IsDeleted eq 0"
+    matching_entities = table_client.query_entities(
+        query_filter=query_filter, parameters={"service": entity['PartitionKey']}
+    )
+
+    chat_history = json.loads(entity['ChatHistory'])
+    async for existing_entity in matching_entities:
+        existing_chat_history = json.loads(existing_entity['ChatHistory'])
+        if existing_chat_history == chat_history and existing_entity['RowKey'] != entity['RowKey']:
+            # Update the previous entry
+            existing_entity['IsDeleted'] = 1
+            await table_client.update_entity(mode=UpdateMode.MERGE, entity=existing_entity)
+
+
+async def upsert_chatlog_entity(selected_service, user_name, api_function, chat_history, is_deleted):
+    table_client = get_table_client(CHATLOG_TABLE)
+    entity = build_chatlog_entity(selected_service, user_name, api_function, chat_history, is_deleted)
+
+    if api_function == 'process':
+        await mark_previous_process_entries_deleted(table_client, entity)
 
     # Insert or update the entity
-    table_client.upsert_entity(entity=entity)
+    await table_client.upsert_entity(entity=entity)
 
 
-async def get_chatlogs(search_criteria):
+async def enqueue_chatlog_entity(selected_service, user_name, api_function, chat_history, is_deleted):
+    # Hand the entry to the background writer so the response doesn't wait for storage
+    entity = build_chatlog_entity(selected_service, user_name, api_function, chat_history, is_deleted)
+    await current_app.config[CONFIG_CHATLOG_WRITER].submit(entity)
+
+
+def newest_first_row_key(created_at: datetime, unique_id: str) -> str:
+    # Counts down with time, so table storage lists a partition's newest entries first
+    inverted = MAX_ROW_KEY_MILLISECONDS - int(created_at.timestamp() * 1000)
+    return f'{inverted:013d}_{unique_id}'
+
+
+def parse_criteria_date(value: str) -> datetime:
+    date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def encode_continuation_token(token: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+
+
+def decode_continuation_token(token: str) -> dict:
     try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(CHATLOG_TABLE)
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError as e:
+        raise ValueError("Invalid continuation_token") from e
 
-        start_date = search_criteria.get('start_date', None)
-        end_date = search_criteria.get('end_date', None)
-        service = search_criteria.get('service', None)
-        api_function = search_criteria.get('api_function', None)
-        is_deleted = search_criteria.get('is_deleted', 0)
-        user_name = search_criteria.get('user_name', None)
-        top = search_criteria.pop('top', None)
-
-        key_mapping = {
-                        "user_name": "UserName",
-                        "is_deleted": "IsDeleted",
-                        "api_function": "ApiFunction"
-                        }
-        for old_key, new_key in key_mapping.items():
-            if old_key in search_criteria:
-                search_criteria[new_key] = search_criteria.pop(old_key)
-                
-        query_filters = []
-        for key, value in search_criteria.items():
-            if key not in ['start_date', 'end_date', 'service']:
-                if isinstance(value, int):
-                    query_filters.append(f"{key} eq {value}")
-                else:
-                    query_filters.append(f"{key} eq '{value}'")
 
+@lru_cache(maxsize=256)
+def criteria_filter(properties: tuple[str, ...]) -> str:
+    # Values are bound as parameters and only property names go into the filter, so it is built once per set of
+    # criteria and can't be broken out of by what is searched for
+    for name in properties:
+        if not PROPERTY_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid search criteria '{name}'")
+    return " and ".join(f"{name} eq @{name}" for name in properties)
+
+
+def criteria_query(search_criteria: dict, criteria_keys: dict, query_options) -> tuple[list[str], dict]:
+    parameters = {
+        criteria_keys.get(key, key): value for key, value in search_criteria.items() if key not in query_options
+    }
+    properties = tuple(sorted(parameters))
+    query_filters = [criteria_filter(properties)] if properties else []
+    if service := search_criteria.get('service'):
+        query_filters.append("PartitionKey eq @_service")
+        parameters['_service'] = service
+    return query_filters, parameters
+
+
+async def query_page(table_client: TableClient, query_filter, parameters, select, limit, continuation_token):
+    # One request's worth of entities, and the table's token for the request after it
+    entities = table_client.query_entities(
+        query_filter=query_filter,
+        parameters=parameters,
+        select=select,
+        results_per_page=None if limit is None else min(limit, MAX_QUERY_PAGE_SIZE),
+    )
+    pages = cast(AsyncPageIterator, entities.by_page(continuation_token=continuation_token))
+    async for page in pages:
+        return [entity async for entity in page], pages.continuation_token
+    return [], None
+
+
+def chatlog_query(search_criteria: dict, legacy: bool) -> tuple[str, dict]:
+    query_filters, parameters = criteria_query(search_criteria, CHATLOG_CRITERIA_KEYS, CHATLOG_QUERY_OPTIONS)
+
+    start_date = search_criteria.get('start_date')
+    end_date = search_criteria.get('end_date')
+    if legacy:
+        # Keys of older entries start with their creation time and sort oldest first
+        query_filters.append("RowKey lt @_newest_first_keys")
         if start_date:
-            query_filters.append(f"Timestamp ge datetime'{start_date}'")
+            query_filters.append("RowKey ge @_start_key")
+            parameters['_start_key'] = legacy_row_key(parse_criteria_date(start_date))
+        if end_date:
+            query_filters.append("RowKey lt @_end_key")
+            parameters['_end_key'] = legacy_row_key(parse_criteria_date(end_date)) + '~'
+    else:
+        # The date range is a RowKey range, newest first keys are bounded by the end date from below
+        query_filters.append("RowKey ge @_newest_first_keys")
         if end_date:
-            query_filters.append(f"Timestamp le datetime'{end_date}'")
+            query_filters.append("RowKey ge @_end_key")
+            parameters['_end_key'] = newest_first_row_key(parse_criteria_date(end_date), '')
+        if start_date:
+            query_filters.append("RowKey lt @_start_key")
+            parameters['_start_key'] = newest_first_row_key(parse_criteria_date(start_date), '~')
+    parameters['_newest_first_keys'] = NEWEST_FIRST_ROW_KEY_START
+    return " and ".join(query_filters), parameters
 
-        if service:
-            query_filters.append(f"PartitionKey eq '{service}'")
-        query_filter = " and ".join(query_filters)
-        # Retrieve entities from the Azure table
-        entities = table_client.query_entities(query_filter=query_filter)
-        entities = sorted(entities, key=lambda x: x._metadata["timestamp"], reverse=True) # TODO: optimization
 
-        if top:
-            entities = entities[:top]
+def legacy_row_key(date: datetime) -> str:
+    return f'{date.astimezone(timezone.utc):%Y%m%d%H%M%S}'
 
-        entry_list = []
-        for entity in entities:
-            entry = {
-                'RowKey': entity['RowKey'],
-                'TimeStamp': entity._metadata["timestamp"],
-                'UserName': entity.get('UserName', ''),
-                'ApiFunction': entity['ApiFunction'],
-                'ChatHistory': json.loads(entity['ChatHistory']),
-                'IsDeleted': entity['IsDeleted']
-            }
-            entry_list.append(entry)
 
-        return entry_list
+def legacy_row_key_time(row_key: str) -> datetime:
+    return datetime.strptime(row_key[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
 
-    except Exception as e:
-        error_message = "An error occurred while retrieving chatlog."
-        logging.exception(error_message)
-        return {"error": error_message, "details": str(e)}
-    
-async def get_prompt_entity(search_criteria):
-    try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(PROMPT_TABLE)
-        service = search_criteria.get('service', None)
-        query_filter = f"RowKey eq '{service}'"
 
-        # Retrieve entities from the Azure table
-        entities = table_client.query_entities(query_filter=query_filter)
+def chatlog_sort_key(entity) -> int:
+    # Milliseconds since epoch the entry was created at, read from either kind of key
+    row_key = entity['RowKey']
+    if row_key >= NEWEST_FIRST_ROW_KEY_START:
+        return MAX_ROW_KEY_MILLISECONDS - int(row_key[:13])
+    try:
+        return int(legacy_row_key_time(row_key).timestamp() * 1000)
+    except ValueError:
+        return 0
+
+
+def chatlog_cursor(row_key: str) -> dict:
+    # Where reading a service's entries continues after the entry with `row_key`
+    if row_key >= NEWEST_FIRST_ROW_KEY_START:
+        return {'after': row_key}
+    return {'legacy': True, 'before': row_key}
+
+
+def chatlog_entry(entity, include_chat_history: bool) -> dict:
+    entry = {
+        'Service': entity.get('PartitionKey'),
+        # Entries given a newest first key keep the key clients know them by in EntryId
+        'RowKey': entity.get('EntryId') or entity['RowKey'],
+        'TimeStamp': entity.get('CreatedAt') or entity._metadata["timestamp"],
+        'UserName': entity.get('UserName', ''),
+        'ApiFunction': entity['ApiFunction'],
+        'IsDeleted': entity['IsDeleted']
+    }
+    if include_chat_history:
+        entry['ChatHistory'] = json.loads(entity['ChatHistory'])
+    return entry
+
+
+async def first_entity(table_client: TableClient, query_filter, parameters, select):
+    # Table storage may answer with an empty page and a continuation token, the first match can be further on
+    next_page = None
+    while True:
+        page, next_page = await query_page(table_client, query_filter, parameters, select, 1, next_page)
+        if page or not next_page:
+            return page[0] if page else None
+
+
+async def list_partitions(table_client: TableClient) -> list[str]:
+    # There is no distinct query, each partition is found by asking for the first entity after the previous one
+    partitions: list[str] = []
+    while entity := await first_entity(
+        table_client, "PartitionKey gt @_after", {'_after': partitions[-1] if partitions else ''}, ['PartitionKey']
+    ):
+        partitions.append(entity['PartitionKey'])
+    return partitions
+
+
+async def get_chatlog_partitions(table_client: TableClient) -> list[str]:
+    # A service that logs its first entry shows up in reads without a service once the list is refreshed
+    expires_at, partitions = current_app.config.get(CONFIG_CHATLOG_PARTITIONS, (0.0, []))
+    if time.monotonic() >= expires_at:
+        partitions = await list_partitions(table_client)
+        current_app.config[CONFIG_CHATLOG_PARTITIONS] = (time.monotonic() + CHATLOG_PARTITIONS_TTL_SECONDS, partitions)
+    return partitions
+
+
+async def read_chatlog_partition(
+    table_client: TableClient, search_criteria: dict, select: list[str], cursor: dict, limit: Optional[int]
+) -> tuple[list, bool]:
+    """
+    Reads up to `limit` entries of the service in `search_criteria` from `cursor` on, newest first, and returns
+    them with whether there are no more. Entries with newest first keys come first; older entries, until
+    migrate_chatlog_row_keys has given them such a key, are read after them in windows going back in time, so
+    about a page of them is read at a time instead of all of them.
+    """
+    entities: list = []
+    if not cursor.get('legacy'):
+        query_filter, parameters = chatlog_query(search_criteria, legacy=False)
+        if after := cursor.get('after'):
+            query_filter += " and RowKey gt @_after"
+            parameters['_after'] = after
+        next_page = None
+        while limit is None or len(entities) < limit:
+            page, next_page = await query_page(
+                table_client,
+                query_filter,
+                parameters,
+                select,
+                None if limit is None else limit - len(entities),
+                next_page,
+            )
+            entities.extend(page)
+            if not next_page:
+                break
+        if next_page or (limit is not None and len(entities) == limit):
+            return entities, False
+
+    query_filter, parameters = chatlog_query(search_criteria, legacy=True)
+    if before := cursor.get('before'):
+        query_filter += " and RowKey lt @_before"
+        parameters['_before'] = before
+    remaining = None if limit is None else limit - len(entities)
+    if remaining is None:
+        legacy_entities = table_client.query_entities(query_filter=query_filter, parameters=parameters, select=select)
+        entities.extend(sorted([entity async for entity in legacy_entities], key=lambda x: x['RowKey'], reverse=True))
+        return entities, True
+    oldest = await first_entity(table_client, query_filter, parameters, ['RowKey'])
+    if oldest is None:
+        return entities, True
+
+    if before and before[:14].isdigit():
+        window_end = legacy_row_key_time(before)
+    elif end_date := search_criteria.get('end_date'):
+        window_end = parse_criteria_date(end_date)
+    else:
+        window_end = datetime.now(timezone.utc)
+    legacy: list = []
+    window_end_key = None
+    window = LEGACY_WINDOW
+    reached_oldest = False
+    while len(legacy) < remaining and not reached_oldest:
+        window_start = window_end - window
+        window_start_key = legacy_row_key(window_start)
+        reached_oldest = window_start < LEGACY_KEYS_START or window_start_key <= oldest['RowKey']
+        window_filter = query_filter
+        window_parameters = dict(parameters)
+        if not reached_oldest:
+            window_filter += " and RowKey ge @_window_start"
+            window_parameters['_window_start'] = window_start_key
+        if window_end_key is not None:
+            window_filter += " and RowKey lt @_window_end"
+            window_parameters['_window_end'] = window_end_key
+        window_entities = table_client.query_entities(
+            query_filter=window_filter, parameters=window_parameters, select=select
+        )
+        legacy.extend(sorted([entity async for entity in window_entities], key=lambda x: x['RowKey'], reverse=True))
+        window_end_key = window_start_key
+        window *= 2
+    entities.extend(legacy[:remaining])
+    return entities, reached_oldest and len(legacy) <= remaining
 
-        # Iterate over the entities (assuming you are expecting one entity)
-        for entity in entities:
-            document_rag_prompt = entity['DocumentRAGPrompt']
-            sql_agent_prompt = entity['SQLAgentPrompt']
-            user_intent_classifier_prompt = entity['UserIntentClassifierPrompt']
-            return {"document_rag_prompt": document_rag_prompt,
-                    "sql_agent_prompt": sql_agent_prompt,
-                    "user_intent_classifier_prompt": user_intent_classifier_prompt}
 
-        # If no entities are found
-        return {"document_rag_prompt": ""}
+async def get_chatlogs(search_criteria):
+    """
+    Returns the chat logs matching `search_criteria`, newest first.
+
+    With `page_size` (or a `continuation_token`) a page is returned as {"entries": [...], "continuation_token": ...},
+    the token is passed back to get the next page and is None after the last one. Without, the list of entries is
+    returned, up to `top` of them. `include_chat_history: false` leaves out the chat histories, for list views.
+    Without a service, each service is read newest first on its own and the services are merged by creation time.
+    """
+    try:
+        table_client = get_table_client(CHATLOG_TABLE)
+
+        top = search_criteria.get('top')
+        page_size = search_criteria.get('page_size')
+        continuation_token = search_criteria.get('continuation_token')
+        include_chat_history = search_criteria.get('include_chat_history', True)
+        paged = page_size is not None or continuation_token is not None
+        limit = int(page_size or DEFAULT_PAGE_SIZE) if paged else top
+
+        select = CHATLOG_LIST_FIELDS + (['ChatHistory'] if include_chat_history else [])
+        if continuation_token:
+            cursors = decode_continuation_token(continuation_token).get('cursors')
+            if not isinstance(cursors, dict):
+                raise ValueError("Invalid continuation_token")
+        elif service := search_criteria.get('service'):
+            cursors = {service: {}}
+        else:
+            cursors = {partition: {} for partition in await get_chatlog_partitions(table_client)}
+
+        reads = await asyncio.gather(
+            *(
+                read_chatlog_partition(table_client, {**search_criteria, 'service': service}, select, cursor, limit)
+                for service, cursor in cursors.items()
+            )
+        )
+        merged = heapq.merge(*(entities for entities, _ in reads), key=chatlog_sort_key, reverse=True)
+        entities = list(itertools.islice(merged, limit))
+
+        # Each service continues after the last of its entries that made it into this page
+        last_taken = {entity['PartitionKey']: entity['RowKey'] for entity in entities}
+        next_cursors = {}
+        for (service, cursor), (read, exhausted) in zip(cursors.items(), reads):
+            if service in last_taken:
+                if not (exhausted and read[-1]['RowKey'] == last_taken[service]):
+                    next_cursors[service] = chatlog_cursor(last_taken[service])
+            elif read or not exhausted:
+                # None of its entries made it into this page, it starts over from the same place
+                next_cursors[service] = cursor
+
+        entry_list = [chatlog_entry(entity, include_chat_history) for entity in entities]
+        if not paged:
+            return entry_list
+        return {
+            'entries': entry_list,
+            'continuation_token': encode_continuation_token({'cursors': next_cursors}) if next_cursors else None
+        }
 
     except Exception as e:
-        error_message = "An error occurred while retrieving prompt entries."
+        error_message = "An error occurred while retrieving chatlog."
         logging.exception(error_message)
         return {"error": error_message, "details": str(e)}
-    
+
+
+async def migrate_chatlog_row_keys(table_client: TableClient) -> int:
+    """
+    Gives chat log entries written before newest first RowKeys were introduced such a key, keeping their creation
+    time in CreatedAt and their former key in EntryId. Each batch of an entry's copy and the removal of the
+    original is one transaction. Run once, as a single job, with migrate_chatlog_keys.py.
+    """
+    legacy_entities = table_client.query_entities(
+        query_filter="RowKey lt @_newest_first_keys", parameters={'_newest_first_keys': NEWEST_FIRST_ROW_KEY_START}
+    )
+    by_partition: dict[str, list] = {}
+    async for entity in legacy_entities:
+        by_partition.setdefault(entity['PartitionKey'], []).append(entity)
+
+    migrated = 0
+    for partition_entities in by_partition.values():
+        for i in range(0, len(partition_entities), MIGRATION_BATCH_SIZE):
+            operations = []
+            for entity in partition_entities[i : i + MIGRATION_BATCH_SIZE]:
+                # Legacy keys are "<%Y%m%d%H%M%S>_<uuid>"
+                timestamp, _, unique_id = entity['RowKey'].partition('_')
+                try:
+                    created_at = datetime.strptime(timestamp, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+                except ValueError:
+                    continue
+                migrated_entity = dict(entity)
+                migrated_entity['RowKey'] = newest_first_row_key(created_at, unique_id or str(uuid.uuid4()))
+                migrated_entity.setdefault('CreatedAt', created_at)
+                # Clients keep referring to the entry by the key they were given
+                migrated_entity.setdefault('EntryId', entity['RowKey'])
+                operations.append(('upsert', migrated_entity))
+                operations.append(('delete', {'PartitionKey': entity['PartitionKey'], 'RowKey': entity['RowKey']}))
+            if not operations:
+                continue
+            try:
+                await table_client.submit_transaction(operations)
+                migrated += len(operations) // 2
+            except Exception:
+                logging.exception("Failed to migrate a batch of chat log keys")
+    if migrated:
+        logging.info("Migrated %d chat log entries to newest first keys", migrated)
+    return migrated
+
 
 async def update_is_deleted(partition_key, row_key):
     try:
-        table_client = current_app.config[CONFIG_TABLE_SERVICE_CLIENT].create_table_if_not_exists(CHATLOG_TABLE)
-
-        entity = table_client.get_entity(partition_key = partition_key, row_key=row_key)
+        table_client = get_table_client(CHATLOG_TABLE)
+
+        try:
+            entity = await table_client.get_entity(partition_key = partition_key, row_key=row_key)
+        except ResourceNotFoundError:
+            # The entry got a newest first key, it is still known by its former key
+            entity = await first_entity(
+                table_client,
+                "PartitionKey eq @_service and EntryId eq @_entry_id",
+                {'_service': partition_key, '_entry_id': row_key},
+                None,
+            )
+            if entity is None:
+                raise
 
         # Update the 'IsDeleted' field to 1
         entity['IsDeleted'] = 1
 
         # Save the updated entity back to the table
-        table_client.update_entity(entity=entity)
+        await table_client.update_entity(entity=entity)
 
     except Exception as e:
         # Handle any errors that may occur during the update
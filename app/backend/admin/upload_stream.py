@@ -0,0 +1,183 @@
+import asyncio
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import BinaryIO, Callable, Optional
+
+from quart import Request, request
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_content_range_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+# Form fields are small (service, url, ...), they are the only part of a multipart upload kept in memory
+MAX_FIELD_BYTES = 64 * 1024
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    def __init__(self, error: str, status_code: int = 400):
+        self.error = error
+        self.status_code = status_code
+
+    def __str__(self) -> str:
+        return self.error
+
+
+def upload_request_class(max_upload_bytes: int, is_upload: Callable[[str, str, Headers], bool]) -> type[Request]:
+    """
+    Returns a request class whose bodies may grow to `max_upload_bytes` for the requests `is_upload(method, path,
+    headers)` picks, all other requests keep the app's MAX_CONTENT_LENGTH. Quart sizes a request body when the
+    request arrives, before it is routed and before_request hooks run, so this is where the limit is raised.
+    """
+
+    class UploadRequest(Request):
+        def __init__(self, method: str, scheme: str, path: str, query_string: bytes, headers: Headers, *args, **kwargs):
+            upload = is_upload(method, path, headers)
+            if upload:
+                kwargs["max_content_length"] = max_upload_bytes
+            super().__init__(method, scheme, path, query_string, headers, *args, **kwargs)
+            if upload:
+                self.max_content_length = max_upload_bytes
+
+    return UploadRequest
+
+
+def safe_file_name(file_name: Optional[str]) -> str:
+    name = os.path.basename((file_name or "").replace("\\", "/"))
+    if name in ("", ".", ".."):
+        raise UploadError(f"Invalid file name '{file_name}'")
+    return name
+
+
+async def save_multipart_upload(
+    files_dir: str, max_file_bytes: int, max_total_bytes: int
+) -> tuple[dict[str, str], list[str]]:
+    """
+    Streams a multipart/form-data request body to disk, writing each file part to `files_dir` as it arrives.
+    Returns the form fields and the names of the saved files. Raises UploadError with status 413 as soon as a
+    file or the whole upload goes over its limit.
+    """
+    boundary = request.mimetype_params.get("boundary")
+    if not boundary:
+        raise UploadError("Missing multipart boundary")
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=MAX_FIELD_BYTES)
+    fields: dict[str, str] = {}
+    file_names: list[str] = []
+    field_name: Optional[str] = None
+    field_value = bytearray()
+    file: Optional[BinaryIO] = None
+    file_bytes = 0
+    total_bytes = 0
+
+    async def handle_events():
+        nonlocal field_name, field_value, file, file_bytes, total_bytes
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                name = safe_file_name(event.filename)
+                file = open(os.path.join(files_dir, name), "wb")
+                file_bytes = 0
+                file_names.append(name)
+            elif isinstance(event, Field):
+                field_name, field_value = event.name, bytearray()
+            elif isinstance(event, Data):
+                if file is not None:
+                    file_bytes += len(event.data)
+                    total_bytes += len(event.data)
+                    if file_bytes > max_file_bytes:
+                        raise UploadError(f"File {file_names[-1]} is larger than {max_file_bytes} bytes", 413)
+                    if total_bytes > max_total_bytes:
+                        raise UploadError(f"Upload is larger than {max_total_bytes} bytes", 413)
+                    await asyncio.to_thread(file.write, event.data)
+                    if not event.more_data:
+                        file.close()
+                        file = None
+                elif field_name is not None:
+                    field_value += event.data
+                    if not event.more_data:
+                        fields[field_name] = field_value.decode()
+            event = decoder.next_event()
+
+    try:
+        async for chunk in request.body:
+            decoder.receive_data(chunk)
+            await handle_events()
+        decoder.receive_data(None)
+        await handle_events()
+    except ValueError as e:
+        raise UploadError(f"Malformed multipart body: {e}") from e
+    except RequestEntityTooLarge as e:
+        raise UploadError(f"Upload is larger than {request.max_content_length} bytes", 413) from e
+    finally:
+        if file is not None:
+            file.close()
+    return fields, file_names
+
+
+def upload_session_dir(uploads_dir: str, upload_id: str) -> str:
+    if not UPLOAD_ID_PATTERN.match(upload_id or ""):
+        raise UploadError("Unknown upload", 404)
+    session_dir = os.path.join(uploads_dir, upload_id)
+    if not os.path.isdir(session_dir):
+        raise UploadError("Unknown upload", 404)
+    return session_dir
+
+
+def create_upload_session(uploads_dir: str, ttl: float) -> str:
+    os.makedirs(uploads_dir, exist_ok=True)
+    # Abandoned sessions are removed when new ones are started
+    for name in os.listdir(uploads_dir):
+        path = os.path.join(uploads_dir, name)
+        if os.path.isdir(path) and time.time() - os.path.getmtime(path) > ttl:
+            shutil.rmtree(path, ignore_errors=True)
+    upload_id = uuid.uuid4().hex
+    os.makedirs(os.path.join(uploads_dir, upload_id))
+    return upload_id
+
+
+def uploaded_file_sizes(session_dir: str) -> dict[str, int]:
+    return {name: os.path.getsize(os.path.join(session_dir, name)) for name in sorted(os.listdir(session_dir))}
+
+
+async def append_upload_chunk(session_dir: str, file_name: str, max_file_bytes: int) -> tuple[int, Optional[int]]:
+    """
+    Appends the request body to an uploaded file. A `Content-Range: bytes <start>-<end>/<total>` header resumes
+    the file at `start`, which must be the number of bytes already received (UploadError with status 409
+    otherwise). Returns the bytes received so far and the total size, if known.
+    """
+    path = os.path.join(session_dir, safe_file_name(file_name))
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    start, length = 0, None
+    if content_range_header := request.headers.get("Content-Range"):
+        content_range = parse_content_range_header(content_range_header)
+        if content_range is None or content_range.units != "bytes" or content_range.start is None:
+            raise UploadError("Invalid Content-Range header")
+        start, length = content_range.start, content_range.length
+    if start != offset:
+        raise UploadError(f"Expected the upload to resume at byte {offset}", 409)
+    if length is not None and length > max_file_bytes:
+        raise UploadError(f"File is larger than {max_file_bytes} bytes", 413)
+
+    with open(path, "ab") as file:
+        try:
+            async for chunk in request.body:
+                offset += len(chunk)
+                if offset > (length if length is not None else max_file_bytes):
+                    # Drop the partial chunk so the client can resume from the last good offset
+                    file.truncate(offset - len(chunk))
+                    raise UploadError("Chunk goes past the end of the file", 413)
+                await asyncio.to_thread(file.write, chunk)
+        except RequestEntityTooLarge as e:
+            raise UploadError(f"Chunk is larger than {request.max_content_length} bytes", 413) from e
+    os.utime(session_dir)
+    return offset, length
@@ -1,22 +1,30 @@
-import json
 import os 
-import asyncio
-import shutil
-import subprocess
-from admin.table_storage import get_prompt_entity, get_api_configuration
-from azure.identity.aio import DefaultAzureCredential
+from typing import Optional
+from admin.answer_cache import AnswerCache
+from admin.bulk_delist import BulkDelister, FileDelisted
+from admin.citation_cache import CitationCache
+from admin.client_pools import BlobContainerClientPool, SearchClientPool
+from admin.pdf_conversion import PdfConversionPool
+from admin.service_registry import ServiceRegistry
 from azure.search.documents.aio import SearchClient
 from azure.core.credentials import AzureKeyCredential
-from azure.storage.blob.aio import BlobServiceClient
+from azure.storage.blob.aio import ContainerClient
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from approaches.fanoutsearch import FanOutSearchClient
 import logging, re
 from quart import current_app
 from dotenv import load_dotenv
+from config import (
+    CONFIG_ANSWER_CACHE,
+    CONFIG_BLOB_CONTAINER_CLIENT_POOL,
+    CONFIG_CHAT_APPROACH,
+    CONFIG_CITATION_CACHE,
+    CONFIG_PDF_CONVERSION_POOL,
+    CONFIG_SEARCH_CLIENT_POOL,
+    CONFIG_SERVICE_REGISTRY,
+)
 
 
-CONFIG_CHAT_APPROACH = "chat_approach"
-CONFIG_OPENAI_CLIENT = "openai_client"
-
 # AZURE_AI_SERVICE = os.environ["AZURE_AI_SERVICE"]
 # AZURE_AI_API_KEY = os.environ["AZURE_AI_API_KEY"]
 AZURE_STORAGE_ACCOUNT = os.environ["AZURE_STORAGE_ACCOUNT"] 
@@ -32,115 +40,86 @@ AZURE_SEARCH_SERVICE = os.environ["AZURE_SEARCH_SERVICE"]
 async def load_environment_variables():
     load_dotenv()
 
-async def load_table_environment_variables():
-    try:
-        api_config = await get_api_configuration()
-
-        # Setting environment variables
-        for key, value in api_config.items():
-            if key=="SERVICES":
-                os.environ[key] = value
-
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-    except Exception as e:
-        print(f"Error setting table environment variables: {e}")
-
-async def install_sudo():
-    try:
-        print("Installing sudo...")
-        subprocess.run(['apt-get', 'update'], check=True)
-        subprocess.run(['apt-get', 'install', 'sudo'], check=True)
-        print("sudo installed successfully.")
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Error installing sudo: {e}")
-    
-async def install_libreoffice():
-    if shutil.which('sudo') is None:
-        await install_sudo()
-
-    try:
-        print("Installing LibreOffice...")
-        subprocess.run(['sudo', 'apt-get', 'update'], check=True)
-        subprocess.run(['sudo', 'apt-get', 'install', 'libreoffice'], check=True)
-        print("LibreOffice installed successfully.")
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Error installing LibreOffice: {e}")
-
-def is_libreoffice_installed():
-    return shutil.which('libreoffice') is not None
-
 async def get_service_accessories(service):
-    # Fetch services and parse JSON
-    services = json.loads(os.getenv('SERVICES', '[]').replace('\\', ''))
-    # service_info = next((x for x in services if x["service"] == service), None)
-    service_info = next((x for x in services if x["service"].lower() == service.lower()), None)
+    # Look up the service in the registry parsed at startup
+    registry: ServiceRegistry = current_app.config[CONFIG_SERVICE_REGISTRY]
+    service_info = registry.get(service)
     if service_info:
         azure_search_index = service_info.get("index", os.environ.get("AZURE_SEARCH_INDEX", "index"))
         azure_storage_container = service_info.get("blob", os.environ.get("AZURE_STORAGE_CONTAINER", "content"))
         service_prompt = service_info.get("prompt", None)
         if not service_prompt:
-            service_prompt = await get_prompt_entity({"service": service })
+            service_prompt = await registry.get_prompt(service)
         use_external_source = service_info.get("use_external_source", 0)
     else:
         return None
     return [azure_search_index, azure_storage_container, service_prompt['document_rag_prompt'], use_external_source]
 
-async def generate_pdf_async(doc_path, output_path): #TODO: Implement alternate way wihtout libre office installation. 
-    if not is_libreoffice_installed():
-        await install_libreoffice()
-
-    process_cmd = [
-        'soffice',
-        '--headless',
-        '--convert-to',
-        'pdf',
-        '--outdir',
-        output_path,
-        doc_path
-    ]
+async def get_fan_out_search_client(service, services):
+    # The request's own service comes first, the other services are searched alongside it
+    search_clients = {}
+    for name in [service, *services]:
+        if name in search_clients:
+            continue
+        service_accessories = await get_service_accessories(name)
+        if not service_accessories or service_accessories[3]:
+            return None
+        search_clients[name] = get_search_client(service_accessories[0])
+    return FanOutSearchClient(search_clients)
+
+def get_service_overrides(service):
+    # Per-service defaults for the approach overrides, e.g. {"service": "hr", "overrides": {"query_rewrite": "auto"}}
+    registry: ServiceRegistry = current_app.config[CONFIG_SERVICE_REGISTRY]
+    service_info = registry.get(service) or {}
+    return dict(service_info.get("overrides") or {})
 
-    try:
-        process = await asyncio.create_subprocess_exec(
-            *process_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        stdout, stderr = await process.communicate()
-
-        if process.returncode == 0: 
-            return True, os.path.join(output_path, os.path.basename(doc_path) + '.pdf')
-        else:
-            return False, f"Conversion failed. Error: {stderr.decode()}"
-    except Exception as e:
-        return False, f"An error occurred: {str(e)}"
-    
+async def generate_pdf_async(doc_path, output_path): #TODO: Implement alternate way wihtout libre office installation. 
+    # Queued on the warm LibreOffice workers set up at startup
+    pdf_conversion_pool: PdfConversionPool = current_app.config[CONFIG_PDF_CONVERSION_POOL]
+    return await pdf_conversion_pool.convert(doc_path, output_path)
 
 
-def get_blob_container_client(azure_storage_container):
 
-    azure_credential = DefaultAzureCredential(exclude_shared_token_cache_credential = True)
+def create_blob_container_client_pool(azure_credential):
     storage_creds = azure_credential if AZURE_STORAGE_KEY is None else AZURE_STORAGE_KEY
-    blob_client = BlobServiceClient(
-        account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net",
-        credential=storage_creds)
-    blob_container_client = blob_client.get_container_client(azure_storage_container)
-    
-    return blob_container_client
+    return BlobContainerClientPool(
+        account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", credential=storage_creds
+    )
+
+
+def get_blob_container_client(azure_storage_container) -> ContainerClient:
+    # Long-lived client from the per-container pool, safe to share between concurrent requests
+    return current_app.config[CONFIG_BLOB_CONTAINER_CLIENT_POOL].get(azure_storage_container)
+
+
+def get_citation_cache() -> Optional[CitationCache]:
+    # None unless CITATION_CACHE_DIR is configured
+    return current_app.config.get(CONFIG_CITATION_CACHE)
 
 
-def get_search_client(azure_search_index):
+def get_answer_cache() -> Optional[AnswerCache]:
+    # None unless USE_ANSWER_CACHE is enabled
+    return current_app.config.get(CONFIG_ANSWER_CACHE)
 
-    azure_credential = DefaultAzureCredential(exclude_shared_token_cache_credential = True)
+
+async def bump_answer_cache_generation(azure_search_index):
+    # Called after the index content changed, so answers cached for the old corpus are not served again
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        try:
+            await answer_cache.bump_generation(azure_search_index)
+        except Exception:
+            logging.exception(f"Failed to bump answer cache generation of {azure_search_index}")
+
+
+def create_search_client_pool(azure_credential):
     search_creds = azure_credential if AZURE_SEARCH_KEY is None else AzureKeyCredential(AZURE_SEARCH_KEY)
-    # Set up clients for Cognitive Search and Storage
-    search_client = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=azure_search_index,
-        credential=search_creds)
-    
-    return search_client
+    return SearchClientPool(endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net", credential=search_creds)
+
+
+def get_search_client(azure_search_index) -> SearchClient:
+    # Long-lived client from the per-index pool, safe to share between concurrent requests
+    return current_app.config[CONFIG_SEARCH_CLIENT_POOL].get(azure_search_index)
 
 
 def is_valid_file_name(file_path):
@@ -172,49 +151,27 @@ def is_valid_file_name(file_path):
         logging.error(f"Error validating file name '{file_path}': {e}")
         return False
     
-async def remove_index_blob(search_client, blob_container, filename):
-    try:
-        if filename:
-            # remove index
-            while True:
-                if filename.startswith("http"):
-                    print(f"Processing URL-based filename: {filename}")
-
-                else:
-                    if is_valid_file_name(filename):
-                        filename = os.path.basename(filename)
-                filter = None if filename is None else f"sourcefile eq '{filename}'"
-                r = await search_client.search("", filter=filter, top=1000, include_total_count=True)
-                doc_to_delete = [{ "id": d["id"] } async for d in r]
-                r_count = await r.get_count()
-                if r_count== 0:
-                    break
-                await search_client.delete_documents(documents=doc_to_delete)
-                await asyncio.sleep(2)
-            
-            # remove blob
-            if filename.startswith("http"):
-                print(f"Skipping blob removal for URL-based filename: {filename}")
-            else:
-                if is_valid_file_name(filename):
-                    prefix = os.path.splitext(os.path.basename(filename))[0]
-                    blob_names = [b async for b in blob_container.list_blob_names(name_starts_with=os.path.splitext(os.path.basename(prefix))[0]) if re.match(f"{prefix}-\d+\.pdf", b)]
-                    for b in blob_names:
-                        await blob_container.delete_blob(b)
-    except Exception as e:
-        # Handle exceptions here, e.g., log the error or perform specific actions.
-        print(f"An error occurred: {e}")
-
-
-def get_config_chat_approaches(azure_search_index):
-    # Get the stored chat approach instance
+def delist_file_name(filename):
+    # The name the file was indexed under, its "sourcefile"
+    if filename.startswith("http") or not is_valid_file_name(filename):
+        return filename
+    return os.path.basename(filename)
+
+async def remove_index_blobs(search_client, blob_container, filenames, on_file_removed: Optional[FileDelisted] = None):
+    # Removes all the files from the index & container in bulk, see BulkDelister
+    delister = BulkDelister(
+        search_client,
+        blob_container,
+        max_concurrency=int(os.getenv("DELIST_MAX_CONCURRENCY") or 4),
+        citation_cache=get_citation_cache(),
+    )
+    return await delister.delist([delist_file_name(filename) for filename in filenames if filename], on_file_removed)
+
+
+def get_config_chat_approaches():
+    # Get the stored chat approach instance, the search client for the service is passed per call
     chat_approach = current_app.config.get(CONFIG_CHAT_APPROACH)
     if not chat_approach:
         raise ValueError("Chat approach is not initialized in current_app.config")
 
-    # Update the search client dynamically
-    chat_approach.search_client = get_search_client(azure_search_index)
-
-    print(f"rrr:{chat_approach}")
-    
-    return {"rrr": chat_approach}
\ No newline at end of file
+    return {"rrr": chat_approach}
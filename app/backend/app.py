@@ -1,22 +1,17 @@
+import asyncio
 import dataclasses
 import io
 import json
 import logging
 import mimetypes
 import os
+import re
 import time
 import base64
 import shutil
 from pathlib import Path
 from typing import Any, AsyncGenerator, Dict, Union, cast
 
-from azure.cognitiveservices.speech import (
-    ResultReason,
-    SpeechConfig,
-    SpeechSynthesisOutputFormat,
-    SpeechSynthesisResult,
-    SpeechSynthesizer,
-)
 from azure.core.exceptions import ResourceNotFoundError
 from azure.identity.aio import (
     AzureDeveloperCliCredential,
@@ -26,7 +21,6 @@ from azure.identity.aio import (
 from azure.monitor.opentelemetry import configure_azure_monitor
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.aio import SearchIndexClient
-from azure.storage.blob.aio import ContainerClient
 from azure.storage.blob.aio import StorageStreamDownloader as BlobDownloader
 from azure.storage.filedatalake.aio import FileSystemClient
 from azure.storage.filedatalake.aio import StorageStreamDownloader as DatalakeDownloader
@@ -45,48 +39,62 @@ from quart import (
     jsonify,
     make_response,
     request,
-    send_file,
     send_from_directory,
 )
 from quart_cors import cors
-from azure.data.tables import TableServiceClient
+from werkzeug.exceptions import RequestEntityTooLarge
+from azure.data.tables.aio import TableServiceClient
 from azure.core.credentials import AzureNamedKeyCredential
 from approaches.approach import Approach
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
+from approaches.historycompactor import HistoryCompactor
 from approaches.promptmanager import PromptyManager
+from approaches.queryrewritepolicy import QueryRewritePolicy
 from approaches.retrievethenread import RetrieveThenReadApproach
 from approaches.retrievethenreadvision import RetrieveThenReadVisionApproach
 from chat_history.cosmosdb import chat_history_cosmosdb_bp
 from config import (
     CONFIG_ASK_APPROACH,
+    CONFIG_ANSWER_CACHE,
     CONFIG_ASK_VISION_APPROACH,
     CONFIG_AUTH_CLIENT,
     CONFIG_BLOB_CONTAINER_CLIENT,
+    CONFIG_BLOB_CONTAINER_CLIENT_POOL,
     CONFIG_CHAT_APPROACH,
     CONFIG_CHAT_HISTORY_BROWSER_ENABLED,
     CONFIG_CHAT_HISTORY_COSMOS_ENABLED,
     CONFIG_CHAT_VISION_APPROACH,
+    CONFIG_CITATION_CACHE,
     CONFIG_CREDENTIAL,
+    CONFIG_EMBEDDING_CACHE,
+    CONFIG_HISTORY_COMPACTOR,
     CONFIG_GPT4V_DEPLOYED,
     CONFIG_INGESTER,
+    CONFIG_INGESTION_JOBS,
     CONFIG_LANGUAGE_PICKER_ENABLED,
     CONFIG_OPENAI_CLIENT,
+    CONFIG_PDF_CONVERSION_POOL,
     CONFIG_SEARCH_CLIENT,
+    CONFIG_SEARCH_CLIENT_POOL,
     CONFIG_SEMANTIC_RANKER_DEPLOYED,
+    CONFIG_SERVICE_REGISTRY,
     CONFIG_SPEECH_INPUT_ENABLED,
     CONFIG_SPEECH_OUTPUT_AZURE_ENABLED,
+    CONFIG_SPEECH_AUDIO_CACHE,
     CONFIG_SPEECH_OUTPUT_BROWSER_ENABLED,
     CONFIG_SPEECH_SERVICE_ID,
     CONFIG_SPEECH_SERVICE_LOCATION,
     CONFIG_SPEECH_SERVICE_TOKEN,
     CONFIG_SPEECH_SERVICE_VOICE,
+    CONFIG_SPEECH_SYNTHESIS_POOL,
     CONFIG_USER_BLOB_CONTAINER_CLIENT,
     CONFIG_USER_UPLOAD_ENABLED,
     CONFIG_VECTOR_SEARCH_ENABLED,
 )
 from core.authentication import AuthenticationHelper
-from core.sessionhelper import create_session_id
+from core.embeddingcache import EmbeddingCache
+from core.speechsynthesis import AudioCache, SpeechSynthesisPool
 from decorators import authenticated, authenticated_path
 from error import error_dict, error_response
 from prepdocs import (
@@ -97,20 +105,53 @@ from prepdocs import (
 )
 from prepdocslib.filestrategy import UploadUserFileStrategy
 from prepdocslib.listfilestrategy import File
-from admin.doc_processor import prepdocs_processor
+from admin.doc_processor import native_file_extensions, prepdocs_processor
+from admin.upload_stream import (
+    UploadError,
+    append_upload_chunk,
+    create_upload_session,
+    safe_file_name,
+    save_multipart_upload,
+    upload_request_class,
+    upload_session_dir,
+    uploaded_file_sizes,
+)
+from admin.ingestion_jobs import (
+    FILE_FAILED,
+    FILE_PENDING,
+    FILE_PROCESSED,
+    FILE_SKIPPED,
+    IngestionJob,
+    IngestionJobQueue,
+    JobProgress,
+)
+from admin.answer_cache import AnswerCache
+from admin.blob_content import blob_content_response
+from admin.chatlog_writer import ChatLogWriter
+from admin.citation_cache import CitationCache
+from admin.pdf_conversion import PdfConversionPool
+from admin.service_registry import ServiceRegistry
 from admin.utilils_helper import (
     get_service_accessories, 
+    get_service_overrides,
+    get_fan_out_search_client,
     generate_pdf_async,
     get_blob_container_client,
+    get_answer_cache,
+    bump_answer_cache_generation,
+    get_citation_cache,
     get_search_client,
-    remove_index_blob,
+    create_search_client_pool,
+    create_blob_container_client_pool,
+    delist_file_name,
+    remove_index_blobs,
     get_config_chat_approaches,
     load_environment_variables,
-    load_table_environment_variables
-
 )
 from admin.table_storage import (
-    upsert_chatlog_entity,
+    enqueue_chatlog_entity,
+    bump_index_generation,
+    get_index_generation,
     update_is_deleted,
     upsert_feedback_entity,
     upsert_api_configuration,
@@ -119,7 +160,14 @@ from admin.table_storage import (
     upsert_prompt_entity,
     get_prompt_entity,
     get_feedback_entries,
-    get_chatlogs
+    get_feedback_entry,
+    export_feedback_entries,
+    get_chatlogs,
+    setup_table_clients,
+    CHATLOG_TABLE,
+    INGESTION_JOB_TABLE,
+    CONFIG_CHATLOG_WRITER,
+    CONFIG_TABLE_CLIENTS,
 )
 import tempfile
 
@@ -127,6 +175,16 @@ CONFIG_TABLE_SERVICE_CLIENT = 'table_service_client'
 CONFIG_OPENAI_CLIENT = "openai_client"
 
 bp = Blueprint("routes", __name__, static_folder="static")
+
+# Quart's default body limit, still applied to every route that reads its whole body into memory
+DEFAULT_MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+UPLOAD_CHUNK_PATH = re.compile(r"/process/uploads/[^/]+/[^/]+")
+PROCESS_MAX_FILE_BYTES = int(os.getenv("PROCESS_MAX_FILE_MB") or 512) * 1024 * 1024
+PROCESS_MAX_UPLOAD_BYTES = int(os.getenv("PROCESS_MAX_UPLOAD_MB") or 2048) * 1024 * 1024
+UPLOADS_DIR_NAME = "uploads"
+UPLOAD_SESSION_TTL_SECONDS = 24 * 60 * 60
+# Uploads in these formats are converted to PDF when the ingestion parsers cannot read them
+PDF_CONVERTIBLE_EXTENSIONS = (".txt", ".docx")
 # Fix Windows registry issue with mimetypes
 mimetypes.add_type("application/javascript", ".js")
 mimetypes.add_type("text/css", ".css")
@@ -271,43 +329,6 @@ async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str,
 #         return error_response(error, "/chat")
 
 
-@bp.route("/chat/stream", methods=["POST"])
-@authenticated
-async def chat_stream(auth_claims: Dict[str, Any]):
-    if not request.is_json:
-        return jsonify({"error": "request must be json"}), 415
-    request_json = await request.get_json()
-    context = request_json.get("context", {})
-    context["auth_claims"] = auth_claims
-    try:
-        use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
-        approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
-        else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH])
-
-        # If session state is provided, persists the session state,
-        # else creates a new session_id depending on the chat history options enabled.
-        session_state = request_json.get("session_state")
-        if session_state is None:
-            session_state = create_session_id(
-                current_app.config[CONFIG_CHAT_HISTORY_COSMOS_ENABLED],
-                current_app.config[CONFIG_CHAT_HISTORY_BROWSER_ENABLED],
-            )
-        result = await approach.run_stream(
-            request_json["messages"],
-            context=context,
-            session_state=session_state,
-        )
-        response = await make_response(format_as_ndjson(result))
-        response.timeout = None  # type: ignore
-        response.mimetype = "application/json-lines"
-        return response
-    except Exception as error:
-        return error_response(error, "/chat")
-
-
 # Send MSAL.js settings to the client UI
 @bp.route("/auth_setup", methods=["GET"])
 def auth_setup():
@@ -338,40 +359,46 @@ async def speech():
     if not request.is_json:
         return jsonify({"error": "request must be json"}), 415
 
-    speech_token = current_app.config.get(CONFIG_SPEECH_SERVICE_TOKEN)
-    if speech_token is None or speech_token.expires_on < time.time() + 60:
-        speech_token = await current_app.config[CONFIG_CREDENTIAL].get_token(
-            "https://cognitiveservices.azure.com/.default"
-        )
-        current_app.config[CONFIG_SPEECH_SERVICE_TOKEN] = speech_token
-
     request_json = await request.get_json()
     text = request_json["text"]
     try:
+        voice = current_app.config[CONFIG_SPEECH_SERVICE_VOICE]
+        speech_pool: SpeechSynthesisPool = current_app.config[CONFIG_SPEECH_SYNTHESIS_POOL]
+        audio_cache: AudioCache = current_app.config.get(CONFIG_SPEECH_AUDIO_CACHE)
+        # The UI replays the same answers, so synthesized audio is cached
+        cache_key = AudioCache.make_key(voice, speech_pool.output_format.name, text)
+        if audio_cache and (audio := await audio_cache.get(cache_key)) is not None:
+            return audio, 200, {"Content-Type": "audio/mp3"}
+
+        speech_token = current_app.config.get(CONFIG_SPEECH_SERVICE_TOKEN)
+        if speech_token is None or speech_token.expires_on < time.time() + 60:
+            speech_token = await current_app.config[CONFIG_CREDENTIAL].get_token(
+                "https://cognitiveservices.azure.com/.default"
+            )
+            current_app.config[CONFIG_SPEECH_SERVICE_TOKEN] = speech_token
+
         # Construct a token as described in documentation:
         # https://learn.microsoft.com/azure/ai-services/speech-service/how-to-configure-azure-ad-auth?pivots=programming-language-python
-        auth_token = (
+        speech_pool.auth_token = (
             "aad#"
             + current_app.config[CONFIG_SPEECH_SERVICE_ID]
             + "#"
             + current_app.config[CONFIG_SPEECH_SERVICE_TOKEN].token
         )
-        speech_config = SpeechConfig(auth_token=auth_token, region=current_app.config[CONFIG_SPEECH_SERVICE_LOCATION])
-        speech_config.speech_synthesis_voice_name = current_app.config[CONFIG_SPEECH_SERVICE_VOICE]
-        speech_config.speech_synthesis_output_format = SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3
-        synthesizer = SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-        result: SpeechSynthesisResult = synthesizer.speak_text_async(text).get()
-        if result.reason == ResultReason.SynthesizingAudioCompleted:
-            return result.audio_data, 200, {"Content-Type": "audio/mp3"}
-        elif result.reason == ResultReason.Canceled:
-            cancellation_details = result.cancellation_details
-            current_app.logger.error(
-                "Speech synthesis canceled: %s %s", cancellation_details.reason, cancellation_details.error_details
-            )
-            raise Exception("Speech synthesis canceled. Check logs for details.")
-        else:
-            current_app.logger.error("Unexpected result reason: %s", result.reason)
-            raise Exception("Speech synthesis failed. Check logs for details.")
+        chunks = await speech_pool.synthesize(voice, text)
+
+        async def stream_audio() -> AsyncGenerator[bytes, None]:
+            audio = bytearray()
+            async for chunk in chunks:
+                audio += chunk
+                yield chunk
+            if audio_cache:
+                await audio_cache.put(cache_key, bytes(audio))
+
+        response = await make_response(stream_audio())
+        response.timeout = None  # type: ignore
+        response.mimetype = "audio/mp3"
+        return response
     except Exception as e:
         current_app.logger.exception("Exception in /speech")
         return jsonify({"error": str(e)}), 500
@@ -394,21 +421,65 @@ async def content_file(service, file_name):
             file_parts = file_name.rsplit("#page=", 1)
             file_name = file_parts[0]
 
-        blob_container_client = get_blob_container_client(azure_storage_container)
-        blob = await blob_container_client.get_blob_client(file_name).download_blob()
-        if not blob.properties or not blob.properties.has_key("content_settings"):
-            abort(404)
-        mime_type = blob.properties["content_settings"]["content_type"]
-        if mime_type == "application/octet-stream":
-            mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
-        blob_file = io.BytesIO()
-        await blob.readinto(blob_file)
-        blob_file.seek(0)
-        return await send_file(blob_file, mimetype=mime_type, as_attachment=False, attachment_filename=file_name)
+        blob_client = get_blob_container_client(azure_storage_container).get_blob_client(file_name)
+        response = await blob_content_response(blob_client, file_name, get_citation_cache())
+        if response is None:
+            return jsonify({"error": "file not found"}), 404
+        return response
     except Exception as e:
         logging.exception(f"Exception in /content: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    
+
+@bp.route('/citation_cache_stats', methods=['GET'])
+async def citation_cache_stats():
+    citation_cache = get_citation_cache()
+    if citation_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **citation_cache.stats()})
+
+@bp.route('/answer_cache_stats', methods=['GET'])
+async def answer_cache_stats():
+    answer_cache = get_answer_cache()
+    if answer_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **answer_cache.stats()})
+
+@bp.route('/embedding_cache_stats', methods=['GET'])
+async def embedding_cache_stats():
+    embedding_cache = current_app.config.get(CONFIG_EMBEDDING_CACHE)
+    if embedding_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **embedding_cache.stats()})
+
+@bp.route('/history_compaction_stats', methods=['GET'])
+async def history_compaction_stats():
+    history_compactor = current_app.config.get(CONFIG_HISTORY_COMPACTOR)
+    if history_compactor is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **history_compactor.stats()})
+
+@bp.route('/query_rewrite_stats', methods=['GET'])
+async def query_rewrite_stats():
+    return jsonify(current_app.config[CONFIG_CHAT_APPROACH].query_rewrite_policy.stats())
+
+@bp.route('/speech_cache_stats', methods=['GET'])
+async def speech_cache_stats():
+    audio_cache = current_app.config.get(CONFIG_SPEECH_AUDIO_CACHE)
+    if audio_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **audio_cache.stats()})
+
+@bp.route('/pdf_conversion_stats', methods=['GET'])
+async def pdf_conversion_stats():
+    return jsonify(current_app.config[CONFIG_PDF_CONVERSION_POOL].stats())
+
+@bp.route('/auth_cache_stats', methods=['GET'])
+async def auth_cache_stats():
+    auth_helper = current_app.config[CONFIG_AUTH_CLIENT]
+    if not auth_helper.use_authentication:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "claims": auth_helper.claims_cache.stats(), "groups": auth_helper.groups_cache.stats()})
+
 @bp.route('/store_feedback', methods=['POST'])
 async def store_feedback():
     if not request.is_json:
@@ -442,6 +513,7 @@ async def store_api_configuration():
     try:
         # Insert prompt entity into the storage
         result = await upsert_api_configuration(key, value)
+        await current_app.config[CONFIG_SERVICE_REGISTRY].invalidate()
         return jsonify(result), 201
     except Exception as e:
         logging.exception(f"Exception in /store_api_configuration: {str(e)}")
@@ -466,6 +538,7 @@ async def delete_api_configurations():
             return jsonify({"error": "Missing 'key' parameter in the request."})
 
         result = await delete_api_configuration(key)
+        await current_app.config[CONFIG_SERVICE_REGISTRY].invalidate()
         return '', 204
     
     except Exception as e:
@@ -486,6 +559,7 @@ async def store_prompt():
     try:
         # Insert prompt entity into the storage
         result = await upsert_prompt_entity(service, user_intent_classifier_prompt, document_rag_prompt, sql_agent_prompt)
+        current_app.config[CONFIG_SERVICE_REGISTRY].invalidate_prompt(service)
         return jsonify(result), 201
     except Exception as e:
         logging.exception(f"Exception in /store_prompt: {str(e)}")
@@ -523,12 +597,52 @@ async def get_feedback():
     except Exception as e:
         logging.exception(f"Exception in /get_feedback: {str(e)}")
         return jsonify({"error": str(e)}), 500
+
+@bp.route('/get_feedback_entry', methods=['POST'])
+async def get_feedback_entry_route():
+    if not request.is_json:
+        return jsonify({"error": "request must be json"}), 415
+    request_json = await request.get_json()
+    service = request_json.get('service')
+    row_key = request_json.get('row_key')
+    if not service or not row_key:
+        return jsonify({"error": "Please provide a service and a row_key"}), 400
+
+    try:
+        # Full entry with its chat history, for an entry picked from the /get_feedback summaries
+        feedback = await get_feedback_entry(service, row_key)
+        if feedback is None:
+            return jsonify({"error": "Unknown feedback entry"}), 404
+        return jsonify(feedback), 200
+
+    except Exception as e:
+        logging.exception(f"Exception in /get_feedback_entry: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/export_feedback', methods=['POST'])
+async def export_feedback():
+    if not request.is_json:
+        return jsonify({"error": "request must be json"}), 415
+    search_criteria = await request.get_json()
+
+    try:
+        # All matching entries as JSON lines, streamed page by page
+        response = await make_response(export_feedback_entries(search_criteria))
+        response.timeout = None  # type: ignore
+        response.mimetype = "application/json-lines"
+        return response
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception(f"Exception in /export_feedback: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     
 @bp.route('/get_services', methods=['GET'])
 async def get_services():
     try:
-        # Fetch services and parse JSON
-        services = json.loads(os.getenv('SERVICES', '[]').replace('\\', ''))
+        # Services are parsed once by the registry and refreshed in the background
+        services = current_app.config[CONFIG_SERVICE_REGISTRY].services
         return jsonify(services)
 
     except Exception as e:
@@ -577,18 +691,39 @@ async def delist_files():
         blob_container = get_blob_container_client(azure_storage_container)
         search_client = get_search_client(azure_search_index)
             
+        row_keys_by_file = {}
         for row_key, file in zip(row_keys, files):
-            # remove file from index & container
-            await remove_index_blob(search_client, blob_container, file)
+            row_keys_by_file.setdefault(delist_file_name(file), []).append(row_key)
+
+        async def on_file_removed(result):
+            if result.error is None:
+                # update the entries
+                await asyncio.gather(*(update_is_deleted(service, row_key) for row_key in row_keys_by_file[result.file]))
+            logging.info("Delisted %s: %s", result.file, result)
 
-            # update the entry
-            await update_is_deleted(service, row_key)
-        return jsonify({"response": "Files delisted successfully"}), 200
+        # remove the files from index & container in one go
+        try:
+            results = await remove_index_blobs(search_client, blob_container, list(row_keys_by_file), on_file_removed)
+        finally:
+            await bump_answer_cache_generation(azure_search_index)
+        failed = [result for result in results if result.error is not None]
+        return jsonify({"response": "Files delisted successfully" if not failed else "Some files could not be delisted",
+                        "files": [dataclasses.asdict(result) for result in results]}), 200 if not failed else 500
 
     except Exception as e:
         logging.exception(f"Exception in /delist_files: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def is_streaming_upload(method, path, headers) -> bool:
+    # Only the streaming upload routes may go past the default body size, other bodies are read into memory
+    if method == "POST" and path == "/process":
+        return headers.get("Content-Type", "").startswith("multipart/form-data")
+    return method == "PUT" and UPLOAD_CHUNK_PATH.fullmatch(path) is not None
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+async def request_entity_too_large(e):
+    return jsonify({"error": "Request body too large"}), 413
+
 @bp.route('/process', methods=['POST'])
 async def process():
     try:
@@ -597,12 +732,26 @@ async def process():
         temp_files_dir = tempfile.mkdtemp(dir=data_dir)
 
         # Retrieve data from the request
-        data = await request.get_json()
+        file_names: list[str] = []
+        data: dict[str, Any]
+        if request.mimetype == "multipart/form-data":
+            # Files are streamed to the temporary directory part by part instead of being read into memory
+            try:
+                data, file_names = await save_multipart_upload(
+                    temp_files_dir, PROCESS_MAX_FILE_BYTES, PROCESS_MAX_UPLOAD_BYTES
+                )
+            except UploadError as e:
+                shutil.rmtree(temp_files_dir, ignore_errors=True)
+                return jsonify({"error": e.error}), e.status_code
+        else:
+            data = await request.get_json()
         service = data.get("service")
         uploaded_files = data.get("files")
+        upload_id = data.get("upload_id")
         url = data.get("url")
-        max_depth = data.get("max_depth", 2)
-        if not service or (not uploaded_files and not url):
+        max_depth = int(data.get("max_depth", 2))
+        if not service or (not uploaded_files and not file_names and not upload_id and not url):
+            shutil.rmtree(temp_files_dir, ignore_errors=True)
             return jsonify({"error": "Please provide a service and either files or a URL"}), 400
         
         # Get index, blob & prompt
@@ -611,48 +760,152 @@ async def process():
         if service_accessories:
             azure_search_index, azure_storage_container, _, use_external_source = service_accessories
             if use_external_source:
+                shutil.rmtree(temp_files_dir, ignore_errors=True)
                 return jsonify({"error": "Unauthorized access! Use different service"}), 400
         else:
+            shutil.rmtree(temp_files_dir, ignore_errors=True)
             return jsonify({"error": "Unknown service"}), 400    
 
         try:
             # Save the uploaded files to the temporary directory
             if uploaded_files:
                 for uploaded_file in uploaded_files:
-                    file_path = os.path.join(temp_files_dir, uploaded_file["name"])
+                    file_name = safe_file_name(uploaded_file["name"])
+                    file_path = os.path.join(temp_files_dir, file_name)
                     with open(file_path, "wb") as f:
                         f.write(base64.b64decode(uploaded_file["data"]))
+                    file_names.append(file_name)
+            if upload_id:
+                # Files sent in chunks to /process/uploads are moved into the job's directory
+                session_dir = upload_session_dir(os.path.join(data_dir, UPLOADS_DIR_NAME), upload_id)
+                for file_name in os.listdir(session_dir):
+                    os.replace(os.path.join(session_dir, file_name), os.path.join(temp_files_dir, file_name))
+                    file_names.append(file_name)
+                shutil.rmtree(session_dir, ignore_errors=True)
+
+            # Ingestion runs as a background job, the client polls /process/<job_id> for progress
+            job = await current_app.config[CONFIG_INGESTION_JOBS].submit(
+                service, azure_storage_container, azure_search_index, temp_files_dir, file_names, url, max_depth
+            )
+            return jsonify({"message": "Files queued for processing",
+                            "job_id": job.job_id,
+                            "status_url": f"/process/{job.job_id}"}), 202
 
-                    if file_path.lower().endswith(('.txt', '.docx')):
-                        # Convert non-PDF files to PDF
-                        success, result = await generate_pdf_async(file_path, temp_files_dir)
-
-                        if success:
-                            os.remove(file_path)
-                
-            # Run the prepdocs_processor asynchronously 
-           
-            processed_files = await prepdocs_processor(temp_files_dir, azure_storage_container, azure_search_index, max_depth, url)
-            
-            for processed_file in processed_files:
-                # if processed_file[1]: #TODO: only save entry for successfully files - rollback unsuccesful files from storage
-                file_entry = {"file": processed_file[0]}
-                await upsert_chatlog_entity(service, "adminApp", "process", file_entry, 0)
-
-            # Clean up and respond with success
-            shutil.rmtree(temp_files_dir)
-            return jsonify({"message": "Files processed successfully",
-                            "processed_files": processed_files["processed_files"]})
-
+        except UploadError as e:
+            shutil.rmtree(temp_files_dir, ignore_errors=True)
+            return jsonify({"error": e.error}), e.status_code
         except Exception as e:
+            shutil.rmtree(temp_files_dir, ignore_errors=True)
             # Handle exceptions that occur during file processing
             return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
 
+    except RequestEntityTooLarge:
+        shutil.rmtree(temp_files_dir, ignore_errors=True)
+        return jsonify({"error": "Request body too large"}), 413
     except Exception as e:
         logging.exception(f"Exception in /process: {str(e)}")
         # Handle other exceptions (e.g., JSON parsing, temporary directory creation)
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+@bp.route('/process/uploads', methods=['POST'])
+async def create_upload():
+    # Resumable uploads: files are sent in chunks to /process/uploads/<upload_id>/<file_name>,
+    # then the upload is processed with {"service": ..., "upload_id": ...} on /process
+    uploads_dir = os.path.join(os.path.abspath('./data'), UPLOADS_DIR_NAME)
+    upload_id = create_upload_session(uploads_dir, UPLOAD_SESSION_TTL_SECONDS)
+    return jsonify({"upload_id": upload_id, "max_file_bytes": PROCESS_MAX_FILE_BYTES}), 201
+
+@bp.route('/process/uploads/<upload_id>', methods=['GET'])
+async def upload_status(upload_id):
+    try:
+        session_dir = upload_session_dir(os.path.join(os.path.abspath('./data'), UPLOADS_DIR_NAME), upload_id)
+    except UploadError as e:
+        return jsonify({"error": e.error}), e.status_code
+    return jsonify({"upload_id": upload_id, "files": uploaded_file_sizes(session_dir)})
+
+@bp.route('/process/uploads/<upload_id>/<file_name>', methods=['PUT'])
+async def upload_chunk(upload_id, file_name):
+    try:
+        session_dir = upload_session_dir(os.path.join(os.path.abspath('./data'), UPLOADS_DIR_NAME), upload_id)
+        received, total = await append_upload_chunk(session_dir, file_name, PROCESS_MAX_FILE_BYTES)
+    except UploadError as e:
+        response: dict[str, Any] = {"error": e.error}
+        if e.status_code == 409:
+            # Tells the client where to resume
+            response["offset"] = uploaded_file_sizes(session_dir).get(safe_file_name(file_name), 0)
+        return jsonify(response), e.status_code
+    return jsonify({"file": file_name, "offset": received, "complete": total is not None and received == total})
+
+@bp.route('/process/<job_id>', methods=['GET'])
+async def process_status(job_id):
+    job = await current_app.config[CONFIG_INGESTION_JOBS].get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.summary())
+
+async def run_ingestion_job(job: IngestionJob, progress: JobProgress):
+    files_dir = job.files_dir
+    # FileStrategy reports the name it ingested, converted uploads are ingested under their PDF name
+    upload_names = {}
+    conversions = []
+    native_extensions = native_file_extensions()
+    for name, file_progress in job.files.items():
+        if name == job.url:
+            continue
+        converted_name = os.path.splitext(name)[0] + ".pdf"
+        if file_progress["status"] != FILE_PENDING:
+            # Ingested before the job was resumed
+            for done_name in {name, converted_name}:
+                if os.path.exists(os.path.join(files_dir, done_name)):
+                    os.remove(os.path.join(files_dir, done_name))
+            continue
+        upload_names[name] = name
+        file_path = os.path.join(files_dir, name)
+        extension = os.path.splitext(name)[1].lower()
+        # Only formats without a parser of their own are converted
+        if extension in PDF_CONVERTIBLE_EXTENSIONS and extension not in native_extensions:
+            upload_names[converted_name] = name
+            if os.path.exists(file_path):
+                conversions.append(file_path)
+
+    # The whole batch is converted in parallel on the PDF conversion workers
+    results = await asyncio.gather(*(generate_pdf_async(file_path, files_dir) for file_path in conversions))
+    for file_path, (success, result) in zip(conversions, results):
+        if success:
+            os.remove(file_path)
+        else:
+            logging.warning("Could not convert %s to PDF: %s", file_path, result)
+    url = job.url if job.url and job.files.get(job.url, {}).get("status") == FILE_PENDING else None
+
+    async def on_file_processed(filename, success, error):
+        await progress(upload_names.get(filename, filename), FILE_PROCESSED if success else FILE_FAILED, error)
+        # if success: #TODO: only save entry for successfully files - rollback unsuccesful files from storage
+        await enqueue_chatlog_entity(job.service, "adminApp", "process", {"file": filename}, 0)
+
+    try:
+        try:
+            await prepdocs_processor(
+                files_dir,
+                job.container,
+                job.index,
+                job.max_depth,
+                url,
+                azure_credential=current_app.config[CONFIG_CREDENTIAL],
+                on_file_processed=on_file_processed,
+            )
+        finally:
+            # Even a partial run changes the index, cached answers must not outlive it
+            await bump_answer_cache_generation(job.index)
+    except Exception:
+        shutil.rmtree(files_dir, ignore_errors=True)
+        raise
+
+    # FileStrategy skips files it has no parser for
+    for name, file_progress in list(job.files.items()):
+        if file_progress["status"] == FILE_PENDING:
+            await progress(name, FILE_SKIPPED, "No parser for this file type")
+    shutil.rmtree(files_dir, ignore_errors=True)
+
 @bp.route("/chat", methods=["POST"])
 async def chat():
     if not request.is_json:
@@ -676,21 +929,116 @@ async def chat():
             return jsonify({"error": "Unauthorized access! Use general chat"}), 400
     else:
         return jsonify({"error": "Unknown service"}), 400
+    # Questions spanning services search every listed service's index, the prompt and container stay the service's
+    services = request_json.get('services') or []
+    search_client = get_search_client(azure_search_index)
+    if services:
+        search_client = await get_fan_out_search_client(service, services)
+        if search_client is None:
+            return jsonify({"error": "Unknown service"}), 400
     try:
-        impl = get_config_chat_approaches(azure_search_index).get(approach)
+        impl = get_config_chat_approaches().get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        r = await impl.run_without_streaming(request_json["chat_history"], request_json.get("overrides", {}), azure_storage_container, service_prompt, user_info)
-        print(r)
+        # Overrides sent with the request win over the service's defaults
+        overrides = get_service_overrides(service) | request_json.get("overrides", {})
+        # First-turn questions can be answered from the semantic answer cache without search or completion calls
+        answer_cache = get_answer_cache()
+        answer_cache_slot = None
+        r = None
+        if answer_cache is not None and len(chat_history) == 1 and not services:
+            question = chat_history[-1]["content"]
+            question_vector = (await impl.compute_text_embedding(question)).vector
+            prompt_version = AnswerCache.make_prompt_version(
+                service_prompt, overrides, impl.build_filter(overrides, user_info or {})
+            )
+            r, answer_cache_slot = await answer_cache.lookup(
+                service, azure_search_index, prompt_version, question, question_vector
+            )
+        if r is None:
+            r = await impl.run_without_streaming(
+                request_json["chat_history"],
+                overrides,
+                azure_storage_container,
+                service_prompt,
+                user_info,
+                search_client=search_client,
+            )
+            if answer_cache_slot is not None:
+                answer_cache.store(answer_cache_slot, r)
         chat_entry = [{"user": chat_history[-1]["content"]}, {"bot": {"bot": r['answer']}}]
-        # Strore chat logs
-        await upsert_chatlog_entity(service, user_name, api_function, chat_entry, is_deleted)
+        # Store chat logs in the background, the answer doesn't wait for storage
+        await enqueue_chatlog_entity(service, user_name, api_function, chat_entry, is_deleted)
         
         return jsonify(r)
     except Exception as e:
         logging.exception(f"Exception in /chat: {str(e)}")
         return jsonify({"error": str(e)}), 500 
 
+
+async def log_chat_stream(
+    r: AsyncGenerator[dict, None], service, user_name, user_query, is_deleted
+) -> AsyncGenerator[dict, None]:
+    answer = None
+    async for event in r:
+        answer = event.get("context", {}).get("answer", answer)
+        yield event
+    # Only a completed stream is logged, the final event carries the whole answer
+    if answer is not None:
+        chat_entry = [{"user": user_query}, {"bot": {"bot": answer}}]
+        await enqueue_chatlog_entity(service, user_name, 'chat', chat_entry, is_deleted)
+
+
+@bp.route("/chat/stream", methods=["POST"])
+async def chat_stream():
+    if not request.is_json:
+        return jsonify({"error": "request must be json"}), 415
+    request_json = await request.get_json()
+    approach = request_json["approach"]
+    optional_prompt = request_json.get("optional_prompt")
+    service = request_json.get('service', {})
+    user_name = request_json.get('user_name')
+    user_info = request_json.get('user_info')
+    chat_history = request_json.get('chat_history')
+    is_deleted = request_json.get('is_deleted', 0)
+
+    # Get index, blob & prompt
+    service_accessories = await get_service_accessories(service)
+    if service_accessories:
+        azure_search_index, azure_storage_container, service_prompt, use_external_source = service_accessories
+        service_prompt = optional_prompt if optional_prompt else service_prompt
+        if use_external_source:
+            return jsonify({"error": "Unauthorized access! Use general chat"}), 400
+    else:
+        return jsonify({"error": "Unknown service"}), 400
+    services = request_json.get('services') or []
+    search_client = get_search_client(azure_search_index)
+    if services:
+        search_client = await get_fan_out_search_client(service, services)
+        if search_client is None:
+            return jsonify({"error": "Unknown service"}), 400
+    try:
+        impl = get_config_chat_approaches().get(approach)
+        if not impl:
+            return jsonify({"error": "unknown approach"}), 400
+        result = impl.run_with_streaming(
+            chat_history,
+            get_service_overrides(service) | request_json.get("overrides", {}),
+            azure_storage_container,
+            service_prompt,
+            user_info,
+            search_client=search_client,
+        )
+        response = await make_response(
+            format_as_ndjson(log_chat_stream(result, service, user_name, chat_history[-1]["content"], is_deleted))
+        )
+        response.timeout = None  # type: ignore
+        response.mimetype = "application/json-lines"
+        return response
+    except Exception as e:
+        logging.exception(f"Exception in /chat/stream: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @bp.post("/upload")
 @authenticated
 async def upload(auth_claims: dict[str, Any]):
@@ -750,14 +1098,11 @@ async def list_uploaded(auth_claims: dict[str, Any]):
             current_app.logger.exception("Error listing uploaded files", error)
     return jsonify(files), 200
 
-@bp.before_request
-async def ensure_openai_token_and_other_config():
-    # load environment variable from app config and azure table - TODO: Optimize these
-    await load_environment_variables()
-    await load_table_environment_variables()
-
 @bp.before_app_serving
 async def setup_clients():
+    # Load the .env file once per worker, the SERVICES setting is read from it by the service registry
+    await load_environment_variables()
+
     # Replace these with your own values, either in environment variables or directly here
     AZURE_STORAGE_ACCOUNT = os.environ["AZURE_STORAGE_ACCOUNT"]
     AZURE_STORAGE_CONTAINER = os.environ["AZURE_STORAGE_CONTAINER"]
@@ -815,14 +1160,20 @@ async def setup_clients():
     USE_SPEECH_OUTPUT_AZURE = os.getenv("USE_SPEECH_OUTPUT_AZURE", "").lower() == "true"
     USE_CHAT_HISTORY_BROWSER = os.getenv("USE_CHAT_HISTORY_BROWSER", "").lower() == "true"
     USE_CHAT_HISTORY_COSMOS = os.getenv("USE_CHAT_HISTORY_COSMOS", "").lower() == "true"
+    USE_SPECULATIVE_RETRIEVAL = os.getenv("USE_SPECULATIVE_RETRIEVAL", "").lower() == "true"
+    # Token budget for the sources of a chat answer, 0 keeps the fixed "top" number of sources
+    CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET") or 0)
+    CHAT_CONTEXT_CANDIDATES = int(os.getenv("CHAT_CONTEXT_CANDIDATES") or 20)
+    CHAT_HISTORY_TOKEN_RESERVE = int(os.getenv("CHAT_HISTORY_TOKEN_RESERVE") or 1024)
+    # Chat histories past this many tokens are compacted into a running summary and the newest turns, 0 disables it
+    CHAT_HISTORY_COMPACTION_TOKENS = int(os.getenv("CHAT_HISTORY_COMPACTION_TOKENS") or 0)
+    CHAT_HISTORY_RECENT_TOKENS = int(os.getenv("CHAT_HISTORY_RECENT_TOKENS") or CHAT_HISTORY_COMPACTION_TOKENS // 2)
+    CHAT_QUERY_HISTORY_TOKENS = int(os.getenv("CHAT_QUERY_HISTORY_TOKENS") or 500)
+    # "first_turn" or "auto" search for questions that stand on their own without the query rewrite completion
+    CHAT_QUERY_REWRITE = os.getenv("CHAT_QUERY_REWRITE") or "always"
 
     # WEBSITE_HOSTNAME is always set by App Service, RUNNING_IN_PRODUCTION is set in main.bicep
     RUNNING_ON_AZURE = os.getenv("WEBSITE_HOSTNAME") is not None or os.getenv("RUNNING_IN_PRODUCTION") is not None
-    storage_creds = azure_credential if os.environ["AZURE_STORAGE_KEY"] is None else os.environ["AZURE_STORAGE_KEY"]
-    tbl_credential = AzureNamedKeyCredential(f"{AZURE_STORAGE_ACCOUNT}", storage_creds)
-    table_service_client = TableServiceClient(
-        endpoint=f"https://{AZURE_STORAGE_ACCOUNT}.table.core.windows.net", 
-        credential=tbl_credential)
 
     # Use the current user identity for keyless authentication to Azure services.
     # This assumes you use 'azd auth login' locally, and managed identity when deployed on Azure.
@@ -851,7 +1202,70 @@ async def setup_clients():
 
     # Set the Azure credential in the app config for use in other parts of the app
     current_app.config[CONFIG_CREDENTIAL] = azure_credential
+
+    storage_creds = azure_credential if os.environ["AZURE_STORAGE_KEY"] is None else os.environ["AZURE_STORAGE_KEY"]
+    tbl_credential = AzureNamedKeyCredential(f"{AZURE_STORAGE_ACCOUNT}", storage_creds)
+    table_service_client = TableServiceClient(
+        endpoint=f"https://{AZURE_STORAGE_ACCOUNT}.table.core.windows.net", 
+        credential=tbl_credential)
     current_app.config[CONFIG_TABLE_SERVICE_CLIENT] = table_service_client
+    # Tables are created here once instead of on every storage call
+    current_app.config[CONFIG_TABLE_CLIENTS] = await setup_table_clients(table_service_client)
+    chatlog_writer = ChatLogWriter(
+        table_client=current_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE],
+        max_queue_size=int(os.getenv("CHATLOG_QUEUE_SIZE") or 10000),
+        flush_interval=float(os.getenv("CHATLOG_FLUSH_SECONDS") or 2),
+    )
+    chatlog_writer.start()
+    current_app.config[CONFIG_CHATLOG_WRITER] = chatlog_writer
+
+    # /process ingestion runs in background jobs, persisted so a restarted worker can resume them
+    ingestion_jobs = IngestionJobQueue(
+        table_client=current_app.config[CONFIG_TABLE_CLIENTS][INGESTION_JOB_TABLE],
+        runner=run_ingestion_job,
+        workers_per_service=int(os.getenv("INGESTION_WORKERS_PER_SERVICE") or 1),
+        lease_seconds=float(os.getenv("INGESTION_JOB_LEASE_SECONDS") or 300),
+        app=current_app._get_current_object(),
+    )
+    ingestion_jobs.start()
+    current_app.config[CONFIG_INGESTION_JOBS] = ingestion_jobs
+
+    # Warm LibreOffice workers, each with its own profile, convert uploads to PDF for ingestion
+    pdf_conversion_pool = PdfConversionPool(
+        workers=int(os.getenv("PDF_CONVERSION_WORKERS") or 2),
+        timeout=float(os.getenv("PDF_CONVERSION_TIMEOUT_SECONDS") or 120),
+        profiles_dir=os.getenv("PDF_CONVERSION_PROFILES_DIR"),
+    )
+    pdf_conversion_pool.start()
+    current_app.config[CONFIG_PDF_CONVERSION_POOL] = pdf_conversion_pool
+
+    # Semantic cache of first-turn /chat answers, generations per index are shared through table storage
+    current_app.config[CONFIG_ANSWER_CACHE] = (
+        AnswerCache(
+            generation_loader=get_index_generation,
+            generation_bumper=bump_index_generation,
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.97")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 60 * 60))),
+        )
+        if os.getenv("USE_ANSWER_CACHE", "").lower() == "true"
+        else None
+    )
+
+    # Parse SERVICES once, then keep it fresh in the background instead of re-reading it on every request
+    service_registry = ServiceRegistry(
+        config_loader=get_api_configuration,
+        prompt_loader=get_prompt_entity,
+        refresh_interval=float(os.getenv("SERVICE_REGISTRY_REFRESH_SECONDS") or 300),
+    )
+    await service_registry.refresh()
+    service_registry.start()
+    current_app.config[CONFIG_SERVICE_REGISTRY] = service_registry
+
+    # One long-lived SearchClient per service index, sharing the credential and connection pool
+    search_client_pool = create_search_client_pool(azure_credential)
+    for service_info in service_registry.services:
+        search_client_pool.get(service_info.get("index", AZURE_SEARCH_INDEX))
+    current_app.config[CONFIG_SEARCH_CLIENT_POOL] = search_client_pool
 
     # Set up clients for AI Search and Storage
     search_client = SearchClient(
@@ -860,8 +1274,19 @@ async def setup_clients():
         credential=azure_credential,
     )
 
-    blob_container_client = ContainerClient(
-        f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", AZURE_STORAGE_CONTAINER, credential=azure_credential
+    # One long-lived ContainerClient per container, shared by /content, /delist_files and the vision approaches
+    blob_container_client_pool = create_blob_container_client_pool(azure_credential)
+    for service_info in service_registry.services:
+        blob_container_client_pool.get(service_info.get("blob", AZURE_STORAGE_CONTAINER))
+    current_app.config[CONFIG_BLOB_CONTAINER_CLIENT_POOL] = blob_container_client_pool
+    blob_container_client = blob_container_client_pool.get(AZURE_STORAGE_CONTAINER)
+
+    # Optional local disk cache for the citation documents served by /content
+    citation_cache_dir = os.getenv("CITATION_CACHE_DIR")
+    current_app.config[CONFIG_CITATION_CACHE] = (
+        CitationCache(citation_cache_dir, max_bytes=int(os.getenv("CITATION_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+        if citation_cache_dir
+        else None
     )
 
     # Set up authentication helper
@@ -942,6 +1367,21 @@ async def setup_clients():
         current_app.config[CONFIG_SPEECH_SERVICE_VOICE] = AZURE_SPEECH_SERVICE_VOICE
         # Wait until token is needed to fetch for the first time
         current_app.config[CONFIG_SPEECH_SERVICE_TOKEN] = None
+        # Synthesis runs on a bounded thread pool, the Speech SDK blocks until the audio is complete
+        current_app.config[CONFIG_SPEECH_SYNTHESIS_POOL] = SpeechSynthesisPool(
+            AZURE_SPEECH_SERVICE_LOCATION, max_workers=int(os.getenv("SPEECH_SYNTHESIS_WORKERS", "4"))
+        )
+        # Synthesized audio is cached in memory, and on disk if SPEECH_CACHE_DIR is set
+        speech_cache_max_mb = int(os.getenv("SPEECH_CACHE_MAX_MB", "64"))
+        current_app.config[CONFIG_SPEECH_AUDIO_CACHE] = (
+            AudioCache(
+                speech_cache_max_mb * 1024 * 1024,
+                directory=os.getenv("SPEECH_CACHE_DIR"),
+                max_disk_bytes=int(os.getenv("SPEECH_CACHE_DISK_MAX_MB", "1024")) * 1024 * 1024,
+            )
+            if speech_cache_max_mb > 0
+            else None
+        )
 
     if OPENAI_HOST.startswith("azure"):
         if OPENAI_HOST == "azure_custom":
@@ -1000,6 +1440,31 @@ async def setup_clients():
 
     prompt_manager = PromptyManager()
 
+    # Query embeddings are cached in memory, and in a SQLite file shared by the workers if EMBEDDING_CACHE_PATH is set
+    embedding_cache_max_mb = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "64"))
+    embedding_cache = (
+        EmbeddingCache(embedding_cache_max_mb * 1024 * 1024, sqlite_path=os.getenv("EMBEDDING_CACHE_PATH"))
+        if embedding_cache_max_mb > 0
+        else None
+    )
+    current_app.config[CONFIG_EMBEDDING_CACHE] = embedding_cache
+
+    history_compactor = (
+        HistoryCompactor(
+            openai_client=openai_client,
+            chatgpt_model=OPENAI_CHATGPT_MODEL,
+            chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+            prompt_manager=prompt_manager,
+            token_threshold=CHAT_HISTORY_COMPACTION_TOKENS,
+            recent_tokens=CHAT_HISTORY_RECENT_TOKENS,
+            query_token_limit=CHAT_QUERY_HISTORY_TOKENS,
+            default_to_cl100k=ChatReadRetrieveReadApproach.ALLOW_NON_GPT_MODELS,
+        )
+        if CHAT_HISTORY_COMPACTION_TOKENS > 0
+        else None
+    )
+    current_app.config[CONFIG_HISTORY_COMPACTOR] = history_compactor
+
     # Set up the two default RAG approaches for /ask and /chat
     # RetrieveThenReadApproach is used by /ask for single-turn Q&A
     current_app.config[CONFIG_ASK_APPROACH] = RetrieveThenReadApproach(
@@ -1016,6 +1481,7 @@ async def setup_clients():
         query_language=AZURE_SEARCH_QUERY_LANGUAGE,
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
         prompt_manager=prompt_manager,
+        embedding_cache=embedding_cache,
     )
 
     # ChatReadRetrieveReadApproach is used by /chat for multi-turn conversation
@@ -1033,6 +1499,13 @@ async def setup_clients():
         query_language=AZURE_SEARCH_QUERY_LANGUAGE,
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
         prompt_manager=prompt_manager,
+        embedding_cache=embedding_cache,
+        speculative_retrieval=USE_SPECULATIVE_RETRIEVAL,
+        context_token_budget=CHAT_CONTEXT_TOKEN_BUDGET,
+        context_candidates=CHAT_CONTEXT_CANDIDATES,
+        history_token_reserve=CHAT_HISTORY_TOKEN_RESERVE,
+        history_compactor=history_compactor,
+        query_rewrite_policy=QueryRewritePolicy(CHAT_QUERY_REWRITE),
     )
 
     if USE_GPT4V:
@@ -1084,16 +1557,41 @@ async def setup_clients():
 
 @bp.after_app_serving
 async def close_clients():
+    await current_app.config[CONFIG_INGESTION_JOBS].stop()
+    await current_app.config[CONFIG_PDF_CONVERSION_POOL].stop()
+    await current_app.config[CONFIG_SERVICE_REGISTRY].stop()
     await current_app.config[CONFIG_SEARCH_CLIENT].close()
-    await current_app.config[CONFIG_BLOB_CONTAINER_CLIENT].close()
+    await current_app.config[CONFIG_SEARCH_CLIENT_POOL].close()
+    # Also closes the default CONFIG_BLOB_CONTAINER_CLIENT, which comes from the pool
+    await current_app.config[CONFIG_BLOB_CONTAINER_CLIENT_POOL].close()
+    if current_app.config.get(CONFIG_CITATION_CACHE):
+        current_app.logger.info("Citation cache stats: %s", current_app.config[CONFIG_CITATION_CACHE].stats())
+    if current_app.config.get(CONFIG_EMBEDDING_CACHE):
+        current_app.logger.info("Embedding cache stats: %s", current_app.config[CONFIG_EMBEDDING_CACHE].stats())
+        current_app.config[CONFIG_EMBEDDING_CACHE].close()
+    if current_app.config.get(CONFIG_HISTORY_COMPACTOR):
+        current_app.logger.info("History compaction stats: %s", current_app.config[CONFIG_HISTORY_COMPACTOR].stats())
+        await current_app.config[CONFIG_HISTORY_COMPACTOR].stop()
+    if current_app.config.get(CONFIG_SPEECH_AUDIO_CACHE):
+        current_app.logger.info("Speech audio cache stats: %s", current_app.config[CONFIG_SPEECH_AUDIO_CACHE].stats())
+    if current_app.config.get(CONFIG_SPEECH_SYNTHESIS_POOL):
+        current_app.config[CONFIG_SPEECH_SYNTHESIS_POOL].close()
     if current_app.config.get(CONFIG_USER_BLOB_CONTAINER_CLIENT):
         await current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT].close()
+    # Flush queued chat logs before the table clients go away
+    await current_app.config[CONFIG_CHATLOG_WRITER].stop()
+    for table_client in current_app.config[CONFIG_TABLE_CLIENTS].values():
+        await table_client.close()
+    await current_app.config[CONFIG_TABLE_SERVICE_CLIENT].close()
 
 
 def create_app():
     app = Quart(__name__)
     app.register_blueprint(bp)
     app.register_blueprint(chat_history_cosmosdb_bp)
+    # Bodies read into memory keep the default limit, streamed /process uploads get theirs per request
+    app.config["MAX_CONTENT_LENGTH"] = DEFAULT_MAX_CONTENT_LENGTH
+    app.request_class = upload_request_class(PROCESS_MAX_UPLOAD_BYTES, is_streaming_upload)
 
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
         app.logger.info("APPLICATIONINSIGHTS_CONNECTION_STRING is set, enabling Azure Monitor")
@@ -1119,6 +1617,6 @@ def create_app():
         allowed_origins = allowed_origin.split(";")
         if len(allowed_origins) > 0:
             app.logger.info("CORS enabled for %s", allowed_origins)
-            cors(app, allow_origin=allowed_origins, allow_methods=["GET", "POST"])
+            cors(app, allow_origin=allowed_origins, allow_methods=["GET", "POST", "PUT"])
 
     return app
@@ -9,6 +9,7 @@ from typing import (
     List,
     Optional,
     TypedDict,
+    Union,
     cast,
 )
 from urllib.parse import urljoin
@@ -24,8 +25,10 @@ from azure.search.documents.models import (
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 
+from approaches.fanoutsearch import FanOutSearchClient
 from approaches.promptmanager import PromptManager
 from core.authentication import AuthenticationHelper
+from core.embeddingcache import EmbeddingCache
 
 
 @dataclass
@@ -42,6 +45,8 @@ class Document:
     captions: List[QueryCaptionResult]
     score: Optional[float] = None
     reranker_score: Optional[float] = None
+    # Rank of a hit merged from several indexes, their own scores can not be compared
+    fused_score: Optional[float] = None
 
     def serialize_for_results(self) -> dict[str, Any]:
         return {
@@ -68,6 +73,7 @@ class Document:
             ),
             "score": self.score,
             "reranker_score": self.reranker_score,
+            **({"fused_score": self.fused_score} if self.fused_score is not None else {}),
         }
 
     @classmethod
@@ -96,6 +102,14 @@ class Approach(ABC):
     # Useful for using local small language models, for example
     ALLOW_NON_GPT_MODELS = True
 
+    # Shared query-embedding cache, set by approaches that are given one
+    embedding_cache: Optional[EmbeddingCache] = None
+
+    # Fields requested for each search hit. Vectors are only requested with the "include_embeddings" override,
+    # for debugging: nothing else reads them and an embedding is ~30 KB of JSON per hit
+    search_select_fields = ["id", "content", "category", "sourcepage", "sourcefile"]
+    embedding_select_fields = ["embedding"]
+
     def __init__(
         self,
         search_client: SearchClient,
@@ -110,6 +124,7 @@ class Approach(ABC):
         vision_endpoint: str,
         vision_token_provider: Callable[[], Awaitable[str]],
         prompt_manager: PromptManager,
+        embedding_cache: Optional[EmbeddingCache] = None,
     ):
         self.search_client = search_client
         self.openai_client = openai_client
@@ -123,6 +138,7 @@ class Approach(ABC):
         self.vision_endpoint = vision_endpoint
         self.vision_token_provider = vision_token_provider
         self.prompt_manager = prompt_manager
+        self.embedding_cache = embedding_cache
 
     def build_filter(self, overrides: dict[str, Any], auth_claims: dict[str, Any]) -> Optional[str]:
         include_category = overrides.get("include_category")
@@ -137,6 +153,15 @@ class Approach(ABC):
             filters.append(security_filter)
         return None if len(filters) == 0 else " and ".join(filters)
 
+    def search_select(self, include_embeddings: bool = False) -> List[str]:
+        select = list(self.search_select_fields)
+        # oids and groups only exist in indexes set up for access control
+        if self.auth_helper is not None and self.auth_helper.has_auth_fields:
+            select += ["oids", "groups"]
+        if include_embeddings:
+            select += self.embedding_select_fields
+        return select
+
     async def search(
         self,
         top: int,
@@ -149,14 +174,20 @@ class Approach(ABC):
         use_semantic_captions: bool,
         minimum_search_score: Optional[float],
         minimum_reranker_score: Optional[float],
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
+        include_embeddings: bool = False,
     ) -> List[Document]:
+        # Callers serving several indexes pass the client for the request, otherwise use the default one
+        search_client = search_client or self.search_client
         search_text = query_text if use_text_search else ""
         search_vectors = vectors if use_vector_search else []
+        select = self.search_select(include_embeddings)
         if use_semantic_ranker:
-            results = await self.search_client.search(
+            results = await search_client.search(
                 search_text=search_text,
                 filter=filter,
                 top=top,
+                select=select,
                 query_caption="extractive|highlight-false" if use_semantic_captions else None,
                 vector_queries=search_vectors,
                 query_type=QueryType.SEMANTIC,
@@ -166,10 +197,11 @@ class Approach(ABC):
                 semantic_query=query_text,
             )
         else:
-            results = await self.search_client.search(
+            results = await search_client.search(
                 search_text=search_text,
                 filter=filter,
                 top=top,
+                select=select,
                 vector_queries=search_vectors,
             )
 
@@ -190,6 +222,7 @@ class Approach(ABC):
                         captions=cast(List[QueryCaptionResult], document.get("@search.captions")),
                         score=document.get("@search.score"),
                         reranker_score=document.get("@search.reranker_score"),
+                        fused_score=document.get("@search.fused_score"),
                     )
                 )
 
@@ -215,8 +248,7 @@ class Approach(ABC):
             return [
                 {
                     "filename": self.get_citation((doc.sourcepage or ""), use_image_citation),
-                    "content": nonewlines(" . ".join([cast(str, c.text) for c in (doc.captions or [])]))
-                  
+                    "content": nonewlines(" . ".join([cast(str, c.text) for c in (doc.captions or [])])),
                 }
                 for doc in results
             ]
@@ -224,7 +256,7 @@ class Approach(ABC):
             return [
                 {
                     "filename": self.get_citation((doc.sourcepage or ""), use_image_citation),
-                    "content": nonewlines(doc.content or "")
+                    "content": nonewlines(doc.content or ""),
                 }
                 for doc in results
             ]
@@ -254,6 +286,14 @@ class Approach(ABC):
         dimensions_args: ExtraArgs = (
             {"dimensions": self.embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else {}
         )
+        cache_key = None
+        if self.embedding_cache is not None:
+            cache_key = EmbeddingCache.make_key(
+                self.embedding_model, self.embedding_deployment, dimensions_args.get("dimensions"), q
+            )
+            if (cached_vector := await self.embedding_cache.get(cache_key)) is not None:
+                return VectorizedQuery(vector=cached_vector, k_nearest_neighbors=50, fields="embedding")
+
         embedding = await self.openai_client.embeddings.create(
             # Azure OpenAI takes the deployment name as the model name
             model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
@@ -261,6 +301,8 @@ class Approach(ABC):
             **dimensions_args,
         )
         query_vector = embedding.data[0].embedding
+        if self.embedding_cache is not None and cache_key is not None:
+            await self.embedding_cache.put(cache_key, query_vector)
         return VectorizedQuery(vector=query_vector, k_nearest_neighbors=50, fields="embedding")
 
     async def compute_image_embedding(self, q: str):
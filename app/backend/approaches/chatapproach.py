@@ -1,11 +1,13 @@
 import json
 import re
 from abc import ABC, abstractmethod
-from typing import Any, AsyncGenerator, Optional
+from typing import Any, AsyncGenerator, Optional, Union
 
+from azure.search.documents.aio import SearchClient
 from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
 
 from approaches.approach import Approach
+from approaches.fanoutsearch import FanOutSearchClient
 import os 
 
 class ChatApproach(Approach, ABC):
@@ -13,7 +15,7 @@ class ChatApproach(Approach, ABC):
     NO_RESPONSE = "0"
 
     @abstractmethod
-    async def run_until_final_call(self, messages, overrides, auth_claims, azure_storage_container, service_prompt, should_stream) -> tuple:
+    async def run_until_final_call(self, messages, overrides, auth_claims, azure_storage_container, service_prompt, should_stream, search_client=None) -> tuple:
         pass
 
     def get_search_query(self, chat_completion: ChatCompletion, user_query: str):
@@ -47,37 +49,46 @@ class ChatApproach(Approach, ABC):
         service_prompt: str, 
         auth_claims: dict[str, Any],
         session_state: Any = None,
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
     ) -> dict[str, Any]:
         extra_info, chat_coroutine = await self.run_until_final_call(
             messages, overrides, auth_claims, azure_storage_container,
-        service_prompt, should_stream=False
+        service_prompt, should_stream=False, search_client=search_client
         )
         chat_completion_response: ChatCompletion = await chat_coroutine
-        content = chat_completion_response.choices[0].message.content
-        reference_file_names = [item['filename'] for item in extra_info['data_points']]
-         # Remove FAQs Extract references from the chat content
-        chat_content = re.sub(r'\[[^\]]*FAQs[^\]]*\]', '', content)
-        references = list(set(re.findall(r'\[([^\]]+)\]', chat_content)))
+        content = chat_completion_response.choices[0].message.content or ""
+        chat_content, references = self.extract_references(content)
         # # Update extra_info with data_points and the original chat answer
         extra_info = {"data_points": references, "answer": chat_content}
         
         return extra_info
 
+    def extract_references(self, content: str) -> tuple[str, list[str]]:
+        # Remove FAQs Extract references from the chat content
+        chat_content = re.sub(r'\[[^\]]*FAQs[^\]]*\]', '', content)
+        references = list(set(re.findall(r'\[([^\]]+)\]', chat_content)))
+        return chat_content, references
 
     async def run_with_streaming(
         self,
         messages: list[ChatCompletionMessageParam],
         overrides: dict[str, Any],
+        azure_storage_container,
+        service_prompt: str,
         auth_claims: dict[str, Any],
         session_state: Any = None,
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
     ) -> AsyncGenerator[dict, None]:
-        extra_info, chat_coroutine = await self.run_until_final_call(
-            messages, overrides, auth_claims, should_stream=True
+        _, chat_coroutine = await self.run_until_final_call(
+            messages, overrides, auth_claims, azure_storage_container,
+            service_prompt, should_stream=True, search_client=search_client
         )
-        yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
+        # First event goes out as soon as the completion stream is open, references follow once the answer is complete
+        yield {"delta": {"role": "assistant"}, "session_state": session_state}
 
         followup_questions_started = False
         followup_content = ""
+        answer_content = ""
         async for event_chunk in await chat_coroutine:
             # "2023-07-01-preview" API version has a bug where first response has empty choices
             event = event_chunk.model_dump()  # Convert pydantic model to dict
@@ -96,15 +107,21 @@ class ChatApproach(Approach, ABC):
                     earlier_content = content[: content.index("<<")]
                     if earlier_content:
                         completion["delta"]["content"] = earlier_content
+                        answer_content += earlier_content
                         yield completion
                     followup_content += content[content.index("<<") :]
                 elif followup_questions_started:
                     followup_content += content
                 else:
+                    answer_content += content
                     yield completion
+
+        chat_content, references = self.extract_references(answer_content)
+        final_context: dict[str, Any] = {"data_points": references, "answer": chat_content}
         if followup_content:
             _, followup_questions = self.extract_followup_questions(followup_content)
-            yield {"delta": {"role": "assistant"}, "context": {"followup_questions": followup_questions}}
+            final_context["followup_questions"] = followup_questions
+        yield {"delta": {"role": "assistant"}, "context": final_context}
 
     async def run(
         self,
@@ -114,7 +131,14 @@ class ChatApproach(Approach, ABC):
     ) -> dict[str, Any]:
         overrides = context.get("overrides", {})
         auth_claims = context.get("auth_claims", {})
-        return await self.run_without_streaming(messages, overrides, auth_claims, session_state)
+        return await self.run_without_streaming(
+            messages,
+            overrides,
+            context.get("azure_storage_container"),
+            context.get("service_prompt", ""),
+            auth_claims,
+            session_state,
+        )
 
     async def run_stream(
         self,
@@ -124,4 +148,11 @@ class ChatApproach(Approach, ABC):
     ) -> AsyncGenerator[dict[str, Any], None]:
         overrides = context.get("overrides", {})
         auth_claims = context.get("auth_claims", {})
-        return self.run_with_streaming(messages, overrides, auth_claims, session_state)
+        return self.run_with_streaming(
+            messages,
+            overrides,
+            context.get("azure_storage_container"),
+            context.get("service_prompt", ""),
+            auth_claims,
+            session_state,
+        )
@@ -1,7 +1,11 @@
+import asyncio
+import logging
+import math
+import re
 from typing import Any, Coroutine, List, Literal, Optional, Union, overload
 
 from azure.search.documents.aio import SearchClient
-from azure.search.documents.models import VectorQuery
+from azure.search.documents.models import VectorizedQuery, VectorQuery
 from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import (
     ChatCompletion,
@@ -9,12 +13,21 @@ from openai.types.chat import (
     ChatCompletionMessageParam,
     ChatCompletionToolParam,
 )
-from openai_messages_token_helper import build_messages, get_token_limit
+from openai_messages_token_helper import (
+    build_messages,
+    count_tokens_for_message,
+    get_token_limit,
+)
 
 from approaches.approach import ThoughtStep
 from approaches.chatapproach import ChatApproach
-from approaches.promptmanager import PromptManager
+from approaches.contextpacker import ContextPacker
+from approaches.fanoutsearch import FanOutSearchClient
+from approaches.historycompactor import HistoryCompactor
+from approaches.queryrewritepolicy import QueryRewritePolicy
+from approaches.promptmanager import PromptManager, RenderedPrompt
 from core.authentication import AuthenticationHelper
+from core.embeddingcache import EmbeddingCache
 import os
 
 
@@ -40,7 +53,15 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         content_field: str,
         query_language: str,
         query_speller: str,
-        prompt_manager: PromptManager
+        prompt_manager: PromptManager,
+        speculative_retrieval: bool = False,
+        speculative_similarity_threshold: float = 0.95,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        context_token_budget: int = 0,
+        context_candidates: int = 20,
+        history_token_reserve: int = 1024,
+        history_compactor: Optional[HistoryCompactor] = None,
+        query_rewrite_policy: Optional[QueryRewritePolicy] = None,
     ):
         self.search_client = search_client
         self.openai_client = openai_client
@@ -59,6 +80,64 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         self.query_rewrite_prompt = self.prompt_manager.load_prompt("chat_query_rewrite.prompty")
         self.query_rewrite_tools = self.prompt_manager.load_tools("chat_query_rewrite_tools.json")
         self.answer_prompt = self.prompt_manager.load_prompt("chat_answer_question.prompty")
+        self.embedding_cache = embedding_cache
+        self.speculative_retrieval = speculative_retrieval
+        self.speculative_similarity_threshold = speculative_similarity_threshold
+        self.speculation_attempts = 0
+        self.speculation_hits = 0
+        # With a token budget, sources are packed from `context_candidates` results instead of taking the `top` ones
+        self.context_token_budget = context_token_budget
+        self.context_candidates = context_candidates
+        self.history_token_reserve = history_token_reserve
+        self.context_packer = ContextPacker(chatgpt_model, default_to_cl100k=self.ALLOW_NON_GPT_MODELS)
+        self.history_compactor = history_compactor
+        self.query_rewrite_policy = query_rewrite_policy or QueryRewritePolicy()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(re.findall(r"\w+", query.lower()))
+
+    @staticmethod
+    def cosine_similarity(a: list[float], b: list[float]) -> float:
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
+
+    async def retrieve(
+        self,
+        query_text: str,
+        vectors: Optional[list[VectorQuery]],
+        top: int,
+        filter: Optional[str],
+        use_text_search: bool,
+        use_vector_search: bool,
+        use_semantic_ranker: bool,
+        use_semantic_captions: bool,
+        minimum_search_score: Optional[float],
+        minimum_reranker_score: Optional[float],
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
+        include_embeddings: bool = False,
+    ):
+        # If retrieval mode includes vectors, compute an embedding for the query unless the caller already has one
+        if vectors is None:
+            vectors = []
+            if use_vector_search:
+                vectors.append(await self.compute_text_embedding(query_text))
+
+        results = await self.search(
+            top,
+            query_text,
+            filter,
+            vectors,
+            use_text_search,
+            use_vector_search,
+            use_semantic_ranker,
+            use_semantic_captions,
+            minimum_search_score,
+            minimum_reranker_score,
+            search_client,
+            include_embeddings,
+        )
+        return vectors, results
 
     @overload
     async def run_until_final_call(
@@ -66,9 +145,10 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         messages: list[ChatCompletionMessageParam],
         overrides: dict[str, Any],
         auth_claims: dict[str, Any],
-        azure_storage_container, 
+        azure_storage_container,
         service_prompt,
         should_stream: Literal[False],
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
     ) -> tuple[dict[str, Any], Coroutine[Any, Any, ChatCompletion]]: ...
 
     @overload
@@ -77,9 +157,10 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         messages: list[ChatCompletionMessageParam],
         overrides: dict[str, Any],
         auth_claims: dict[str, Any],
-        azure_storage_container, 
+        azure_storage_container,
         service_prompt,
         should_stream: Literal[True],
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
     ) -> tuple[dict[str, Any], Coroutine[Any, Any, AsyncStream[ChatCompletionChunk]]]: ...
 
     async def run_until_final_call(
@@ -90,14 +171,18 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         azure_storage_container,
         service_prompt,
         should_stream: bool = False,
+        search_client: Optional[Union[SearchClient, FanOutSearchClient]] = None,
     ) -> tuple[dict[str, Any], Coroutine[Any, Any, Union[ChatCompletion, AsyncStream[ChatCompletionChunk]]]]:
-        
+
         seed = overrides.get("seed", None)
         use_text_search = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         use_vector_search = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_ranker = True if overrides.get("semantic_ranker") else False
         use_semantic_captions = True if overrides.get("semantic_captions") else False
         top = overrides.get("top", 3)
+        context_token_budget = overrides.get("context_token_budget", self.context_token_budget)
+        if context_token_budget:
+            top = max(top, overrides.get("context_candidates", self.context_candidates))
         minimum_search_score = overrides.get("minimum_search_score", 0.0)
         minimum_reranker_score = overrides.get("minimum_reranker_score", 0.0)
         filter = self.build_filter(overrides, auth_claims)
@@ -106,59 +191,89 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         if not isinstance(original_user_query, str):
             raise ValueError("The most recent message content must be a string.")
 
-        rendered_query_prompt = self.prompt_manager.render_prompt(
-            self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": messages[:-1]}
-        )
-        tools: List[ChatCompletionToolParam] = self.query_rewrite_tools
-
-        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
-        query_response_token_limit = 100
-        query_messages = build_messages(
-            model=self.chatgpt_model,
-            system_prompt=rendered_query_prompt.system_content,
-            few_shots=rendered_query_prompt.few_shot_messages,
-            past_messages=rendered_query_prompt.past_messages,
-            new_user_content=rendered_query_prompt.new_user_content,
-            tools=tools,
-            max_tokens=self.chatgpt_token_limit - query_response_token_limit,
-            fallback_to_default=self.ALLOW_NON_GPT_MODELS,
-        )
-
-        chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
-            messages=query_messages,  # type: ignore
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
-            temperature=0.0,  # Minimize creativity for search query generation
-            max_tokens=query_response_token_limit,  # Setting too low risks malformed JSON, setting too high may affect performance
-            n=1,
-            tools=tools,
-            seed=seed,
-        )
-
-        query_text = self.get_search_query(chat_completion, original_user_query)
+        # Long histories are sent as a summary and the newest turns, the query rewrite only needs the last few
+        past_messages = query_past_messages = messages[:-1]
+        compaction: Optional[dict[str, Any]] = None
+        if self.history_compactor is not None:
+            past_messages, query_past_messages, compaction = self.history_compactor.compact(messages[:-1])
 
-        # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
-
-        # If retrieval mode includes vectors, compute an embedding for the query
-        vectors: list[VectorQuery] = []
-        if use_vector_search:
-            vectors.append(await self.compute_text_embedding(query_text))
-
-        results = await self.search(
+        retrieve_args = (
             top,
-            query_text,
             filter,
-            vectors,
             use_text_search,
             use_vector_search,
             use_semantic_ranker,
             use_semantic_captions,
             minimum_search_score,
             minimum_reranker_score,
+            search_client,
+            bool(overrides.get("include_embeddings")),
+        )
+
+        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question,
+        # unless the question can be searched for as it is
+        bypass_rewrite, rewrite_reason = self.query_rewrite_policy.decide(
+            original_user_query, len(messages) > 1, overrides.get("query_rewrite")
         )
+        query_messages: Optional[list[ChatCompletionMessageParam]] = None
+        speculative_task: Optional[asyncio.Task] = None
+        if bypass_rewrite:
+            # Retrieved for right away, which is what a speculative retrieval would have started early
+            query_text = original_user_query
+        else:
+            rendered_query_prompt = self.prompt_manager.render_prompt(
+                self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": query_past_messages}
+            )
+            tools: List[ChatCompletionToolParam] = self.query_rewrite_tools
+            query_response_token_limit = 100
+            query_messages = build_messages(
+                model=self.chatgpt_model,
+                system_prompt=rendered_query_prompt.system_content,
+                few_shots=rendered_query_prompt.few_shot_messages,
+                past_messages=rendered_query_prompt.past_messages,
+                new_user_content=rendered_query_prompt.new_user_content,
+                tools=tools,
+                max_tokens=self.chatgpt_token_limit - query_response_token_limit,
+                fallback_to_default=self.ALLOW_NON_GPT_MODELS,
+            )
+
+            # On the first turn the rewritten query is usually the question itself, so retrieve for the raw question
+            # while the rewrite is in flight and keep those results if the rewrite turns out to be equivalent
+            if overrides.get("speculative_retrieval", self.speculative_retrieval) and len(messages) == 1:
+                speculative_task = asyncio.create_task(self.retrieve(original_user_query, None, *retrieve_args))
+
+            try:
+                chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
+                    messages=query_messages,  # type: ignore
+                    # Azure OpenAI takes the deployment name as the model name
+                    model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
+                    temperature=0.0,  # Minimize creativity for search query generation
+                    max_tokens=query_response_token_limit,  # Setting too low risks malformed JSON, setting too high may affect performance
+                    n=1,
+                    tools=tools,
+                    seed=seed,
+                )
+            except BaseException:
+                if speculative_task is not None:
+                    speculative_task.cancel()
+                raise
+
+            query_text = self.get_search_query(chat_completion, original_user_query)
+
+        # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+        vectors: Optional[list[VectorQuery]] = None
+        results = None
+        speculation: Optional[dict[str, Any]] = None
+        if speculative_task is not None:
+            vectors, results, speculation = await self.resolve_speculation(
+                speculative_task, original_user_query, query_text, use_vector_search
+            )
+        if results is None:
+            vectors, results = await self.retrieve(query_text, vectors, *retrieve_args)
 
         # STEP 3: Generate a contextual and content specific answer using the search results and chat history
         text_sources = self.get_sources_content(results, use_semantic_captions, use_image_citation=False)
+        response_token_limit = 1024
         # rendered_answer_prompt = self.prompt_manager.render_prompt(
         #     self.answer_prompt,
         #     self.get_system_prompt_variables(overrides.get("prompt_template"))
@@ -174,18 +289,24 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         if service_prompt:
             prompt_override = service_prompt
 
+        answer_prompt_variables = self.get_system_prompt_variables(prompt_override) | {
+            "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
+            "past_messages": past_messages,
+            "user_query": original_user_query,
+        }
+        packing: Optional[dict[str, Any]] = None
+        if context_token_budget:
+            source_token_budget = self.get_source_token_budget(
+                self.prompt_manager.render_prompt(self.answer_prompt, answer_prompt_variables | {"text_sources": []}),
+                context_token_budget,
+                response_token_limit,
+            )
+            results, text_sources, packing = self.context_packer.pack(results, text_sources, source_token_budget)
+
         rendered_answer_prompt = self.prompt_manager.render_prompt(
-            self.answer_prompt,
-            self.get_system_prompt_variables(prompt_override)
-            | {
-                "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
-                "past_messages": messages[:-1],
-                "user_query": original_user_query,
-                "text_sources": text_sources,
-            },
+            self.answer_prompt, answer_prompt_variables | {"text_sources": text_sources}
         )
-        
-        response_token_limit = 1024
+
         messages = build_messages(
             model=self.chatgpt_model,
             system_prompt=rendered_answer_prompt.system_content,
@@ -196,24 +317,28 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         )
 
         datapoints = [
-        {
-            "filename": f.get("filename", "").strip(),
-            "filecontent": f.get("content", "").strip(),
-        }
-        for f in text_sources  # Iterate through JSON objects
+            {
+                "filename": f.get("filename", "").strip(),
+                "filecontent": f.get("content", "").strip(),
+            }
+            for f in text_sources  # Iterate through JSON objects
         ]
-     
+
         extra_info = {
             "data_points": datapoints,
             "thoughts": [
-                ThoughtStep(
-                    "Prompt to generate search query",
-                    query_messages,
-                    (
-                        {"model": self.chatgpt_model, "deployment": self.chatgpt_deployment}
-                        if self.chatgpt_deployment
-                        else {"model": self.chatgpt_model}
-                    ),
+                (
+                    ThoughtStep(
+                        "Prompt to generate search query",
+                        query_messages,
+                        (
+                            {"model": self.chatgpt_model, "deployment": self.chatgpt_deployment}
+                            if self.chatgpt_deployment
+                            else {"model": self.chatgpt_model}
+                        ),
+                    )
+                    if query_messages is not None
+                    else ThoughtStep("Search query rewrite skipped", {"reason": rewrite_reason})
                 ),
                 ThoughtStep(
                     "Search using generated search query",
@@ -231,6 +356,14 @@ class ChatReadRetrieveReadApproach(ChatApproach):
                     "Search results",
                     [result.serialize_for_results() for result in results],
                 ),
+                *([ThoughtStep("Speculative retrieval", speculation)] if speculation is not None else []),
+                *([ThoughtStep("Context packing", packing)] if packing is not None else []),
+                *([ThoughtStep("History compaction", compaction)] if compaction is not None else []),
+                *(
+                    [ThoughtStep("Fan-out search", search_client.last_search)]
+                    if isinstance(search_client, FanOutSearchClient)
+                    else []
+                ),
                 ThoughtStep(
                     "Prompt to generate answer",
                     messages,
@@ -254,3 +387,68 @@ class ChatReadRetrieveReadApproach(ChatApproach):
             seed=seed,
         )
         return (extra_info, chat_coroutine)
+
+    def get_source_token_budget(
+        self, rendered_prompt: RenderedPrompt, context_token_budget: int, response_token_limit: int
+    ) -> int:
+        """
+        Returns the tokens left for sources in the answer prompt: at most `context_token_budget`, after the prompt
+        itself, the answer and up to `history_token_reserve` tokens of chat history.
+        """
+        model, default_to_cl100k = self.chatgpt_model, self.ALLOW_NON_GPT_MODELS
+        prompt_tokens = count_tokens_for_message(
+            model=model,
+            message={"role": "system", "content": rendered_prompt.system_content},
+            default_to_cl100k=default_to_cl100k,
+        ) + count_tokens_for_message(
+            model=model,
+            message={"role": "user", "content": rendered_prompt.new_user_content},
+            default_to_cl100k=default_to_cl100k,
+        )
+        history_tokens = sum(
+            count_tokens_for_message(model=model, message=message, default_to_cl100k=default_to_cl100k)
+            for message in rendered_prompt.past_messages
+        )
+        available = (
+            self.chatgpt_token_limit
+            - response_token_limit
+            - prompt_tokens
+            - min(history_tokens, self.history_token_reserve)
+        )
+        return max(0, min(context_token_budget, available))
+
+    async def resolve_speculation(
+        self, speculative_task: asyncio.Task, original_user_query: str, query_text: str, use_vector_search: bool
+    ) -> tuple[Optional[list[VectorQuery]], Optional[list], dict[str, Any]]:
+        """
+        Decides whether the results retrieved for the raw question can stand in for the rewritten query.
+        Returns the vectors already computed for `query_text` (or None), the results to use (or None to search
+        again) and a summary for the thoughts.
+        """
+        self.speculation_attempts += 1
+        speculation: dict[str, Any] = {"query": original_user_query, "used": False}
+        try:
+            speculative_vectors, speculative_results = await speculative_task
+        except Exception as error:
+            logging.warning("Speculative retrieval failed, searching with the rewritten query: %s", error)
+            speculative_vectors, speculative_results = None, None
+
+        vectors: Optional[list[VectorQuery]] = None
+        if speculative_results is not None:
+            if self.normalize_query(query_text) == self.normalize_query(original_user_query):
+                speculation.update(used=True, match="normalized")
+                vectors = speculative_vectors
+            elif use_vector_search and speculative_vectors:
+                # The rewritten query needs an embedding either way, so compare it before paying for another search
+                query_vector, speculative_vector = await self.compute_text_embedding(query_text), speculative_vectors[0]
+                vectors = [query_vector]
+                if isinstance(query_vector, VectorizedQuery) and isinstance(speculative_vector, VectorizedQuery):
+                    similarity = self.cosine_similarity(query_vector.vector, speculative_vector.vector)
+                    speculation["similarity"] = round(similarity, 4)
+                    if similarity >= self.speculative_similarity_threshold:
+                        speculation.update(used=True, match="similarity")
+
+        if speculation["used"]:
+            self.speculation_hits += 1
+        speculation["hit_rate"] = round(self.speculation_hits / self.speculation_attempts, 4)
+        return vectors, speculative_results if speculation["used"] else None, speculation
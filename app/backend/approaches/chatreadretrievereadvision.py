@@ -25,6 +25,8 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
     original user question, and search results to OpenAI to generate a response.
     """
 
+    embedding_select_fields = ["embedding", "imageEmbedding"]
+
     def __init__(
         self,
         *,
@@ -151,6 +153,7 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
             use_semantic_captions,
             minimum_search_score,
             minimum_reranker_score,
+            include_embeddings=bool(overrides.get("include_embeddings")),
         )
 
         # STEP 3: Generate a contextual and content specific answer using the search results and chat history
@@ -0,0 +1,114 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any
+
+from openai_messages_token_helper.model_helper import encoding_for_model
+
+from approaches.approach import Document
+
+
+class ContextPacker:
+    """
+    Picks the sources that go into an answer prompt by token budget instead of by count.
+
+    Candidates are taken by score (the fused score of fan-out results, else the reranker score when there is
+    one), near-duplicates of an already picked source
+    are dropped, and each source is kept if it still fits the remaining budget, so a long chunk does not stop
+    shorter ones behind it from being used. Token counts are cached by source text in an LRU of `max_entries`,
+    since the same chunks come back across requests.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        default_to_cl100k: bool = False,
+        duplicate_threshold: float = 0.9,
+        max_entries: int = 10000,
+    ):
+        self.encoding = encoding_for_model(model, default_to_cl100k)
+        self.duplicate_threshold = duplicate_threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._token_counts: OrderedDict[bytes, int] = OrderedDict()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._token_counts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def count_tokens(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        if (count := self._token_counts.get(key)) is not None:
+            self._token_counts.move_to_end(key)
+            self.hits += 1
+            return count
+        self.misses += 1
+        count = len(self.encoding.encode(text))
+        self._token_counts[key] = count
+        if len(self._token_counts) > self.max_entries:
+            self._token_counts.popitem(last=False)
+        return count
+
+    @staticmethod
+    def shingles(text: str) -> set[tuple[str, ...]]:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < 3:
+            return {tuple(words)}
+        return {tuple(words[i : i + 3]) for i in range(len(words) - 2)}
+
+    def is_duplicate(self, shingles: set[tuple[str, ...]], picked: list[set[tuple[str, ...]]]) -> bool:
+        for other in picked:
+            union = len(shingles | other)
+            if union and len(shingles & other) / union >= self.duplicate_threshold:
+                return True
+        return False
+
+    def pack(
+        self, results: list[Document], text_sources: list[dict], token_budget: int
+    ) -> tuple[list[Document], list[dict], dict[str, Any]]:
+        """
+        Returns the results and their text sources that fit in `token_budget`, best first, and a summary of the
+        packing for the thoughts. `text_sources` are the prompt sources of `results`, in the same order.
+        """
+
+        def score(index: int) -> float:
+            result = results[index]
+            # Fused results keep the order of the fusion, the scores of different indexes do not compare
+            if result.fused_score is not None:
+                return result.fused_score
+            return result.reranker_score if result.reranker_score is not None else (result.score or 0.0)
+
+        picked: list[int] = []
+        picked_shingles: list[set[tuple[str, ...]]] = []
+        tokens_used = 0
+        duplicates = 0
+        over_budget = 0
+        for index in sorted(range(len(results)), key=score, reverse=True):
+            shingles = self.shingles(text_sources[index].get("content", ""))
+            if self.is_duplicate(shingles, picked_shingles):
+                duplicates += 1
+                continue
+            # Sources are rendered into the prompt as they are, so that is what gets counted
+            tokens = self.count_tokens(str(text_sources[index]))
+            if tokens_used + tokens > token_budget:
+                over_budget += 1
+                continue
+            picked.append(index)
+            picked_shingles.append(shingles)
+            tokens_used += tokens
+
+        packing = {
+            "candidates": len(results),
+            "packed": len(picked),
+            "token_budget": token_budget,
+            "tokens": tokens_used,
+            "duplicates": duplicates,
+            "over_budget": over_budget,
+        }
+        return [results[index] for index in picked], [text_sources[index] for index in picked], packing
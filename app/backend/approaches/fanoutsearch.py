@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+
+from azure.search.documents.aio import SearchClient
+
+# Rank constant of reciprocal rank fusion, the value from the original paper and what Azure AI Search uses for hybrid
+RRF_K = 60
+
+
+class FusedResults:
+    """Fused hits in the shape `Approach.search` reads search results in: one page of result dicts."""
+
+    def __init__(self, documents: list[dict[str, Any]]):
+        self.documents = documents
+
+    def by_page(self):
+        return self._pages()
+
+    async def _pages(self):
+        yield self._page()
+
+    async def _page(self):
+        for document in self.documents:
+            yield document
+
+
+def reciprocal_rank_fusion(result_lists: list[list[dict[str, Any]]], top: int, k: int = RRF_K) -> list[dict[str, Any]]:
+    """
+    Merges ranked result lists by reciprocal rank fusion, counting hits with the same sourcepage as one.
+    Each merged hit is the best ranked of its duplicates, with the fused score in "@search.fused_score".
+    """
+    fused: dict[str, tuple[float, int, dict[str, Any]]] = {}
+    for results in result_lists:
+        for rank, document in enumerate(results, start=1):
+            key = document.get("sourcepage") or document.get("id") or str(id(document))
+            score, best_rank, best = fused.get(key, (0.0, rank, document))
+            if rank < best_rank:
+                best_rank, best = rank, document
+            fused[key] = (score + 1 / (k + rank), best_rank, best)
+    ranked = sorted(fused.values(), key=lambda entry: (-entry[0], entry[1]))
+    return [{**document, "@search.fused_score": score} for score, _, document in ranked[:top]]
+
+
+class FanOutSearchClient:
+    """
+    Searches the indexes of several services at once, standing in for a single `SearchClient`.
+
+    Every index gets the same query concurrently, so a search takes as long as the slowest index, not the sum of
+    them. The hits are merged by reciprocal rank fusion, since scores of different indexes can not be compared,
+    and de-duplicated by sourcepage. An index that fails is left out of the results; the search only fails when
+    all of them do. The timings of the last search are kept in `last_search` for the thoughts.
+    """
+
+    def __init__(self, search_clients: dict[str, SearchClient]):
+        self.search_clients = search_clients
+        self.last_search: Optional[dict[str, Any]] = None
+
+    async def search(self, *, top: int, **kwargs) -> FusedResults:
+        async def search_index(service: str, search_client: SearchClient) -> tuple[list[dict[str, Any]], dict]:
+            start = time.monotonic()
+            try:
+                results = await search_client.search(top=top, **kwargs)
+                documents = [document async for page in results.by_page() async for document in page]
+            except Exception as error:
+                logging.warning("Search of the %s index failed: %s", service, error)
+                return [], {"ms": round((time.monotonic() - start) * 1000), "error": str(error)}
+            return documents, {"ms": round((time.monotonic() - start) * 1000), "results": len(documents)}
+
+        start = time.monotonic()
+        searched = await asyncio.gather(
+            *(search_index(service, search_client) for service, search_client in self.search_clients.items())
+        )
+        timings = dict(zip(self.search_clients, (timing for _, timing in searched)))
+        if all("error" in timing for timing in timings.values()):
+            raise RuntimeError(f"Search failed for every service: {timings}")
+
+        documents = reciprocal_rank_fusion([documents for documents, _ in searched], top)
+        self.last_search = {
+            "services": timings,
+            "ms": round((time.monotonic() - start) * 1000),
+            "fused_results": len(documents),
+        }
+        logging.info("Fan-out search: %s", self.last_search)
+        return FusedResults(documents)
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Optional
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageParam
+from openai_messages_token_helper import count_tokens_for_message
+
+from approaches.promptmanager import PromptManager
+
+# Rendered prompts pair past messages up as user/assistant turns, so the summary goes in as the answer to this
+SUMMARY_REQUEST = "Summarize our conversation so far."
+
+
+class HistoryCompactor:
+    """
+    Keeps the chat history sent to the model about the same size however long a conversation gets.
+
+    Once the history passes `token_threshold` tokens, its older turns are replaced by a running summary and only
+    the newest turns are kept as they are. Summaries are written by the chat model in a background task, off the
+    request path, and cached by a hash of the history prefix they cover. Each summary continues the previous one,
+    so a turn only ever summarizes the messages added since. Until a summary is ready the older turns are left
+    out, as `build_messages` would do. The cache is per process: after a restart, or on another worker, the next
+    turn starts a new summary.
+    """
+
+    def __init__(
+        self,
+        openai_client: AsyncOpenAI,
+        chatgpt_model: str,
+        chatgpt_deployment: Optional[str],
+        prompt_manager: PromptManager,
+        token_threshold: int = 2000,
+        recent_tokens: int = 1000,
+        query_token_limit: int = 500,
+        summary_max_tokens: int = 400,
+        max_entries: int = 1000,
+        default_to_cl100k: bool = False,
+    ):
+        self.openai_client = openai_client
+        self.chatgpt_model = chatgpt_model
+        self.chatgpt_deployment = chatgpt_deployment
+        self.summary_prompt = prompt_manager.load_prompt("chat_history_summary.prompty")
+        self.prompt_manager = prompt_manager
+        self.token_threshold = token_threshold
+        self.recent_tokens = min(recent_tokens, token_threshold)
+        self.query_token_limit = query_token_limit
+        self.summary_max_tokens = summary_max_tokens
+        self.max_entries = max_entries
+        self.default_to_cl100k = default_to_cl100k
+        self.hits = 0
+        self.misses = 0
+        self.summaries = 0
+        self.failures = 0
+        self._summaries: OrderedDict[bytes, str] = OrderedDict()
+        self._pending: dict[bytes, asyncio.Task] = {}
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._summaries),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "summaries": self.summaries,
+            "failures": self.failures,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def stop(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+
+    @staticmethod
+    def prefix_keys(messages: list[ChatCompletionMessageParam]) -> list[bytes]:
+        """Returns a key for each prefix of `messages`, `keys[k]` stands for `messages[:k]`."""
+        keys = [b""]
+        for message in messages:
+            text = json.dumps([message.get("role"), message.get("content")])
+            keys.append(hashlib.sha256(keys[-1] + text.encode()).digest())
+        return keys
+
+    def compact(
+        self, past_messages: list[ChatCompletionMessageParam]
+    ) -> tuple[list[ChatCompletionMessageParam], list[ChatCompletionMessageParam], Optional[dict[str, Any]]]:
+        """
+        Returns the messages to send in place of `past_messages` to the answer and to the query rewrite: the
+        newest messages that fit in `token_threshold` and in `query_token_limit`, after the summary of the ones
+        before them when there is one. The last item summarizes the compaction for the thoughts, it is None when
+        the history is sent as is.
+        """
+        counts = [
+            count_tokens_for_message(self.chatgpt_model, message, default_to_cl100k=self.default_to_cl100k)
+            for message in past_messages
+        ]
+        if sum(counts) <= self.token_threshold:
+            if sum(counts) <= self.query_token_limit:
+                return past_messages, past_messages, None
+            query_first = self.newest_messages(past_messages, counts, 0, self.query_token_limit)
+            return past_messages, past_messages[query_first:], None
+
+        keys = self.prefix_keys(past_messages)
+        start, summary = 0, None
+        for end in range(len(past_messages), 0, -1):
+            if (summary := self._summaries.get(keys[end])) is not None:
+                self._summaries.move_to_end(keys[end])
+                start = end
+                break
+        if summary is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        first = self.newest_messages(past_messages, counts, start, self.token_threshold)
+        query_first = self.newest_messages(past_messages, counts, start, self.query_token_limit)
+        # History added since the summary outgrew the threshold, summarize all but the most recent turns for later
+        if sum(counts[start:]) > self.token_threshold:
+            boundary = self.newest_messages(past_messages, counts, start, self.recent_tokens)
+            if boundary > start:
+                self.schedule(keys[boundary], summary, past_messages, counts, start, boundary)
+
+        summary_messages: list[ChatCompletionMessageParam] = []
+        if summary is not None:
+            summary_messages = [
+                {"role": "user", "content": SUMMARY_REQUEST},
+                {"role": "assistant", "content": summary},
+            ]
+        return (
+            [*summary_messages, *past_messages[first:]],
+            [*summary_messages, *past_messages[query_first:]],
+            {
+                "messages": len(past_messages),
+                "summarized": start,
+                "dropped": first - start,
+                "kept": len(past_messages) - first,
+                "tokens": sum(counts[first:]),
+            },
+        )
+
+    @staticmethod
+    def newest_messages(
+        past_messages: list[ChatCompletionMessageParam], counts: list[int], start: int, token_limit: int
+    ) -> int:
+        """Returns the index of the oldest message after `start` such that the messages from it fit in `token_limit`."""
+        first = len(past_messages)
+        tokens = 0
+        while first > start and tokens + counts[first - 1] <= token_limit:
+            first -= 1
+            tokens += counts[first]
+        # Always start at a user message, so the kept messages are still whole turns
+        while first < len(past_messages) and past_messages[first].get("role") != "user":
+            first += 1
+        return first
+
+    def schedule(
+        self,
+        key: bytes,
+        previous_summary: Optional[str],
+        past_messages: list[ChatCompletionMessageParam],
+        counts: list[int],
+        start: int,
+        end: int,
+    ):
+        if key in self._summaries or key in self._pending:
+            return
+        # Without a previous summary (a restart, another worker) only the newest part of a long history is summarized
+        first = end
+        tokens = 0
+        while first > start and tokens + counts[first - 1] <= 2 * self.token_threshold:
+            first -= 1
+            tokens += counts[first]
+        task = asyncio.create_task(self.summarize(key, previous_summary, past_messages[first:end]))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def summarize(
+        self, key: bytes, previous_summary: Optional[str], messages: list[ChatCompletionMessageParam]
+    ) -> Optional[str]:
+        rendered_prompt = self.prompt_manager.render_prompt(
+            self.summary_prompt, {"previous_summary": previous_summary, "past_messages": messages}
+        )
+        try:
+            chat_completion = await self.openai_client.chat.completions.create(
+                # Azure OpenAI takes the deployment name as the model name
+                model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
+                messages=[
+                    {"role": "system", "content": rendered_prompt.system_content},
+                    {"role": "user", "content": rendered_prompt.new_user_content},
+                ],
+                temperature=0.0,
+                max_tokens=self.summary_max_tokens,
+                n=1,
+            )
+        except Exception:
+            self.failures += 1
+            logging.exception("Failed to summarize chat history")
+            return None
+        summary = (chat_completion.choices[0].message.content or "").strip()
+        if not summary:
+            self.failures += 1
+            return None
+        self.summaries += 1
+        self._summaries[key] = summary
+        if len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+        return summary
@@ -0,0 +1,113 @@
+import re
+from collections import Counter
+from typing import Optional
+
+# Modes for the "query_rewrite" override and the CHAT_QUERY_REWRITE setting
+QUERY_REWRITE_ALWAYS = "always"
+QUERY_REWRITE_FIRST_TURN = "first_turn"
+QUERY_REWRITE_AUTO = "auto"
+QUERY_REWRITE_MODES = (QUERY_REWRITE_ALWAYS, QUERY_REWRITE_FIRST_TURN, QUERY_REWRITE_AUTO)
+
+# Words that point back at earlier turns, a question using them needs the history to be searched for
+REFERENCE_WORDS = {
+    "it",
+    "it's",
+    "its",
+    "they",
+    "them",
+    "their",
+    "theirs",
+    "this",
+    "that",
+    "these",
+    "those",
+    "he",
+    "him",
+    "his",
+    "she",
+    "her",
+    "hers",
+    "there",
+    "same",
+    "above",
+    "previous",
+    "former",
+    "latter",
+    "else",
+    "also",
+    "too",
+    "again",
+    "another",
+    "other",
+    "one",
+    "ones",
+}
+# Questions in English nearly always use one of these, the rewrite translates questions in other languages
+ENGLISH_WORDS = set(
+    "a an the is are was were do does did can could should would will what how when where which who why i my we our"
+    " you your for of to in on with about".split()
+)
+# Openings of elliptical follow-ups, like "and for dental?" or "what about part-time staff?"
+FOLLOW_UP_OPENINGS = re.compile(r"^(and|but|or|so|then|also|what about|how about|same for|and what)\b")
+
+
+class QueryRewritePolicy:
+    """
+    Decides whether a chat question can be searched as it is, without the query rewrite completion.
+
+    In "always" mode every question is rewritten. "first_turn" searches for the question itself when there is no
+    history, and "auto" also does so for follow-ups that stand on their own. A question is only searched as it is
+    if it is between `min_words` and `max_words` long (short ones are usually ellipses, long ones search better as
+    keywords), looks like English (the rewrite translates it otherwise), has no citations or follow-up markup,
+    and for follow-ups, has no pronouns or openings that refer back to earlier turns.
+
+    A bypassed question is retrieved for right away, so it never starts a speculative retrieval: that only runs
+    alongside a rewrite, for the same question the bypass would have searched for.
+    """
+
+    def __init__(self, mode: str = QUERY_REWRITE_ALWAYS, min_words: int = 3, max_words: int = 40):
+        if mode not in QUERY_REWRITE_MODES:
+            raise ValueError(f"Query rewrite mode must be one of {', '.join(QUERY_REWRITE_MODES)}, not {mode}")
+        self.mode = mode
+        self.min_words = min_words
+        self.max_words = max_words
+        self.decisions: Counter[str] = Counter()
+
+    def stats(self) -> dict[str, object]:
+        total = sum(self.decisions.values())
+        bypassed = sum(count for reason, count in self.decisions.items() if reason.startswith("bypass"))
+        return {
+            "mode": self.mode,
+            "decisions": total,
+            "bypassed": bypassed,
+            "bypass_rate": round(bypassed / total, 4) if total else 0.0,
+            **{f"reason_{reason}": count for reason, count in sorted(self.decisions.items())},
+        }
+
+    def decide(self, question: str, has_history: bool, mode: Optional[str] = None) -> tuple[bool, str]:
+        """
+        Returns whether to search for `question` as it is, and the reason, which is also counted.
+        """
+        bypass, reason = self.classify(question, has_history, mode or self.mode)
+        self.decisions[reason] += 1
+        return bypass, reason
+
+    def classify(self, question: str, has_history: bool, mode: str) -> tuple[bool, str]:
+        if mode not in QUERY_REWRITE_MODES or mode == QUERY_REWRITE_ALWAYS:
+            return False, "mode_always"
+        if has_history and mode == QUERY_REWRITE_FIRST_TURN:
+            return False, "has_history"
+        words = re.findall(r"[a-z0-9']+", question.lower())
+        if len(words) < self.min_words:
+            return False, "too_short"
+        if len(words) > self.max_words:
+            return False, "too_long"
+        if any(c.isalpha() and not c.isascii() for c in question) or not ENGLISH_WORDS.intersection(words):
+            return False, "language"
+        if "[" in question or "<<" in question:
+            return False, "markup"
+        if not has_history:
+            return True, "bypass_first_turn"
+        if FOLLOW_UP_OPENINGS.match(" ".join(words)) or any(word in REFERENCE_WORDS for word in words):
+            return False, "refers_back"
+        return True, "bypass_standalone"
@@ -9,6 +9,7 @@ from openai_messages_token_helper import get_token_limit
 from approaches.approach import Approach, ThoughtStep
 from approaches.promptmanager import PromptManager
 from core.authentication import AuthenticationHelper
+from core.embeddingcache import EmbeddingCache
 
 
 class RetrieveThenReadApproach(Approach):
@@ -34,6 +35,7 @@ class RetrieveThenReadApproach(Approach):
         query_language: str,
         query_speller: str,
         prompt_manager: PromptManager,
+        embedding_cache: Optional[EmbeddingCache] = None,
     ):
         self.search_client = search_client
         self.chatgpt_deployment = chatgpt_deployment
@@ -51,6 +53,7 @@ class RetrieveThenReadApproach(Approach):
         self.chatgpt_token_limit = get_token_limit(chatgpt_model, self.ALLOW_NON_GPT_MODELS)
         self.prompt_manager = prompt_manager
         self.answer_prompt = self.prompt_manager.load_prompt("ask_answer_question.prompty")
+        self.embedding_cache = embedding_cache
 
     async def run(
         self,
@@ -89,6 +92,7 @@ class RetrieveThenReadApproach(Approach):
             use_semantic_captions,
             minimum_search_score,
             minimum_reranker_score,
+            include_embeddings=bool(overrides.get("include_embeddings")),
         )
 
         # Process results
@@ -21,6 +21,8 @@ class RetrieveThenReadVisionApproach(Approach):
     (answer) with that prompt.
     """
 
+    embedding_select_fields = ["embedding", "imageEmbedding"]
+
     def __init__(
         self,
         *,
@@ -108,6 +110,7 @@ class RetrieveThenReadVisionApproach(Approach):
             use_semantic_captions,
             minimum_search_score,
             minimum_reranker_score,
+            include_embeddings=bool(overrides.get("include_embeddings")),
         )
 
         # Process results
@@ -27,3 +27,14 @@ CONFIG_CHAT_HISTORY_COSMOS_ENABLED = "chat_history_cosmos_enabled"
 CONFIG_COSMOS_HISTORY_CLIENT = "cosmos_history_client"
 CONFIG_COSMOS_HISTORY_CONTAINER = "cosmos_history_container"
 CONFIG_COSMOS_HISTORY_VERSION = "cosmos_history_version"
+CONFIG_SERVICE_REGISTRY = "service_registry"
+CONFIG_SEARCH_CLIENT_POOL = "search_client_pool"
+CONFIG_BLOB_CONTAINER_CLIENT_POOL = "blob_container_client_pool"
+CONFIG_CITATION_CACHE = "citation_cache"
+CONFIG_EMBEDDING_CACHE = "embedding_cache"
+CONFIG_HISTORY_COMPACTOR = "history_compactor"
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_SPEECH_SYNTHESIS_POOL = "speech_synthesis_pool"
+CONFIG_SPEECH_AUDIO_CACHE = "speech_audio_cache"
+CONFIG_INGESTION_JOBS = "ingestion_jobs"
+CONFIG_PDF_CONVERSION_POOL = "pdf_conversion_pool"
@@ -1,8 +1,13 @@
 # Refactored from https://github.com/Azure-Samples/ms-identity-python-on-behalf-of
 
+import asyncio
 import base64
+import hashlib
 import json
 import logging
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 from typing import Any, Optional
 
 import aiohttp
@@ -31,8 +36,76 @@ class AuthError(Exception):
         return self.error or ""
 
 
+@lru_cache(maxsize=64)
+def rsa_pem_from_jwk(n: str, e: str) -> bytes:
+    # Construct the RSA public key and convert it to PEM format, keys only change on rotation so this is cached
+    public_numbers = rsa.RSAPublicNumbers(
+        e=int.from_bytes(base64.urlsafe_b64decode(e + "=="), byteorder="big"),
+        n=int.from_bytes(base64.urlsafe_b64decode(n + "=="), byteorder="big"),
+    )
+    return public_numbers.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def jwks_max_age(headers, default: float) -> float:
+    # Cache lifetime of the JWKS document from Cache-Control max-age, else Expires, else the default
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age" and value.isdigit():
+            return float(value)
+    if expires := headers.get("Expires"):
+        try:
+            return max(parsedate_to_datetime(expires).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return default
+
+
+class ExpiringCache:
+    """
+    In-memory cache whose entries expire at a given `time.time()`, holding at most `max_entries` entries.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, tuple[Any, float]] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.time():
+            self.hits += 1
+            return entry[0]
+        self._entries.pop(key, None)
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any, expires_at: float):
+        now = time.time()
+        if expires_at <= now:
+            return
+        if len(self._entries) >= self.max_entries:
+            for expired in [key for key, (_, entry_expires_at) in self._entries.items() if entry_expires_at <= now]:
+                del self._entries[expired]
+        while len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries.pop(key, None)
+        self._entries[key] = (value, expires_at)
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
 class AuthenticationHelper:
     scope: str = "https://graph.microsoft.com/.default"
+    # Used when the keys endpoint sends no caching headers
+    jwks_default_max_age: float = 60 * 60
+    # Unknown key ids force a refresh at most this often, so forged tokens can't hammer the keys endpoint
+    jwks_min_refresh_interval: float = 60
+    # Group membership read from Microsoft Graph is reused for this long
+    groups_cache_ttl: float = 5 * 60
 
     def __init__(
         self,
@@ -61,6 +134,13 @@ class AuthenticationHelper:
         self.valid_audiences = [f"api://{server_app_id}", str(server_app_id)]
         # See https://learn.microsoft.com/entra/identity-platform/access-tokens#validate-the-issuer for more information on token validation
         self.key_url = f"{self.authority}/discovery/v2.0/keys"
+        self._jwks: Optional[dict[str, Any]] = None
+        self._jwks_expires_at = 0.0
+        self._jwks_fetched_at = 0.0
+        self._jwks_refresh: Optional[asyncio.Future] = None
+        # Claims resolved through the on-behalf-of flow by token hash, and Graph group membership by oid
+        self.claims_cache = ExpiringCache()
+        self.groups_cache = ExpiringCache()
 
         if self.use_authentication:
             field_names = [field.name for field in search_index.fields] if search_index else []
@@ -216,12 +296,20 @@ class AuthenticationHelper:
             # https://learn.microsoft.com/entra/identity-platform/v2-oauth2-on-behalf-of-flow
             auth_token = AuthenticationHelper.get_token_auth_header(headers)
             # Validate the token before use
-            await self.validate_access_token(auth_token)
+            token_claims = await self.validate_access_token(auth_token)
+
+            # Claims don't change for the lifetime of a token, so a warm user costs no identity round trips
+            token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
+            if (cached_claims := self.claims_cache.get(token_hash)) is not None:
+                return {"oid": cached_claims["oid"], "groups": list(cached_claims["groups"])}
 
             # Use the on-behalf-of-flow to acquire another token for use with Microsoft Graph
             # See https://learn.microsoft.com/entra/identity-platform/v2-oauth2-on-behalf-of-flow for more information
-            graph_resource_access_token = self.confidential_client.acquire_token_on_behalf_of(
-                user_assertion=auth_token, scopes=["https://graph.microsoft.com/.default"]
+            # MSAL is synchronous, run it on a worker thread so the event loop keeps serving other requests
+            graph_resource_access_token = await asyncio.to_thread(
+                self.confidential_client.acquire_token_on_behalf_of,
+                user_assertion=auth_token,
+                scopes=["https://graph.microsoft.com/.default"],
             )
             if "error" in graph_resource_access_token:
                 raise AuthError(error=str(graph_resource_access_token), status_code=401)
@@ -240,9 +328,22 @@ class AuthenticationHelper:
                 and "_claim_names" in id_token_claims
                 and "groups" in id_token_claims["_claim_names"]
             )
+            claims_expire_at = token_claims["exp"] if token_claims and "exp" in token_claims else None
             if missing_groups_claim or has_group_overage_claim:
                 # Read the user's groups from Microsoft Graph
-                auth_claims["groups"] = await AuthenticationHelper.list_groups(graph_resource_access_token)
+                groups = self.groups_cache.get(auth_claims["oid"])
+                if groups is None:
+                    groups = await AuthenticationHelper.list_groups(graph_resource_access_token)
+                    self.groups_cache.set(auth_claims["oid"], groups, time.time() + self.groups_cache_ttl)
+                auth_claims["groups"] = list(groups)
+                # Groups read from Graph change without a new token, they are only trusted as long as the groups cache
+                if claims_expire_at is not None:
+                    claims_expire_at = min(claims_expire_at, time.time() + self.groups_cache_ttl)
+
+            if claims_expire_at is not None:
+                self.claims_cache.set(
+                    token_hash, {"oid": auth_claims["oid"], "groups": tuple(auth_claims["groups"])}, claims_expire_at
+                )
             return auth_claims
         except AuthError as e:
             logging.exception("Exception getting authorization information - " + json.dumps(e.error))
@@ -288,30 +389,18 @@ class AuthenticationHelper:
         unverified_header = jwt.get_unverified_header(token)
         for key in jwks["keys"]:
             if key["kid"] == unverified_header["kid"]:
-                # Construct the RSA public key
-                public_numbers = rsa.RSAPublicNumbers(
-                    e=int.from_bytes(base64.urlsafe_b64decode(key["e"] + "=="), byteorder="big"),
-                    n=int.from_bytes(base64.urlsafe_b64decode(key["n"] + "=="), byteorder="big"),
-                )
-                public_key = public_numbers.public_key()
+                return rsa_pem_from_jwk(key["n"], key["e"])
 
-                # Convert to PEM format
-                pem_key = public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo
-                )
-                rsa_key = pem_key
-                return rsa_key
-
-    # See https://github.com/Azure-Samples/ms-identity-python-on-behalf-of/blob/939be02b11f1604814532fdacc2c2eccd198b755/FlaskAPI/helpers/authorization.py#L44
-    async def validate_access_token(self, token: str):
-        """
-        Validate an access token is issued by Entra
-        """
+    async def fetch_jwks(self) -> tuple[dict[str, Any], float]:
         jwks = None
+        max_age = self.jwks_default_max_age
+        # With keys already cached a failed refresh falls back to them, so only a cold start waits for retries
+        attempts = 1 if self._jwks else 5
         async for attempt in AsyncRetrying(
             retry=retry_if_exception_type(AuthError),
             wait=wait_random_exponential(min=15, max=60),
-            stop=stop_after_attempt(5),
+            stop=stop_after_attempt(attempts),
+            reraise=True,
         ):
             with attempt:
                 async with aiohttp.ClientSession() as session:
@@ -322,9 +411,46 @@ class AuthenticationHelper:
                                 error=f"Failed to get keys info: {await resp.text()}", status_code=resp_status
                             )
                         jwks = await resp.json()
+                        max_age = jwks_max_age(resp.headers, self.jwks_default_max_age)
 
         if not jwks or "keys" not in jwks:
             raise AuthError("Unable to get keys to validate auth token.", 401)
+        return jwks, max_age
+
+    async def _refresh_jwks(self) -> dict[str, Any]:
+        try:
+            jwks, max_age = await self.fetch_jwks()
+        except Exception:
+            if not self._jwks:
+                raise
+            logging.exception("Failed to refresh token signing keys, using the cached keys")
+            self._jwks_expires_at = time.monotonic() + self.jwks_min_refresh_interval
+            return self._jwks
+        now = time.monotonic()
+        self._jwks, self._jwks_fetched_at, self._jwks_expires_at = jwks, now, now + max_age
+        return jwks
+
+    async def get_jwks(self, force_refresh: bool = False) -> dict[str, Any]:
+        """
+        Returns the cached Entra signing keys, refreshing them when they expired or when `force_refresh` is set.
+        Concurrent callers share a single refresh.
+        """
+        if self._jwks and not force_refresh and time.monotonic() < self._jwks_expires_at:
+            return self._jwks
+        if self._jwks_refresh is None:
+            self._jwks_refresh = asyncio.ensure_future(self._refresh_jwks())
+            self._jwks_refresh.add_done_callback(lambda _: setattr(self, "_jwks_refresh", None))
+        return await asyncio.shield(self._jwks_refresh)
+
+    def can_force_jwks_refresh(self) -> bool:
+        return time.monotonic() - self._jwks_fetched_at >= self.jwks_min_refresh_interval
+
+    # See https://github.com/Azure-Samples/ms-identity-python-on-behalf-of/blob/939be02b11f1604814532fdacc2c2eccd198b755/FlaskAPI/helpers/authorization.py#L44
+    async def validate_access_token(self, token: str) -> dict[str, Any]:
+        """
+        Validate an access token is issued by Entra, returning its verified claims
+        """
+        jwks = await self.get_jwks()
 
         rsa_key = None
         issuer = None
@@ -334,6 +460,9 @@ class AuthenticationHelper:
             issuer = unverified_claims.get("iss")
             audience = unverified_claims.get("aud")
             rsa_key = await self.create_pem_format(jwks, token)
+            if not rsa_key and self.can_force_jwks_refresh():
+                # An unknown key id usually means Entra rotated its signing keys
+                rsa_key = await self.create_pem_format(await self.get_jwks(force_refresh=True), token)
         except jwt.PyJWTError as exc:
             raise AuthError("Unable to parse authorization token.", 401) from exc
         if not rsa_key:
@@ -349,7 +478,7 @@ class AuthenticationHelper:
             )
 
         try:
-            jwt.decode(token, rsa_key, algorithms=["RS256"], audience=audience, issuer=issuer)
+            return jwt.decode(token, rsa_key, algorithms=["RS256"], audience=audience, issuer=issuer)
         except jwt.ExpiredSignatureError as jwt_expired_exc:
             raise AuthError("Token is expired", 401) from jwt_expired_exc
         except (jwt.InvalidAudienceError, jwt.InvalidIssuerError) as jwt_claims_exc:
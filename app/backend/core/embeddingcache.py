@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+EmbeddingKey = tuple[str, str, int, str]
+
+
+class EmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by (model, deployment, dimensions, normalized text).
+
+    Vectors are kept as float32 `array('f')`, about a quarter of the memory of a list of Python floats, and the
+    in-memory cache is capped at `max_bytes`. With `sqlite_path` set, embeddings are also written to a SQLite
+    database so every worker process on the host shares them.
+    """
+
+    def __init__(self, max_bytes: int, sqlite_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[EmbeddingKey, array] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, deployment: Optional[str], dimensions: Optional[int], text: str) -> EmbeddingKey:
+        return (model, deployment or "", dimensions or 0, " ".join(text.split()).casefold())
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def get(self, key: EmbeddingKey) -> Optional[list[float]]:
+        if (vector := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector.tolist()
+        if self._db is not None:
+            try:
+                vector = await asyncio.to_thread(self._db_get, key)
+            except sqlite3.Error:
+                logging.exception("Failed to read embedding cache database")
+            if vector is not None:
+                self._remember(key, vector)
+                self.hits += 1
+                self.persistent_hits += 1
+                return vector.tolist()
+        self.misses += 1
+        return None
+
+    async def put(self, key: EmbeddingKey, embedding: list[float]):
+        vector = array("f", embedding)
+        self._remember(key, vector)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._db_put, key, vector)
+            except sqlite3.Error:
+                logging.exception("Failed to write embedding cache database")
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _entry_bytes(key: EmbeddingKey, vector: array) -> int:
+        return vector.itemsize * len(vector) + len(key[3])
+
+    def _remember(self, key: EmbeddingKey, vector: array):
+        if (previous := self._entries.pop(key, None)) is not None:
+            self.bytes_used -= self._entry_bytes(key, previous)
+        self._entries[key] = vector
+        self.bytes_used += self._entry_bytes(key, vector)
+        while self.bytes_used > self.max_bytes and self._entries:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.bytes_used -= self._entry_bytes(evicted_key, evicted)
+            self.evictions += 1
+
+    @staticmethod
+    def _db_key(key: EmbeddingKey) -> str:
+        return hashlib.sha256("\n".join(map(str, key)).encode()).hexdigest()
+
+    def _db_get(self, key: EmbeddingKey) -> Optional[array]:
+        with self._db_lock:
+            # Closed while the lookup waited for its thread
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (self._db_key(key),)).fetchone()
+        if row is None:
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector
+
+    def _db_put(self, key: EmbeddingKey, vector: array):
+        with self._db_lock:
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (self._db_key(key), vector.tobytes())
+            )
+            self._db.commit()
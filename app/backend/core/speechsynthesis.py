@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncGenerator, Callable, Optional
+
+from azure.cognitiveservices.speech import (
+    ResultReason,
+    SpeechConfig,
+    SpeechSynthesisOutputFormat,
+    SpeechSynthesizer,
+)
+
+
+class SpeechSynthesisError(Exception):
+    pass
+
+
+class AudioCache:
+    """
+    Size-capped LRU cache of synthesized audio keyed by (voice, output format, text hash).
+
+    Audio is kept in memory up to `max_bytes`. With `directory` set it is also written to local disk, capped at
+    `max_disk_bytes`, so it survives restarts and is shared by the workers on the host.
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, max_disk_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.bytes_used = 0
+        self.disk_bytes_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._disk_entries: OrderedDict[str, int] = OrderedDict()
+        self.directory = Path(directory) if directory else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Pick up the audio written before a restart, least recently used first
+            for path in sorted(self.directory.glob("*.audio"), key=lambda path: path.stat().st_mtime):
+                self._disk_entries[path.stem] = path.stat().st_size
+                self.disk_bytes_used += self._disk_entries[path.stem]
+
+    @staticmethod
+    def make_key(voice: str, output_format: str, text: str) -> str:
+        return hashlib.sha256(f"{voice}\n{output_format}\n{text}".encode()).hexdigest()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk_entries),
+            "disk_bytes": self.disk_bytes_used,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if (audio := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return audio
+        if self.directory is not None:
+            try:
+                audio = await asyncio.to_thread(self._read_file, key)
+            except OSError:
+                logging.exception("Failed to read cached audio %s", key)
+            if audio is not None:
+                self._remember(key, audio)
+                # Another worker may have written the file, track it so it counts against the disk cap
+                if (size := self._disk_entries.pop(key, None)) is None:
+                    size = len(audio)
+                    self.disk_bytes_used += size
+                self._disk_entries[key] = size
+                self.hits += 1
+                self.disk_hits += 1
+                return audio
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, audio: bytes):
+        self._remember(key, audio)
+        if self.directory is not None and 0 < len(audio) <= self.max_disk_bytes:
+            try:
+                await asyncio.to_thread(self._write_file, key, audio)
+            except OSError:
+                logging.exception("Failed to write cached audio %s", key)
+                return
+            if (previous := self._disk_entries.pop(key, None)) is not None:
+                self.disk_bytes_used -= previous
+            self._disk_entries[key] = len(audio)
+            self.disk_bytes_used += len(audio)
+            while self.disk_bytes_used > self.max_disk_bytes and self._disk_entries:
+                evicted_key, size = self._disk_entries.popitem(last=False)
+                self.disk_bytes_used -= size
+                self._path_for(evicted_key).unlink(missing_ok=True)
+
+    def _remember(self, key: str, audio: bytes):
+        if (previous := self._entries.pop(key, None)) is not None:
+            self.bytes_used -= len(previous)
+        if len(audio) > self.max_bytes:
+            return
+        self._entries[key] = audio
+        self.bytes_used += len(audio)
+        while self.bytes_used > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes_used -= len(evicted)
+
+    def _path_for(self, key: str) -> Path:
+        # Only called when the disk tier is on
+        assert self.directory is not None
+        return self.directory / f"{key}.audio"
+
+    def _read_file(self, key: str) -> Optional[bytes]:
+        path = self._path_for(key)
+        try:
+            audio = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return audio
+
+    def _write_file(self, key: str, audio: bytes):
+        path = self._path_for(key)
+        partial_path = path.with_suffix(f".{os.getpid()}.partial")
+        partial_path.write_bytes(audio)
+        os.replace(partial_path, path)
+
+
+class PooledSynthesizer:
+    def __init__(self, voice: str):
+        self.voice = voice
+        self.synthesizer: Optional[SpeechSynthesizer] = None
+        self.on_audio: Callable[[bytes], None] = lambda _: None
+
+
+class SpeechSynthesisPool:
+    """
+    Runs Azure speech synthesis on a bounded pool of worker threads, so the blocking Speech SDK calls never run
+    on the event loop. Synthesizers are reused per voice, and audio is handed back chunk by chunk as the SDK
+    produces it.
+    """
+
+    def __init__(
+        self,
+        region: str,
+        max_workers: int = 4,
+        output_format: SpeechSynthesisOutputFormat = SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3,
+    ):
+        self.region = region
+        self.output_format = output_format
+        # Entra token in the "aad#<resource id>#<token>" form, set before each synthesis
+        self.auth_token: Optional[str] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speech")
+        self._slots = asyncio.Semaphore(max_workers)
+        self._idle: dict[str, list[PooledSynthesizer]] = {}
+
+    async def synthesize(self, voice: str, text: str) -> AsyncGenerator[bytes, None]:
+        """
+        Starts synthesizing `text` and waits for the first chunk of audio, so a synthesis that fails up front
+        raises SpeechSynthesisError here. Returns the generator of audio chunks.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        def emit(item):
+            loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+        await self._slots.acquire()
+        idle = self._idle.setdefault(voice, [])
+        pooled = idle.pop() if idle else PooledSynthesizer(voice)
+        try:
+            job = loop.run_in_executor(self._executor, self._speak, pooled, text, emit)
+        except BaseException:
+            self._slots.release()
+            raise
+        job.add_done_callback(lambda _: self._release(pooled))
+
+        first = await chunks.get()
+        if isinstance(first, Exception):
+            raise first
+        return self._stream(first, chunks)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, pooled: PooledSynthesizer):
+        pooled.on_audio = lambda _: None
+        self._idle.setdefault(pooled.voice, []).append(pooled)
+        self._slots.release()
+
+    @staticmethod
+    async def _stream(first: Optional[bytes], chunks: asyncio.Queue) -> AsyncGenerator[bytes, None]:
+        item = first
+        while item is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            item = await chunks.get()
+
+    def _speak(self, pooled: PooledSynthesizer, text: str, emit: Callable):
+        # Runs on a worker thread
+        streamed = False
+
+        def on_audio(chunk: bytes):
+            nonlocal streamed
+            if chunk:
+                streamed = True
+                emit(chunk)
+
+        try:
+            if pooled.synthesizer is None:
+                speech_config = SpeechConfig(auth_token=self.auth_token, region=self.region)
+                speech_config.speech_synthesis_voice_name = pooled.voice
+                speech_config.speech_synthesis_output_format = self.output_format
+                pooled.synthesizer = SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+                pooled.synthesizer.synthesizing.connect(lambda evt: pooled.on_audio(evt.result.audio_data))
+            else:
+                pooled.synthesizer.authorization_token = self.auth_token
+            pooled.on_audio = on_audio
+
+            result = pooled.synthesizer.speak_text_async(text).get()
+            if result.reason == ResultReason.SynthesizingAudioCompleted:
+                if not streamed:
+                    emit(result.audio_data)
+            elif result.reason == ResultReason.Canceled:
+                cancellation_details = result.cancellation_details
+                logging.error(
+                    "Speech synthesis canceled: %s %s", cancellation_details.reason, cancellation_details.error_details
+                )
+                # A canceled synthesizer may hold a broken connection, start the next request on a fresh one
+                pooled.synthesizer = None
+                emit(SpeechSynthesisError("Speech synthesis canceled. Check logs for details."))
+            else:
+                logging.error("Unexpected result reason: %s", result.reason)
+                emit(SpeechSynthesisError("Speech synthesis failed. Check logs for details."))
+        except Exception as exc:
+            pooled.synthesizer = None
+            emit(exc)
+        finally:
+            emit(None)
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import logging
+import os
+from typing import Union
+
+from azure.core.credentials import AzureNamedKeyCredential
+from azure.core.credentials_async import AsyncTokenCredential
+from azure.data.tables.aio import TableClient
+from azure.identity.aio import AzureDeveloperCliCredential
+
+from admin.table_storage import CHATLOG_TABLE, migrate_chatlog_row_keys
+from load_azd_env import load_azd_env
+
+logger = logging.getLogger("scripts")
+
+
+async def main(storage_account: str, credential: Union[AsyncTokenCredential, AzureNamedKeyCredential]):
+    async with TableClient(
+        endpoint=f"https://{storage_account}.table.core.windows.net", table_name=CHATLOG_TABLE, credential=credential
+    ) as table_client:
+        migrated = await migrate_chatlog_row_keys(table_client)
+    logger.info("Gave %d chat log entries newest first keys", migrated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Give chat log entries written before newest first RowKeys such a key. Run it once, from one "
+        "place: the web app reads both kinds of keys meanwhile, and entries keep their former key in EntryId."
+    )
+    parser.add_argument(
+        "--storagekey",
+        required=False,
+        help="Optional. Use this Azure Storage account key instead of the current user identity to login (use az login to set current user for Azure)",
+    )
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    load_azd_env()
+
+    storage_account = os.environ["AZURE_STORAGE_ACCOUNT"]
+    storage_key = args.storagekey or os.getenv("AZURE_STORAGE_KEY")
+    credential: Union[AsyncTokenCredential, AzureNamedKeyCredential]
+    if storage_key:
+        credential = AzureNamedKeyCredential(storage_account, storage_key)
+    elif tenant_id := os.getenv("AZURE_TENANT_ID"):
+        credential = AzureDeveloperCliCredential(tenant_id=tenant_id, process_timeout=60)
+    else:
+        credential = AzureDeveloperCliCredential(process_timeout=60)
+
+    asyncio.run(main(storage_account, credential))
@@ -55,10 +55,22 @@ class OpenAIEmbeddings(ABC):
         self.open_ai_model_name = open_ai_model_name
         self.open_ai_dimensions = open_ai_dimensions
         self.disable_batch = disable_batch
+        self._client: Optional[AsyncOpenAI] = None
 
     async def create_client(self) -> AsyncOpenAI:
         raise NotImplementedError
 
+    async def get_client(self) -> AsyncOpenAI:
+        # One client for all the embeddings of a run, each client holds its own connection pool
+        if self._client is None:
+            self._client = await self.create_client()
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
     def before_retry_sleep(self, retry_state):
         logger.info("Rate limited on the OpenAI embeddings API, sleeping before retrying...")
 
@@ -100,7 +112,7 @@ class OpenAIEmbeddings(ABC):
     async def create_embedding_batch(self, texts: List[str], dimensions_args: ExtraArgs) -> List[List[float]]:
         batches = self.split_text_into_batches(texts)
         embeddings = []
-        client = await self.create_client()
+        client = await self.get_client()
         for batch in batches:
             async for attempt in AsyncRetrying(
                 retry=retry_if_exception_type(RateLimitError),
@@ -122,7 +134,7 @@ class OpenAIEmbeddings(ABC):
         return embeddings
 
     async def create_embedding_single(self, text: str, dimensions_args: ExtraArgs) -> List[float]:
-        client = await self.create_client()
+        client = await self.get_client()
         async for attempt in AsyncRetrying(
             retry=retry_if_exception_type(RateLimitError),
             wait=wait_random_exponential(min=15, max=60),
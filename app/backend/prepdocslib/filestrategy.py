@@ -1,5 +1,5 @@
 import logging
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 
 from azure.core.credentials import AzureKeyCredential
 
@@ -103,7 +103,8 @@ class FileStrategy(Strategy):
         use_content_understanding: bool = False,
         content_understanding_endpoint: Optional[str] = None,
         url: Optional[str] = None,
-        max_depth: Optional[int] = None
+        max_depth: Optional[int] = None,
+        on_file_processed: Optional[Callable[[str, bool, Optional[str]], Awaitable[None]]] = None,
     ):
         self.list_file_strategy = list_file_strategy
         self.blob_manager = blob_manager
@@ -119,6 +120,16 @@ class FileStrategy(Strategy):
         self.content_understanding_endpoint = content_understanding_endpoint
         self.url = url
         self.max_depth = int(max_depth) if max_depth is not None else 0
+        # Called with (filename, success, error) after each file or URL, used for job progress
+        self.on_file_processed = on_file_processed
+
+    async def report_file_processed(self, filename: str, success: bool, error: Optional[str] = None):
+        if error:
+            print(f"Filename processed: {filename}, Status: {success}, Error: {error}")
+        else:
+            print(f"Filename processed: {filename}, Status: {success}")
+        if self.on_file_processed is not None:
+            await self.on_file_processed(filename, success, error)
 
     async def setup(self):
         search_manager = SearchManager(
@@ -155,10 +166,10 @@ class FileStrategy(Strategy):
                         if self.image_embeddings and blob_sas_uris:
                             blob_image_embeddings = await self.image_embeddings.create_embeddings(blob_sas_uris)
                         await search_manager.update_content(sections, blob_image_embeddings, url=file.url, source_website_url=self.url)
-                        print(f"Filename processed: {self.url}, Status: True")
+                        await self.report_file_processed(self.url, True)
 
                 except Exception as e:
-                    print(f"Filename processed: {self.url}, Status: False, Error: {e}")
+                    await self.report_file_processed(self.url, False, str(e))
 
 
             files = self.list_file_strategy.list()
@@ -173,10 +184,10 @@ class FileStrategy(Strategy):
                             blob_image_embeddings = await self.image_embeddings.create_embeddings(blob_sas_uris)
 
                         await search_manager.update_content(sections, blob_image_embeddings, url=file.url)
-                        print(f"Filename processed: {file.filename()}, Status: True")
+                        await self.report_file_processed(file.filename(), True)
 
                 except Exception as e:
-                    print(f"Filename processed: {file.filename()}, Status: False, Error: {e}")
+                    await self.report_file_processed(file.filename(), False, str(e))
                 finally:
                     if file:
                         file.close()
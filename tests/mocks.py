@@ -1,11 +1,21 @@
 import json
+import re
 from collections import namedtuple
+from datetime import datetime, timezone
 from io import BytesIO
 from typing import Optional
 
 import openai.types
 from azure.cognitiveservices.speech import ResultReason
+from azure.core import MatchConditions
 from azure.core.credentials_async import AsyncTokenCredential
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.data.tables import TableEntity, UpdateMode
+from azure.data.tables._serialize import _parameter_filter_substitution
 from azure.search.documents.models import (
     VectorQuery,
 )
@@ -54,6 +64,50 @@ class MockBlob:
         buffer.write(b"test")
 
 
+class MockStreamingBlobClient:
+    def __init__(self, name: str, data: Optional[bytes], content_type: str = "application/pdf", etag: str = '"0x8DC1"'):
+        self.container_name = "content"
+        self.blob_name = name
+        self.data = data
+        self.properties = BlobProperties(name=name, content_type=content_type)
+        self.properties.etag = etag
+        self.properties.size = len(data or b"")
+        self.properties.last_modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.downloads = []
+        self.property_requests = []
+
+    async def get_blob_properties(self, etag=None, match_condition=None):
+        self.property_requests.append(etag)
+        if self.data is None:
+            raise ResourceNotFoundError("Blob not found")
+        if match_condition == MatchConditions.IfModified and etag == self.properties.etag:
+            error = HttpResponseError("Not modified")
+            error.status_code = 304
+            raise error
+        return self.properties
+
+    def replace(self, data: bytes, etag: str):
+        self.data = data
+        self.properties.etag = etag
+        self.properties.size = len(data)
+
+    async def download_blob(self, offset=None, length=None, **kwargs):
+        self.downloads.append((offset, length, kwargs.get("etag")))
+        if offset is None:
+            return MockBlobDownloader(self.data)
+        return MockBlobDownloader(self.data[offset : offset + length])
+
+
+class MockBlobDownloader:
+    def __init__(self, data: bytes, chunk_size: int = 4):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    async def chunks(self):
+        for i in range(0, len(self.data), self.chunk_size):
+            yield self.data[i : i + self.chunk_size]
+
+
 class MockAsyncPageIterator:
     def __init__(self, data):
         self.data = data
@@ -251,12 +305,184 @@ class MockSynthesisResult:
 
 
 def mock_speak_text_success(self, text):
-    return MockSynthesisResult(MockAudio("mock_audio_data"))
+    return MockSynthesisResult(MockAudio(b"mock_audio_data"))
 
 
 def mock_speak_text_cancelled(self, text):
-    return MockSynthesisResult(MockAudioCancelled("mock_audio_data"))
+    return MockSynthesisResult(MockAudioCancelled(b"mock_audio_data"))
 
 
 def mock_speak_text_failed(self, text):
-    return MockSynthesisResult(MockAudioFailure("mock_audio_data"))
+    return MockSynthesisResult(MockAudioFailure(b"mock_audio_data"))
+
+
+class MockAsyncEntityIterator:
+    def __init__(self, entities):
+        self.entities = list(entities)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.entities:
+            raise StopAsyncIteration
+        return self.entities.pop(0)
+
+
+# "<Property> <operator> <@parameter or literal>", the comparisons a table query filter is made of
+MOCK_FILTER_COMPARISON = re.compile(
+    r"(\w+)\s+(eq|ne|gt|ge|lt|le)\s+(datetime'[^']*'|'(?:[^']|'')*'|-?\d+L?|true|false)"
+)
+MOCK_FILTER_OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b,
+}
+
+
+def mock_filter_matches(entity, query_filter, parameters):
+    if not query_filter:
+        return True
+    # Parameters are substituted the way the SDK sends them to the service
+    query_filter = _parameter_filter_substitution(parameters, query_filter)
+    results = []
+
+    def compare(match):
+        name, operator, value = match.groups()
+        if value.startswith("datetime'"):
+            value = datetime.fromisoformat(value[9:-1].replace("Z", "+00:00"))
+        elif value.startswith("'"):
+            value = value[1:-1].replace("''", "'")
+        elif value in ("true", "false"):
+            value = value == "true"
+        else:
+            value = int(value.rstrip("L"))
+        actual = entity.get(name)
+        try:
+            results.append(actual is not None and MOCK_FILTER_OPERATORS[operator](actual, value))
+        except TypeError:
+            results.append(False)
+        return f" _results[{len(results) - 1}] "
+
+    expression = MOCK_FILTER_COMPARISON.sub(compare, query_filter)
+    return eval(expression, {"_results": results})
+
+
+class MockEntityPages:
+    def __init__(self, entities, results_per_page, continuation_token):
+        self.entities = entities
+        self.results_per_page = results_per_page or 1000
+        self.continuation_token = continuation_token
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        start = 0
+        if self.continuation_token:
+            next_key = (self.continuation_token["PartitionKey"], self.continuation_token["RowKey"])
+            start = next(
+                (i for i, e in enumerate(self.entities) if (e["PartitionKey"], e["RowKey"]) >= next_key),
+                len(self.entities),
+            )
+        page = self.entities[start : start + self.results_per_page]
+        rest = self.entities[start + self.results_per_page :]
+        self.continuation_token = (
+            {"PartitionKey": rest[0]["PartitionKey"], "RowKey": rest[0]["RowKey"]} if rest else None
+        )
+        self.done = not rest
+        return MockAsyncEntityIterator(page)
+
+
+class MockQueriedEntities(MockAsyncEntityIterator):
+    def __init__(self, entities, results_per_page):
+        super().__init__(entities)
+        self.results_per_page = results_per_page
+
+    def by_page(self, continuation_token=None):
+        return MockEntityPages(self.entities, self.results_per_page, continuation_token)
+
+
+class MockTableClient:
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.entities = {}
+        self.etags = {}
+        self.version = 0
+        self.queries = []
+        self.transactions = []
+
+    def _entity(self, key):
+        entity = TableEntity(self.entities[key])
+        entity._metadata = {"etag": self.etags[key], "timestamp": None}
+        return entity
+
+    def _touch(self, key):
+        self.version += 1
+        self.etags[key] = f'W/"{self.version}"'
+
+    async def upsert_entity(self, entity, **kwargs):
+        key = (entity["PartitionKey"], entity["RowKey"])
+        self.entities[key] = dict(entity)
+        self._touch(key)
+
+    async def update_entity(self, entity, mode=UpdateMode.MERGE, etag=None, match_condition=None, **kwargs):
+        key = (entity["PartitionKey"], entity["RowKey"])
+        if match_condition == MatchConditions.IfNotModified and etag != self.etags.get(key):
+            raise ResourceModifiedError("The entity was modified")
+        if mode == UpdateMode.REPLACE:
+            self.entities[key] = dict(entity)
+        else:
+            self.entities[key].update(entity)
+        self._touch(key)
+
+    async def delete_entity(self, partition_key, row_key, **kwargs):
+        self.entities.pop((partition_key, row_key), None)
+
+    async def get_entity(self, partition_key, row_key, **kwargs):
+        if (partition_key, row_key) not in self.entities:
+            raise ResourceNotFoundError("Entity not found")
+        return self._entity((partition_key, row_key))
+
+    def list_entities(self, **kwargs):
+        return MockAsyncEntityIterator([self._entity(key) for key in self.entities])
+
+    def query_entities(self, query_filter, parameters=None, select=None, results_per_page=None, **kwargs):
+        self.queries.append(query_filter)
+        # Sorted by PartitionKey and RowKey, like table storage returns them
+        entities = [
+            self._entity(key)
+            for key in sorted(self.entities)
+            if mock_filter_matches(self.entities[key], query_filter, parameters or {})
+        ]
+        if select:
+            for entity in entities:
+                for name in set(entity) - set(select) - {"PartitionKey", "RowKey"}:
+                    del entity[name]
+        return MockQueriedEntities(entities, results_per_page)
+
+    async def submit_transaction(self, operations, **kwargs):
+        self.transactions.append(operations)
+        for operation, entity in operations:
+            if operation == "delete":
+                await self.delete_entity(entity["PartitionKey"], entity["RowKey"])
+            else:
+                await self.upsert_entity(entity)
+
+    async def close(self):
+        pass
+
+
+class MockTableServiceClient:
+    def __init__(self):
+        self.created_tables = []
+
+    async def create_table_if_not_exists(self, table_name):
+        self.created_tables.append(table_name)
+        return MockTableClient(table_name)
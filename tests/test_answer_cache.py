@@ -0,0 +1,66 @@
+import pytest
+
+from admin.answer_cache import AnswerCache
+
+ANSWER = {"data_points": ["Leave_Policy-1.pdf"], "answer": "You get 25 days. [Leave_Policy-1.pdf]"}
+
+
+class MockGenerationStore:
+    def __init__(self):
+        self.generations = {}
+
+    async def get(self, index):
+        return self.generations.get(index, "0")
+
+    async def bump(self, index):
+        self.generations[index] = str(int(self.generations.get(index, "0")) + 1)
+        return self.generations[index]
+
+
+def create_cache(store: MockGenerationStore) -> AnswerCache:
+    return AnswerCache(generation_loader=store.get, generation_bumper=store.bump, similarity_threshold=0.95)
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_hits_on_normalized_question():
+    answer_cache = create_cache(MockGenerationStore())
+    answer, slot = await answer_cache.lookup("HR", "hr-index", "v1", "What is the leave policy?", [1.0, 0.0])
+    assert answer is None
+    answer_cache.store(slot, ANSWER)
+
+    answer, _ = await answer_cache.lookup("hr", "hr-index", "v1", "what is the  leave policy", [0.0, 1.0])
+    assert answer == ANSWER
+    answer, _ = await answer_cache.lookup("HR", "hr-index", "v2", "What is the leave policy?", [1.0, 0.0])
+    assert answer is None
+    assert answer_cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_hits_on_similar_embedding():
+    answer_cache = create_cache(MockGenerationStore())
+    _, slot = await answer_cache.lookup("HR", "hr-index", "v1", "What is the leave policy?", [1.0, 0.1])
+    answer_cache.store(slot, ANSWER)
+
+    answer, _ = await answer_cache.lookup("HR", "hr-index", "v1", "leave policy?", [2.0, 0.25])
+    assert answer == ANSWER
+    answer, _ = await answer_cache.lookup("HR", "hr-index", "v1", "sick leave?", [0.5, 1.0])
+    assert answer is None
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_generation_bump_retires_answers():
+    store = MockGenerationStore()
+    answer_cache = create_cache(store)
+    other_worker = create_cache(store)
+    for cache in [answer_cache, other_worker]:
+        _, slot = await cache.lookup("HR", "hr-index", "v1", "leave policy", [1.0, 0.0])
+        cache.store(slot, ANSWER)
+
+    _, pending_slot = await other_worker.lookup("HR", "hr-index", "v1", "sick leave", [0.0, 1.0])
+    await answer_cache.bump_generation("hr-index")
+
+    assert (await answer_cache.lookup("HR", "hr-index", "v1", "leave policy", [1.0, 0.0]))[0] is None
+    assert (await other_worker.lookup("HR", "hr-index", "v1", "leave policy", [1.0, 0.0]))[0] is None
+    # An answer generated against the old corpus is not stored under the new generation
+    other_worker.store(pending_slot, ANSWER)
+    assert (await other_worker.lookup("HR", "hr-index", "v1", "sick leave", [0.0, 1.0]))[0] is None
@@ -1,10 +1,12 @@
 import base64
 import json
 import re
+import time
 from datetime import datetime, timedelta
 
 import aiohttp
 import jwt
+import msal
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.aio import SearchClient
@@ -111,6 +113,40 @@ async def test_get_auth_claims_overage_unauthorized(
     assert len(auth_claims.keys()) == 0
 
 
+@pytest.mark.asyncio
+async def test_get_auth_claims_cached(monkeypatch, mock_confidential_client_overage, mock_list_groups_success):
+    async def mock_validate_access_token(self, token):
+        return {"oid": "OID_X", "exp": time.time() + 3600}
+
+    monkeypatch.setattr(AuthenticationHelper, "validate_access_token", mock_validate_access_token)
+    on_behalf_of_assertions = []
+    acquire_token_on_behalf_of = msal.ConfidentialClientApplication.acquire_token_on_behalf_of
+
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        on_behalf_of_assertions.append(kwargs["user_assertion"])
+        return acquire_token_on_behalf_of(self, *args, **kwargs)
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+
+    helper = create_authentication_helper()
+    for _ in range(2):
+        auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+        assert auth_claims == {"oid": "OID_X", "groups": ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]}
+    assert on_behalf_of_assertions == ["Token"]
+
+    # A new token for the same user needs the on-behalf-of exchange, but reuses the groups read from Graph
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer OtherToken"})
+    assert auth_claims == {"oid": "OID_X", "groups": ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]}
+    assert on_behalf_of_assertions == ["Token", "OtherToken"]
+    assert helper.groups_cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+    # Claims with groups from Graph expire with the groups cache, not with the hour long token
+    expiries = [expires_at for _, expires_at in helper.claims_cache._entries.values()]
+    assert len(expiries) == 2
+    assert max(expiries) <= time.time() + helper.groups_cache_ttl
+
+
 @pytest.mark.asyncio
 async def test_list_groups_success(mock_list_groups_success, mock_validate_token_success):
     groups = await AuthenticationHelper.list_groups(graph_resource_access_token={"access_token": "MockToken"})
@@ -649,3 +685,73 @@ async def test_validate_access_token(monkeypatch, mock_confidential_client_succe
 
     helper = create_authentication_helper()
     await helper.validate_access_token(mock_token)
+
+
+def create_mock_jwk(public_key, kid):
+    numbers = public_key.public_numbers()
+    return {
+        "kty": "RSA",
+        "use": "sig",
+        "kid": kid,
+        "n": base64.urlsafe_b64encode(numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, byteorder="big"))
+        .decode("utf-8")
+        .rstrip("="),
+        "e": base64.urlsafe_b64encode(numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, byteorder="big"))
+        .decode("utf-8")
+        .rstrip("="),
+    }
+
+
+@pytest.mark.asyncio
+async def test_validate_access_token_caches_jwks(monkeypatch, mock_confidential_client_success):
+    mock_token, public_key, _ = create_mock_jwt(kid="mock_kid")
+    key_requests = []
+
+    def mock_get(*args, **kwargs):
+        key_requests.append(kwargs["url"])
+        return MockResponse(
+            status=200,
+            text=json.dumps({"keys": [create_mock_jwk(public_key, "mock_kid")]}),
+            headers={"Cache-Control": "max-age=86400, private"},
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+
+    helper = create_authentication_helper()
+    for _ in range(3):
+        await helper.validate_access_token(mock_token)
+    assert len(key_requests) == 1
+
+    # An expired key set is fetched again
+    helper._jwks_expires_at = 0
+    await helper.validate_access_token(mock_token)
+    assert len(key_requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_validate_access_token_refreshes_jwks_for_unknown_kid(monkeypatch, mock_confidential_client_success):
+    old_token, old_public_key, _ = create_mock_jwt(kid="old_kid")
+    new_token, new_public_key, _ = create_mock_jwt(kid="new_kid")
+    published_keys = [create_mock_jwk(old_public_key, "old_kid")]
+    key_requests = []
+
+    def mock_get(*args, **kwargs):
+        key_requests.append(kwargs["url"])
+        return MockResponse(status=200, text=json.dumps({"keys": list(published_keys)}))
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+
+    helper = create_authentication_helper()
+    await helper.validate_access_token(old_token)
+
+    # Entra rotates its signing keys
+    published_keys.append(create_mock_jwk(new_public_key, "new_kid"))
+    helper._jwks_fetched_at -= helper.jwks_min_refresh_interval
+    await helper.validate_access_token(new_token)
+    assert len(key_requests) == 2
+
+    # Unknown key ids don't trigger another refresh until the minimum interval has passed
+    forged_token, _, _ = create_mock_jwt(kid="forged_kid")
+    with pytest.raises(AuthError):
+        await helper.validate_access_token(forged_token)
+    assert len(key_requests) == 2
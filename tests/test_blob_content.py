@@ -0,0 +1,76 @@
+import pytest
+import quart
+
+from admin.blob_content import blob_content_response
+
+from .mocks import MockStreamingBlobClient
+
+DATA = b"0123456789abcdefghij"
+
+
+@pytest.fixture
+def content_app():
+    return quart.Quart(__name__)
+
+
+@pytest.mark.asyncio
+async def test_blob_content_streams_whole_blob(content_app):
+    blob_client = MockStreamingBlobClient("a.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a.pdf"):
+        response = await blob_content_response(blob_client, "a.pdf")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/pdf"
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.headers["ETag"] == '"0x8DC1"'
+        assert response.headers["Content-Length"] == str(len(DATA))
+        assert await response.get_data() == DATA
+    assert blob_client.downloads == [(0, len(DATA), '"0x8DC1"')]
+
+
+@pytest.mark.asyncio
+async def test_blob_content_range(content_app):
+    blob_client = MockStreamingBlobClient("a.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a.pdf", headers={"Range": "bytes=5-9"}):
+        response = await blob_content_response(blob_client, "a.pdf")
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 5-9/{len(DATA)}"
+        assert response.headers["Content-Length"] == "5"
+        assert await response.get_data() == b"56789"
+    assert blob_client.downloads == [(5, 5, '"0x8DC1"')]
+
+
+@pytest.mark.asyncio
+async def test_blob_content_unsatisfiable_range(content_app):
+    blob_client = MockStreamingBlobClient("a.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a.pdf", headers={"Range": "bytes=100-200"}):
+        response = await blob_content_response(blob_client, "a.pdf")
+        assert response.status_code == 416
+        assert response.headers["Content-Range"] == f"bytes */{len(DATA)}"
+    assert blob_client.downloads == []
+
+
+@pytest.mark.asyncio
+async def test_blob_content_stale_if_range_sends_whole_blob(content_app):
+    blob_client = MockStreamingBlobClient("a.pdf", DATA)
+    headers = {"Range": "bytes=5-9", "If-Range": '"0xOLD"'}
+    async with content_app.test_request_context("/content/HR/a.pdf", headers=headers):
+        response = await blob_content_response(blob_client, "a.pdf")
+        assert response.status_code == 200
+        assert await response.get_data() == DATA
+
+
+@pytest.mark.asyncio
+async def test_blob_content_not_modified(content_app):
+    blob_client = MockStreamingBlobClient("a.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a.pdf", headers={"If-None-Match": '"0x8DC1"'}):
+        response = await blob_content_response(blob_client, "a.pdf")
+        assert response.status_code == 304
+        assert response.headers["ETag"] == '"0x8DC1"'
+    assert blob_client.downloads == []
+
+
+@pytest.mark.asyncio
+async def test_blob_content_missing_blob(content_app):
+    blob_client = MockStreamingBlobClient("missing.pdf", None)
+    async with content_app.test_request_context("/content/HR/missing.pdf"):
+        assert await blob_content_response(blob_client, "missing.pdf") is None
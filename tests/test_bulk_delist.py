@@ -0,0 +1,97 @@
+import pytest
+
+from admin.bulk_delist import BulkDelister, sourcefile_filter
+
+
+class AsyncList:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.items:
+            raise StopAsyncIteration
+        return self.items.pop(0)
+
+
+class FakeSearchClient:
+    def __init__(self, documents, visible_after_searches=1):
+        # id -> sourcefile
+        self.documents = dict(documents)
+        self.filters = []
+        self.deleted_batches = []
+        # Deletions show up in search results a few searches later, like in the real index
+        self.visible_after_searches = visible_after_searches
+        self.pending_deletes = []
+
+    async def search(self, search_text, filter, select, top):
+        self.filters.append(filter)
+        for id, searches in list(self.pending_deletes):
+            if searches >= self.visible_after_searches:
+                self.documents.pop(id, None)
+                self.pending_deletes.remove((id, searches))
+        self.pending_deletes = [(id, searches + 1) for id, searches in self.pending_deletes]
+        names = filter.split("'")[1].split(filter.split("'")[3])
+        return AsyncList(
+            {"id": id, "sourcefile": sourcefile} for id, sourcefile in self.documents.items() if sourcefile in names
+        )
+
+    async def delete_documents(self, documents):
+        self.deleted_batches.append(documents)
+        self.pending_deletes.extend((document["id"], 0) for document in documents)
+
+
+class FakeContainerClient:
+    container_name = "content"
+
+    def __init__(self, blob_names):
+        self.blob_names = set(blob_names)
+
+    def list_blob_names(self, name_starts_with):
+        return AsyncList(sorted(name for name in self.blob_names if name.startswith(name_starts_with)))
+
+    async def delete_blob(self, name):
+        self.blob_names.remove(name)
+
+
+def test_sourcefile_filter():
+    assert sourcefile_filter(["a.pdf", "b's.pdf"]) == "search.in(sourcefile, 'a.pdf|b''s.pdf', '|')"
+    assert sourcefile_filter(["a|b.pdf", "c.pdf"]) == "search.in(sourcefile, 'a|b.pdf,c.pdf', ',')"
+
+
+@pytest.mark.asyncio
+async def test_bulk_delist():
+    documents = {f"a-{i}": "a.pdf" for i in range(2500)}
+    documents.update({"b-0": "b.pdf", "c-0": "c.pdf"})
+    search_client = FakeSearchClient(documents)
+    blob_container = FakeContainerClient(["a-1.pdf", "a-2.pdf", "b-1.pdf", "ba-1.pdf", "c-1.pdf"])
+    delisted = []
+
+    async def on_file_delisted(result):
+        delisted.append(result.file)
+
+    delister = BulkDelister(search_client, blob_container, settle_delay=0)
+    results = await delister.delist(["a.pdf", "b.pdf", "https://example.com/page"], on_file_delisted)
+
+    assert [(result.file, result.documents, result.blobs, result.error) for result in results] == [
+        ("a.pdf", 2500, 2, None),
+        ("b.pdf", 1, 1, None),
+        ("https://example.com/page", 0, 0, None),
+    ]
+    assert delisted == ["a.pdf", "b.pdf", "https://example.com/page"]
+    # One filter for all the files per round, 1000 documents per delete
+    assert set(search_client.filters) == {"search.in(sourcefile, 'a.pdf|b.pdf|https://example.com/page', '|')"}
+    assert [len(batch) for batch in search_client.deleted_batches] == [1000, 1000, 501]
+    assert set(search_client.documents) == {"c-0"}
+    assert blob_container.blob_names == {"ba-1.pdf", "c-1.pdf"}
+
+
+@pytest.mark.asyncio
+async def test_bulk_delist_gives_up():
+    search_client = FakeSearchClient({"a-0": "a.pdf"}, visible_after_searches=100)
+    delister = BulkDelister(search_client, FakeContainerClient([]), settle_delay=0, max_rounds=3)
+    [result] = await delister.delist(["a.pdf"])
+    assert result.error == "Documents were still in the index after 3 rounds of deletes"
+    assert len(search_client.deleted_batches) == 1
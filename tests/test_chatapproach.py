@@ -1,9 +1,11 @@
+import asyncio
 import json
 
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.aio import SearchClient
-from openai.types.chat import ChatCompletion
+from azure.search.documents.models import VectorizedQuery
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.promptmanager import PromptyManager
@@ -201,3 +203,212 @@ async def test_search_results_filtering_by_scores(
     assert (
         len(filtered_results) == expected_result_count
     ), f"Expected {expected_result_count} results with minimum_search_score={minimum_search_score} and minimum_reranker_score={minimum_reranker_score}"
+
+
+@pytest.mark.asyncio
+async def test_search_uses_search_client_for_call(chat_approach):
+    class MockSearchClient:
+        def __init__(self):
+            self.calls = 0
+
+        async def search(self, *args, **kwargs):
+            self.calls += 1
+            return MockAsyncSearchResultsIterator(kwargs.get("search_text"), kwargs.get("vector_queries"))
+
+    search_client = MockSearchClient()
+    results = await chat_approach.search(
+        top=10,
+        query_text="test query",
+        filter=None,
+        vectors=[],
+        use_text_search=True,
+        use_vector_search=False,
+        use_semantic_ranker=False,
+        use_semantic_captions=False,
+        minimum_search_score=0,
+        minimum_reranker_score=0,
+        search_client=search_client,
+    )
+
+    assert search_client.calls == 1
+    assert len(results) == 1
+
+
+@pytest.mark.asyncio
+async def test_search_selects_embeddings_only_when_asked(chat_approach):
+    class MockSearchClient:
+        def __init__(self):
+            self.selects = []
+
+        async def search(self, *args, **kwargs):
+            self.selects.append(kwargs.get("select"))
+            return MockAsyncSearchResultsIterator(kwargs.get("search_text"), kwargs.get("vector_queries"))
+
+    search_client = MockSearchClient()
+    for include_embeddings in (False, True):
+        await chat_approach.search(
+            top=10,
+            query_text="test query",
+            filter=None,
+            vectors=[],
+            use_text_search=True,
+            use_vector_search=False,
+            use_semantic_ranker=False,
+            use_semantic_captions=False,
+            minimum_search_score=0,
+            minimum_reranker_score=0,
+            search_client=search_client,
+            include_embeddings=include_embeddings,
+        )
+
+    assert search_client.selects == [
+        ["id", "content", "category", "sourcepage", "sourcefile"],
+        ["id", "content", "category", "sourcepage", "sourcefile", "embedding"],
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query_rewrite, completions", [("always", 2), ("first_turn", 1)])
+async def test_run_until_final_call_skips_query_rewrite(chat_approach, monkeypatch, query_rewrite, completions):
+    class MockCompletions:
+        def __init__(self):
+            self.calls = 0
+
+        async def create(self, *args, **kwargs):
+            self.calls += 1
+            return ChatCompletion.model_validate(
+                {
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "message": {"role": "assistant", "content": "pto policy"},
+                            "finish_reason": "stop",
+                            "index": 0,
+                        }
+                    ],
+                    "id": "test-123",
+                    "created": 0,
+                    "model": "gpt-35-turbo",
+                }
+            )
+
+    class MockSearchClient:
+        async def search(self, *args, **kwargs):
+            return MockAsyncSearchResultsIterator(kwargs.get("search_text"), kwargs.get("vector_queries"))
+
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    completions_client = MockCompletions()
+    chat_approach.openai_client = type(
+        "MockOpenAI", (), {"chat": type("MockChat", (), {"completions": completions_client})}
+    )
+    extra_info, chat_coroutine = await chat_approach.run_until_final_call(
+        [{"role": "user", "content": "What is the PTO policy for new employees?"}],
+        {"retrieval_mode": "text", "query_rewrite": query_rewrite},
+        {},
+        "content",
+        None,
+        should_stream=False,
+        search_client=MockSearchClient(),
+    )
+    await chat_coroutine
+
+    assert completions_client.calls == completions
+    if query_rewrite == "first_turn":
+        assert extra_info["thoughts"][0].title == "Search query rewrite skipped"
+        assert extra_info["thoughts"][1].description == "What is the PTO policy for new employees?"
+
+
+@pytest.mark.asyncio
+async def test_run_with_streaming_emits_references_last(chat_approach, monkeypatch):
+    class MockChunkStream:
+        def __init__(self, contents):
+            self.chunks = [
+                ChatCompletionChunk.model_validate(
+                    {
+                        "object": "chat.completion.chunk",
+                        "choices": [{"delta": {"role": "assistant", "content": content}, "index": 0}],
+                        "id": "test-123",
+                        "model": "gpt-35-turbo",
+                        "created": 1,
+                    }
+                )
+                for content in contents
+            ]
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if not self.chunks:
+                raise StopAsyncIteration
+            return self.chunks.pop(0)
+
+    async def mock_run_until_final_call(*args, **kwargs):
+        assert kwargs["should_stream"] is True
+
+        async def chat_coroutine():
+            return MockChunkStream(["Paris is the capital ", "[Benefit_Options-2.pdf].", " <<What about Spain?>>"])
+
+        return {}, chat_coroutine()
+
+    monkeypatch.setattr(chat_approach, "run_until_final_call", mock_run_until_final_call)
+    events = [
+        event
+        async for event in chat_approach.run_with_streaming(
+            [{"role": "user", "content": "What is the capital of France?"}],
+            {"suggest_followup_questions": True},
+            "content",
+            "prompt",
+            {},
+        )
+    ]
+
+    assert "context" not in events[0]
+    assert (
+        "".join(event["delta"]["content"] for event in events[1:-1]) == "Paris is the capital [Benefit_Options-2.pdf]. "
+    )
+    assert events[-1]["context"] == {
+        "data_points": ["Benefit_Options-2.pdf"],
+        "answer": "Paris is the capital [Benefit_Options-2.pdf]. ",
+        "followup_questions": ["What about Spain?"],
+    }
+
+
+@pytest.mark.asyncio
+async def test_resolve_speculation_normalized_match(chat_approach):
+    async def speculative_retrieval():
+        return ["vector"], ["result"]
+
+    vectors, results, speculation = await chat_approach.resolve_speculation(
+        asyncio.create_task(speculative_retrieval()), "What is the PTO policy?", "what is the pto policy", True
+    )
+    assert vectors == ["vector"]
+    assert results == ["result"]
+    assert speculation["match"] == "normalized"
+    assert speculation["hit_rate"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_resolve_speculation_similarity(chat_approach, monkeypatch):
+    async def mock_compute_text_embedding(q):
+        return VectorizedQuery(vector=[1.0, 0.0] if q == "pto policy" else [0.0, 1.0], k_nearest_neighbors=50)
+
+    monkeypatch.setattr(chat_approach, "compute_text_embedding", mock_compute_text_embedding)
+
+    async def speculative_retrieval():
+        return [VectorizedQuery(vector=[1.0, 0.1], k_nearest_neighbors=50)], ["result"]
+
+    _, results, speculation = await chat_approach.resolve_speculation(
+        asyncio.create_task(speculative_retrieval()), "How much PTO do I get?", "pto policy", True
+    )
+    assert results == ["result"]
+    assert speculation["match"] == "similarity"
+
+    vectors, results, speculation = await chat_approach.resolve_speculation(
+        asyncio.create_task(speculative_retrieval()), "How much PTO do I get?", "sick leave", True
+    )
+    # The rewritten query's embedding is handed back so the fallback search doesn't compute it again
+    assert vectors[0].vector == [0.0, 1.0]
+    assert results is None
+    assert speculation["used"] is False
+    assert speculation["hit_rate"] == 0.5
@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+import pytest
+
+from admin.chatlog_writer import ChatLogWriter
+from admin.table_storage import build_chatlog_entity
+
+from .mocks import MockTableClient
+
+
+class MockFailingTransactionTableClient(MockTableClient):
+    async def submit_transaction(self, operations, **kwargs):
+        raise Exception("Transaction failed")
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_batches_by_partition():
+    table_client = MockTableClient("chatLog")
+    writer = ChatLogWriter(table_client, flush_interval=60)
+    for i in range(150):
+        await writer.submit(build_chatlog_entity("HR", "user", "chat", [{"user": f"q{i}"}], 0))
+    for i in range(10):
+        await writer.submit(build_chatlog_entity("IT", "user", "chat", [{"user": f"q{i}"}], 0))
+    await writer.stop()
+
+    assert len(table_client.entities) == 160
+    batch_sizes = sorted(len(transaction) for transaction in table_client.transactions)
+    assert batch_sizes == [10, 50, 100]
+    for transaction in table_client.transactions:
+        assert len({entity["PartitionKey"] for _, entity in transaction}) == 1
+    assert writer.stats()["written"] == 160
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_flushes_on_interval():
+    table_client = MockTableClient("chatLog")
+    writer = ChatLogWriter(table_client, flush_interval=0.01)
+    writer.start()
+    await writer.submit(build_chatlog_entity("HR", "user", "chat", [{"user": "hello"}], 0))
+    for _ in range(100):
+        if table_client.entities:
+            break
+        await asyncio.sleep(0.01)
+    assert len(table_client.entities) == 1
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_drops_when_full():
+    writer = ChatLogWriter(MockTableClient("chatLog"), max_queue_size=1, enqueue_timeout=0.01)
+    assert await writer.submit(build_chatlog_entity("HR", "user", "chat", [], 0)) is True
+    assert await writer.submit(build_chatlog_entity("HR", "user", "chat", [], 0)) is False
+    stats = writer.stats()
+    assert stats["overflowed"] == 1
+    assert stats["dropped"] == 1
+    assert stats["queued"] == 1
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_falls_back_to_single_upserts():
+    table_client = MockFailingTransactionTableClient("chatLog")
+    writer = ChatLogWriter(table_client)
+    await writer.submit(build_chatlog_entity("HR", "user", "chat", [], 0))
+    await writer.submit(build_chatlog_entity("HR", "user", "chat", [], 0))
+    await writer.stop()
+    assert len(table_client.entities) == 2
+    assert writer.stats()["written"] == 2
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_supersedes_process_entries():
+    table_client = MockTableClient("chatLog")
+    previous = build_chatlog_entity("HR", "adminApp", "process", {"file": "a.pdf"}, 0)
+    await table_client.upsert_entity(previous)
+
+    writer = ChatLogWriter(table_client)
+    first = build_chatlog_entity("HR", "adminApp", "process", {"file": "a.pdf"}, 0)
+    second = build_chatlog_entity("HR", "adminApp", "process", {"file": "a.pdf"}, 0)
+    other = build_chatlog_entity("HR", "adminApp", "process", {"file": "b.pdf"}, 0)
+    for entity in [first, second, other]:
+        await writer.submit(entity)
+    await writer.stop()
+
+    is_deleted = {row_key: entity["IsDeleted"] for (_, row_key), entity in table_client.entities.items()}
+    assert is_deleted[previous["RowKey"]] == 1
+    assert is_deleted[first["RowKey"]] == 1
+    assert is_deleted[second["RowKey"]] == 0
+    assert is_deleted[other["RowKey"]] == 0
+    assert json.loads(table_client.entities[("HR", other["RowKey"])]["ChatHistory"]) == {"file": "b.pdf"}
+
+
+class MockFailingTableClient(MockTableClient):
+    # Queries fail, and so does every write to the partitions in `failing_partitions`
+    def __init__(self, table_name, failing_partitions):
+        super().__init__(table_name)
+        self.failing_partitions = failing_partitions
+
+    def query_entities(self, *args, **kwargs):
+        raise Exception("Query failed")
+
+    async def submit_transaction(self, operations, **kwargs):
+        if operations[0][1]["PartitionKey"] in self.failing_partitions:
+            raise Exception("Transaction failed")
+        await super().submit_transaction(operations, **kwargs)
+
+    async def upsert_entity(self, entity, **kwargs):
+        if entity["PartitionKey"] in self.failing_partitions:
+            raise Exception("Write failed")
+        await super().upsert_entity(entity, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_counts_failed_entries():
+    table_client = MockFailingTableClient("chatLog", {"IT"})
+    writer = ChatLogWriter(table_client)
+    await writer.submit(build_chatlog_entity("HR", "adminApp", "process", {"file": "a.pdf"}, 0))
+    await writer.submit(build_chatlog_entity("HR", "user", "chat", [], 0))
+    await writer.submit(build_chatlog_entity("IT", "user", "chat", [], 0))
+    await writer.stop()
+
+    # A failed supersede query still writes the partition, only the entries that could not be written count as failed
+    assert sorted(partition for partition, _ in table_client.entities) == ["HR", "HR"]
+    stats = writer.stats()
+    assert stats["written"] == 2
+    assert stats["failed"] == 1
+    assert stats["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_chatlog_writer_caps_pending():
+    writer = ChatLogWriter(MockTableClient("chatLog"), max_queue_size=2)
+    for i in range(3):
+        writer._add_pending(build_chatlog_entity("HR", "user", "chat", [{"user": f"q{i}"}], 0))
+    assert len(writer._pending) == 2
+    assert writer.stats()["dropped"] == 1
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+import quart
+
+from admin.blob_content import blob_content_response
+from admin.citation_cache import CitationCache
+
+from .mocks import MockStreamingBlobClient
+
+DATA = b"0123456789abcdefghij"
+
+
+@pytest.fixture
+def content_app():
+    return quart.Quart(__name__)
+
+
+@pytest.mark.asyncio
+async def test_citation_cache_serves_hits_from_disk(content_app, tmp_path):
+    citation_cache = CitationCache(str(tmp_path / "cache"), max_bytes=1024)
+    blob_client = MockStreamingBlobClient("a-1.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a-1.pdf"):
+        response = await blob_content_response(blob_client, "a-1.pdf", citation_cache)
+        assert await response.get_data() == DATA
+    async with content_app.test_request_context("/content/HR/a-1.pdf", headers={"Range": "bytes=10-"}):
+        response = await blob_content_response(blob_client, "a-1.pdf", citation_cache)
+        assert response.status_code == 206
+        assert await response.get_data() == b"abcdefghij"
+
+    assert blob_client.downloads == [(None, None, '"0x8DC1"')]
+    assert blob_client.property_requests == [None, '"0x8DC1"']
+    assert citation_cache.stats()["hits"] == 1
+    assert citation_cache.stats()["misses"] == 1
+    assert citation_cache.stats()["bytes"] == len(DATA)
+
+
+@pytest.mark.asyncio
+async def test_citation_cache_refetches_changed_blob(content_app, tmp_path):
+    citation_cache = CitationCache(str(tmp_path / "cache"), max_bytes=1024)
+    blob_client = MockStreamingBlobClient("a-1.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a-1.pdf"):
+        await (await blob_content_response(blob_client, "a-1.pdf", citation_cache)).get_data()
+        blob_client.replace(b"new version", '"0x8DC2"')
+        response = await blob_content_response(blob_client, "a-1.pdf", citation_cache)
+        assert response.headers["ETag"] == '"0x8DC2"'
+        assert await response.get_data() == b"new version"
+
+    assert citation_cache.stats()["misses"] == 2
+    assert citation_cache.stats()["entries"] == 1
+    assert len(list(citation_cache.directory.iterdir())) == 1
+
+
+@pytest.mark.asyncio
+async def test_citation_cache_evicts_least_recently_used(content_app, tmp_path):
+    citation_cache = CitationCache(str(tmp_path / "cache"), max_bytes=2 * len(DATA))
+    blob_clients = [MockStreamingBlobClient(f"a-{i}.pdf", DATA) for i in range(3)]
+    async with content_app.test_request_context("/content/HR/a.pdf"):
+        for blob_client in [blob_clients[0], blob_clients[1], blob_clients[0], blob_clients[2]]:
+            await blob_content_response(blob_client, blob_client.blob_name, citation_cache)
+
+    assert citation_cache.stats()["evictions"] == 1
+    assert citation_cache.stats()["bytes"] == 2 * len(DATA)
+    entry, _ = await citation_cache.lookup(blob_clients[0])
+    assert entry is not None
+    entry, _ = await citation_cache.lookup(blob_clients[1])
+    assert entry is None
+
+
+@pytest.mark.asyncio
+async def test_citation_cache_invalidate_removes_file(content_app, tmp_path):
+    citation_cache = CitationCache(str(tmp_path / "cache"), max_bytes=1024)
+    blob_client = MockStreamingBlobClient("a-1.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a-1.pdf"):
+        await blob_content_response(blob_client, "a-1.pdf", citation_cache)
+    citation_cache.invalidate("content", "a-1.pdf")
+    assert citation_cache.stats()["entries"] == 0
+    assert citation_cache.stats()["bytes"] == 0
+    assert list(citation_cache.directory.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_citation_cache_missing_file_is_a_miss(content_app, tmp_path):
+    citation_cache = CitationCache(str(tmp_path / "cache"), max_bytes=1024)
+    blob_client = MockStreamingBlobClient("a-1.pdf", DATA)
+    async with content_app.test_request_context("/content/HR/a-1.pdf"):
+        await (await blob_content_response(blob_client, "a-1.pdf", citation_cache)).get_data()
+        for path in citation_cache.directory.iterdir():
+            path.unlink()
+        response = await blob_content_response(blob_client, "a-1.pdf", citation_cache)
+        assert await response.get_data() == DATA
+
+    assert citation_cache.stats()["hits"] == 0
+    assert citation_cache.stats()["misses"] == 2
+    assert len(blob_client.downloads) == 2
+
+
+def test_citation_cache_keeps_directories_of_running_workers(tmp_path):
+    running = tmp_path / "cache" / f"worker-{os.getppid()}"
+    stopped = tmp_path / "cache" / "worker-999999999"
+    for directory in (running, stopped):
+        directory.mkdir(parents=True)
+        (directory / "cached").write_bytes(DATA)
+
+    citation_cache = CitationCache(str(tmp_path / "cache"), max_bytes=1024)
+
+    assert citation_cache.directory == tmp_path / "cache" / f"worker-{os.getpid()}"
+    assert (running / "cached").exists()
+    assert not stopped.exists()
@@ -0,0 +1,35 @@
+import pytest
+from azure.core.credentials import AzureKeyCredential
+
+from admin.client_pools import BlobContainerClientPool, SearchClientPool
+
+
+@pytest.mark.asyncio
+async def test_search_client_pool_reuses_clients_per_index():
+    pool = SearchClientPool(endpoint="https://test.search.windows.net", credential=AzureKeyCredential("key"))
+    hr_client = pool.get("hr-index")
+    assert pool.get("hr-index") is hr_client
+    it_client = pool.get("it-index")
+    assert it_client is not hr_client
+    assert it_client._index_name == "it-index"
+    # All clients share one connection pool
+    assert hr_client._client._client._pipeline._transport.session is pool._session
+    assert it_client._client._client._pipeline._transport.session is pool._session
+
+    await pool.close()
+    assert pool._session is None
+    assert pool.get("hr-index") is not hr_client
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_blob_container_client_pool_reuses_clients_per_container():
+    pool = BlobContainerClientPool(account_url="https://test.blob.core.windows.net", credential="key")
+    hr_client = pool.get("hr-content")
+    assert pool.get("hr-content") is hr_client
+    it_client = pool.get("it-content")
+    assert it_client.container_name == "it-content"
+    assert hr_client._pipeline._transport.session is pool._session
+    assert it_client._pipeline._transport.session is pool._session
+    await pool.close()
+    assert pool._session is None
@@ -0,0 +1,105 @@
+from approaches.approach import Document
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from approaches.contextpacker import ContextPacker
+from approaches.promptmanager import PromptyManager, RenderedPrompt
+
+from .mocks import MOCK_EMBEDDING_DIMENSIONS, MOCK_EMBEDDING_MODEL_NAME
+
+
+def make_result(id: str, content: str, score: float, reranker_score=None, fused_score=None) -> Document:
+    return Document(
+        id=id,
+        content=content,
+        embedding=None,
+        image_embedding=None,
+        category=None,
+        sourcepage=f"{id}.pdf",
+        sourcefile=f"{id}.pdf",
+        oids=None,
+        groups=None,
+        captions=[],
+        score=score,
+        reranker_score=reranker_score,
+        fused_score=fused_score,
+    )
+
+
+def test_pack_fills_budget_by_score():
+    packer = ContextPacker("gpt-35-turbo")
+    results = [
+        make_result("short", "Employees get fifteen days of paid time off.", 0.01, 2.0),
+        make_result("long", "The handbook covers benefits in detail. " * 60, 0.03, 3.0),
+        make_result("best", "Paid time off accrues every pay period for full time staff.", 0.02, 3.5),
+        make_result("copy", "Paid time off accrues every pay period for full time staff!", 0.02, 3.4),
+    ]
+    text_sources = [{"filename": result.sourcepage, "content": result.content} for result in results]
+
+    packed, packed_sources, packing = packer.pack(results, text_sources, token_budget=100)
+
+    # The long chunk does not fit, the copy of the best one is dropped, the short one still goes in
+    assert [result.id for result in packed] == ["best", "short"]
+    assert packed_sources == [text_sources[2], text_sources[0]]
+    assert packing["candidates"] == 4
+    assert packing["packed"] == 2
+    assert packing["duplicates"] == 1
+    assert packing["over_budget"] == 1
+    assert 0 < packing["tokens"] <= 100
+
+    packer.pack(results, text_sources, token_budget=100)
+    assert packer.stats()["hits"] == 3
+    assert packer.stats()["misses"] == 3
+
+
+def test_pack_keeps_fused_order():
+    packer = ContextPacker("gpt-35-turbo")
+    # Hits of two indexes, the raw scores of the second index are higher but rank below in the fusion
+    results = [
+        make_result("first", "Employees get fifteen days of paid time off.", 0.01, 1.5, fused_score=0.0325),
+        make_result("second", "Dental coverage is part of the Plus plan.", 0.05, 3.9, fused_score=0.0164),
+        make_result("third", "Vision coverage starts after ninety days.", 0.04, 3.1, fused_score=0.0161),
+    ]
+    text_sources = [{"filename": result.sourcepage, "content": result.content} for result in results]
+
+    packed, _, _ = packer.pack(list(reversed(results)), list(reversed(text_sources)), token_budget=1000)
+
+    assert [result.id for result in packed] == ["first", "second", "third"]
+
+
+def test_pack_empty_budget():
+    packer = ContextPacker("gpt-35-turbo")
+    results = [make_result("a", "Some content", 1.0)]
+    packed, packed_sources, packing = packer.pack(results, [{"filename": "a.pdf", "content": "Some content"}], 0)
+    assert packed == []
+    assert packed_sources == []
+    assert packing["over_budget"] == 1
+
+
+def test_get_source_token_budget():
+    chat_approach = ChatReadRetrieveReadApproach(
+        search_client=None,
+        auth_helper=None,
+        openai_client=None,
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+        prompt_manager=PromptyManager(),
+        context_token_budget=10000,
+        history_token_reserve=50,
+    )
+    rendered_prompt = RenderedPrompt(
+        all_messages=[],
+        system_content="Answer with the sources.",
+        few_shot_messages=[],
+        past_messages=[{"role": "user", "content": "word " * 500}],
+        new_user_content="What is the PTO policy?",
+    )
+    # gpt-35-turbo has 4000 tokens, minus the answer, the prompt and the history reserve
+    budget = chat_approach.get_source_token_budget(rendered_prompt, 10000, 1024)
+    assert 2850 < budget < 4000 - 1024 - 50
+    assert chat_approach.get_source_token_budget(rendered_prompt, 500, 1024) == 500
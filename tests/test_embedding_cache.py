@@ -0,0 +1,87 @@
+import openai.types
+import pytest
+
+from approaches.promptmanager import PromptyManager
+from approaches.retrievethenread import RetrieveThenReadApproach
+from core.embeddingcache import EmbeddingCache
+
+from .mocks import MOCK_EMBEDDING_DIMENSIONS, MOCK_EMBEDDING_MODEL_NAME, MockClient
+
+
+class CountingEmbeddingsClient:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, *args, **kwargs) -> openai.types.CreateEmbeddingResponse:
+        self.calls += 1
+        return openai.types.CreateEmbeddingResponse(
+            object="list",
+            data=[openai.types.Embedding(embedding=[0.5, 0.25, 0.125], index=0, object="embedding")],
+            model=MOCK_EMBEDDING_MODEL_NAME,
+            usage=openai.types.create_embedding_response.Usage(prompt_tokens=8, total_tokens=8),
+        )
+
+
+def create_key(text: str):
+    return EmbeddingCache.make_key(MOCK_EMBEDDING_MODEL_NAME, "embeddings", None, text)
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_normalizes_text():
+    embedding_cache = EmbeddingCache(max_bytes=1024)
+    await embedding_cache.put(create_key("What is  the PTO policy?"), [0.5, 0.25])
+    assert await embedding_cache.get(create_key(" what is the pto policy? ")) == [0.5, 0.25]
+    assert await embedding_cache.get(create_key("What is the sick leave policy?")) is None
+    assert embedding_cache.stats()["hit_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_evicts_by_bytes():
+    key_bytes = len(create_key("q0")[3])
+    embedding_cache = EmbeddingCache(max_bytes=2 * (4 * 4 + key_bytes))
+    for i in range(3):
+        await embedding_cache.put(create_key(f"q{i}"), [0.0, 1.0, 2.0, 3.0])
+
+    stats = embedding_cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 2 * (4 * 4 + key_bytes)
+    assert await embedding_cache.get(create_key("q0")) is None
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_shares_sqlite_between_instances(tmp_path):
+    sqlite_path = str(tmp_path / "embeddings.db")
+    writer = EmbeddingCache(max_bytes=1024, sqlite_path=sqlite_path)
+    await writer.put(create_key("pto policy"), [0.5, 0.25])
+    writer.close()
+
+    reader = EmbeddingCache(max_bytes=1024, sqlite_path=sqlite_path)
+    assert await reader.get(create_key("pto policy")) == [0.5, 0.25]
+    assert reader.stats()["persistent_hits"] == 1
+    reader.close()
+
+
+@pytest.mark.asyncio
+async def test_compute_text_embedding_uses_cache():
+    embeddings_client = CountingEmbeddingsClient()
+    approach = RetrieveThenReadApproach(
+        search_client=None,
+        auth_helper=None,
+        openai_client=MockClient(embeddings_client),
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_deployment="embeddings",
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+        prompt_manager=PromptyManager(),
+        embedding_cache=EmbeddingCache(max_bytes=1024),
+    )
+    first = await approach.compute_text_embedding("PTO policy")
+    second = await approach.compute_text_embedding("pto  policy")
+    assert embeddings_client.calls == 1
+    assert first.vector == second.vector == [0.5, 0.25, 0.125]
@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import pytest
+
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from approaches.fanoutsearch import FanOutSearchClient, reciprocal_rank_fusion
+from approaches.promptmanager import PromptyManager
+
+from .mocks import MOCK_EMBEDDING_DIMENSIONS, MOCK_EMBEDDING_MODEL_NAME
+
+
+class AsyncList:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.items:
+            raise StopAsyncIteration
+        return self.items.pop(0)
+
+
+class FakeResults:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def by_page(self):
+        return AsyncList([AsyncList(self.documents)])
+
+
+class FakeSearchClient:
+    def __init__(self, sourcepages, delay=0.0, error=None):
+        self.sourcepages = sourcepages
+        self.delay = delay
+        self.error = error
+        self.calls = []
+
+    async def search(self, **kwargs):
+        self.calls.append(kwargs)
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return FakeResults(
+            [
+                {"id": f"{sourcepage}-{rank}", "content": sourcepage, "sourcepage": sourcepage, "@search.score": 1.0}
+                for rank, sourcepage in enumerate(self.sourcepages[: kwargs["top"]])
+            ]
+        )
+
+
+@pytest.fixture
+def chat_approach():
+    return ChatReadRetrieveReadApproach(
+        search_client=None,
+        auth_helper=None,
+        openai_client=None,
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+        prompt_manager=PromptyManager(),
+    )
+
+
+def test_reciprocal_rank_fusion():
+    hr = [{"sourcepage": "leave.pdf#page=1"}, {"sourcepage": "shared.pdf#page=2"}, {"sourcepage": "pay.pdf#page=3"}]
+    it = [{"sourcepage": "laptop.pdf#page=1"}, {"sourcepage": "shared.pdf#page=2"}]
+    fused = reciprocal_rank_fusion([hr, it], top=3)
+    # Found by both services, so it beats the two top hits found by one
+    assert [document["sourcepage"] for document in fused] == [
+        "shared.pdf#page=2",
+        "leave.pdf#page=1",
+        "laptop.pdf#page=1",
+    ]
+    assert fused[0]["@search.fused_score"] == pytest.approx(2 / 62)
+
+
+@pytest.mark.asyncio
+async def test_fan_out_search_runs_concurrently(chat_approach):
+    search_clients = {
+        "hr": FakeSearchClient(["leave.pdf#page=1", "shared.pdf#page=2"], delay=0.3),
+        "it": FakeSearchClient(["laptop.pdf#page=1", "shared.pdf#page=2"], delay=0.3),
+        "finance": FakeSearchClient([], delay=0.1, error=RuntimeError("index not found")),
+    }
+    search_client = FanOutSearchClient(search_clients)
+
+    start = time.monotonic()
+    results = await chat_approach.search(
+        top=3,
+        query_text="Who approves leave for IT staff?",
+        filter="category eq 'policy'",
+        vectors=[],
+        use_text_search=True,
+        use_vector_search=False,
+        use_semantic_ranker=False,
+        use_semantic_captions=False,
+        minimum_search_score=0,
+        minimum_reranker_score=0,
+        search_client=search_client,
+    )
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.55
+    assert [result.sourcepage for result in results] == ["shared.pdf#page=2", "leave.pdf#page=1", "laptop.pdf#page=1"]
+    assert all(client.calls[0]["filter"] == "category eq 'policy'" for client in search_clients.values())
+    assert search_client.last_search["fused_results"] == 3
+    assert search_client.last_search["services"]["hr"]["results"] == 2
+    assert search_client.last_search["services"]["hr"]["ms"] >= 300
+    assert search_client.last_search["services"]["finance"]["error"] == "index not found"
+
+
+@pytest.mark.asyncio
+async def test_fan_out_search_fails_when_every_index_fails():
+    search_client = FanOutSearchClient({"hr": FakeSearchClient([], error=RuntimeError("down"))})
+    with pytest.raises(RuntimeError):
+        await search_client.search(search_text="leave", top=3)
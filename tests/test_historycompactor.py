@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from openai_messages_token_helper import count_tokens_for_message
+
+from approaches.historycompactor import SUMMARY_REQUEST, HistoryCompactor
+from approaches.promptmanager import PromptyManager
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        summary = f"Summary {len(self.calls)} of the conversation about paid time off and health plans."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=summary))])
+
+
+def fake_openai_client():
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+
+def history_tokens(messages):
+    return sum(count_tokens_for_message("gpt-35-turbo", message) for message in messages)
+
+
+def turn(index):
+    return [
+        {"role": "user", "content": f"Question {index}: how many days of paid time off do I get in year {index}?"},
+        {"role": "assistant", "content": f"Answer {index}: " + "You get fifteen days of paid time off. " * 5},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_history_compaction_keeps_prompts_flat():
+    openai_client = fake_openai_client()
+    compactor = HistoryCompactor(
+        openai_client,
+        "gpt-35-turbo",
+        None,
+        PromptyManager(),
+        token_threshold=300,
+        recent_tokens=150,
+        query_token_limit=80,
+    )
+    past_messages = []
+    answer_tokens = []
+    for index in range(30):
+        lookups = compactor.hits + compactor.misses
+        compacted, query_messages, compaction = compactor.compact(past_messages)
+        # One lookup per turn, whatever the history is used for
+        assert compactor.hits + compactor.misses - lookups == (0 if compaction is None else 1)
+        answer_tokens.append(history_tokens(compacted))
+        assert history_tokens(query_messages) <= history_tokens(compacted)
+        if compaction is not None and compaction["summarized"]:
+            assert compacted[0]["content"] == SUMMARY_REQUEST
+            assert compacted[1]["content"].startswith("Summary")
+            assert compacted[2]["role"] == "user"
+            assert query_messages[:2] == compacted[:2]
+        # Summaries are written after the turn, off the request path
+        await asyncio.gather(*compactor._pending.values())
+        past_messages += turn(index)
+
+    uncompacted = history_tokens(past_messages)
+    assert uncompacted > 8 * 300
+    # The threshold plus a short summary, however long the conversation
+    assert max(answer_tokens) < 300 + 100
+    assert compactor.stats()["summaries"] > 5
+    assert compactor.stats()["failures"] == 0
+    # Each summary continues the previous one instead of summarizing the whole history again
+    last_prompt = openai_client.chat.completions.calls[-1]["messages"][1]["content"]
+    assert "Previous summary:" in last_prompt
+    assert "Question 0:" not in last_prompt
+
+
+@pytest.mark.asyncio
+async def test_history_compaction_short_history_unchanged():
+    compactor = HistoryCompactor(fake_openai_client(), "gpt-35-turbo", None, PromptyManager(), token_threshold=600)
+    past_messages = turn(0)
+    assert compactor.compact(past_messages) == (past_messages, past_messages, None)
+    assert compactor.stats()["misses"] == 0
@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+
+from admin.ingestion_jobs import (
+    FILE_BATCH_SIZE,
+    FILE_FAILED,
+    FILE_PENDING,
+    FILE_PROCESSED,
+    JOB_PARTITION,
+    JOB_RUNNING,
+    JOB_SUCCEEDED,
+    IngestionJob,
+    IngestionJobQueue,
+)
+
+from .mocks import MockTableClient
+
+
+async def wait_for_status(queue, job_id, status):
+    for _ in range(100):
+        job = await queue.get(job_id)
+        if job.status == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} never reached status {status}")
+
+
+@pytest.mark.asyncio
+async def test_ingestion_job_progress(tmp_path):
+    table_client = MockTableClient("ingestionJobs")
+    release = asyncio.Event()
+
+    async def runner(job, progress):
+        await progress("a.pdf", FILE_PROCESSED)
+        await release.wait()
+        await progress("b.pdf", FILE_FAILED, "Unsupported file")
+
+    queue = IngestionJobQueue(table_client, runner)
+    job = await queue.submit("HR", "content", "hr-index", str(tmp_path), ["a.pdf", "b.pdf"])
+    assert job.status in ("queued", "running")
+
+    running = await wait_for_status(queue, job.job_id, JOB_RUNNING)
+    await asyncio.sleep(0.01)
+    assert running.summary()["progress"] == {"pending": 1, "processed": 1, "failed": 0, "skipped": 0}
+
+    release.set()
+    await wait_for_status(queue, job.job_id, JOB_SUCCEEDED)
+    # Finished jobs are read back from the table
+    persisted = await IngestionJobQueue(table_client, runner).get(job.job_id)
+    assert persisted.status == JOB_SUCCEEDED
+    assert persisted.files == {
+        "a.pdf": {"status": FILE_PROCESSED, "error": None},
+        "b.pdf": {"status": FILE_FAILED, "error": "Unsupported file"},
+    }
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_ingestion_jobs_per_service_limit(tmp_path):
+    table_client = MockTableClient("ingestionJobs")
+    running, peak = 0, 0
+
+    async def runner(job, progress):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    queue = IngestionJobQueue(table_client, runner, workers_per_service=2)
+    jobs = [await queue.submit("HR", "content", "hr-index", str(tmp_path), ["a.pdf"]) for _ in range(5)]
+    for job in jobs:
+        await wait_for_status(queue, job.job_id, JOB_SUCCEEDED)
+    assert peak == 2
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_ingestion_job_resumed_after_lease(tmp_path):
+    table_client = MockTableClient("ingestionJobs")
+    abandoned = IngestionJob(
+        job_id="abandoned",
+        service="HR",
+        container="content",
+        index="hr-index",
+        files_dir=str(tmp_path),
+        status=JOB_RUNNING,
+        files={"a.pdf": {"status": FILE_PROCESSED, "error": None}, "b.pdf": {"status": FILE_PENDING, "error": None}},
+        owner="crashed-host:1",
+        updated_at=time.time() - 600,
+    )
+    await table_client.upsert_entity(abandoned.to_entity())
+    await table_client.submit_transaction([("upsert", file_entity) for file_entity in abandoned.file_entities()])
+    resumed_with = []
+
+    async def runner(job, progress):
+        resumed_with.append([name for name, file in job.files.items() if file["status"] == FILE_PENDING])
+        await progress("b.pdf", FILE_PROCESSED)
+
+    queue = IngestionJobQueue(table_client, runner, lease_seconds=300)
+    other_queue = IngestionJobQueue(table_client, runner, lease_seconds=300)
+    await asyncio.gather(queue.resume_abandoned_jobs(), other_queue.resume_abandoned_jobs())
+    await wait_for_status(queue, "abandoned", JOB_SUCCEEDED)
+
+    # Only one worker claims the job, and only the pending file is left to ingest
+    assert resumed_with == [["b.pdf"]]
+    assert queue.resumed + other_queue.resumed == 1
+    await queue.stop()
+    await other_queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_ingestion_job_files_saved_as_rows(tmp_path):
+    table_client = MockTableClient("ingestionJobs")
+
+    async def runner(job, progress):
+        await progress("file-0042.pdf", FILE_FAILED, "Unsupported file")
+
+    queue = IngestionJobQueue(table_client, runner)
+    # Far more than fits in the 32K characters of one table property
+    names = [f"file-{i:04d}.pdf" for i in range(2 * FILE_BATCH_SIZE + 50)]
+    job = await queue.submit("HR", "content", "hr-index", str(tmp_path), names)
+    await wait_for_status(queue, job.job_id, JOB_SUCCEEDED)
+
+    job_entity = await table_client.get_entity(JOB_PARTITION, job.job_id)
+    assert "Files" not in job_entity
+    assert [len(operations) for operations in table_client.transactions] == [FILE_BATCH_SIZE, FILE_BATCH_SIZE, 50]
+    persisted = await IngestionJobQueue(table_client, runner).get(job.job_id)
+    assert list(persisted.files) == names
+    assert persisted.files["file-0042.pdf"] == {"status": FILE_FAILED, "error": "Unsupported file"}
+    assert persisted.summary()["progress"]["pending"] == len(names) - 1
+    await queue.stop()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import stat
+import time
+
+import pytest
+
+from admin.pdf_conversion import PdfConversionPool
+
+# Stands in for soffice: writes "<outdir>/<stem>.pdf", or hangs for documents named "hang.*"
+FAKE_SOFFICE = """#!/bin/sh
+for last; do :; done
+while [ "$#" -gt 0 ]; do
+  if [ "$1" = "--outdir" ]; then outdir="$2"; fi
+  shift
+done
+name=$(basename "$last")
+case "$name" in hang.*) sleep 30 ;; esac
+sleep 0.2
+echo converted > "$outdir/${name%.*}.pdf"
+"""
+
+
+@pytest.fixture
+def soffice(tmp_path):
+    path = tmp_path / "soffice"
+    path.write_text(FAKE_SOFFICE)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.mark.asyncio
+async def test_pdf_conversion_pool_converts_in_parallel(tmp_path, soffice):
+    pool = PdfConversionPool(workers=3, timeout=10, profiles_dir=str(tmp_path / "profiles"), soffice=soffice)
+    docs = []
+    for name in ("a.docx", "b.docx", "c.txt"):
+        (tmp_path / name).write_text(name)
+        docs.append(str(tmp_path / name))
+
+    start = time.monotonic()
+    results = await asyncio.gather(*(pool.convert(doc, str(tmp_path)) for doc in docs))
+    elapsed = time.monotonic() - start
+
+    assert results == [(True, os.path.join(str(tmp_path), name)) for name in ("a.pdf", "b.pdf", "c.pdf")]
+    # Workers each warm up their own profile, then share the batch
+    assert elapsed < 1.5
+    assert pool.stats()["conversions"] == 6
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pdf_conversion_pool_restarts_hung_worker(tmp_path, soffice):
+    pool = PdfConversionPool(workers=1, timeout=0.5, profiles_dir=str(tmp_path / "profiles"), soffice=soffice)
+    (tmp_path / "hang.docx").write_text("hang")
+    (tmp_path / "ok.docx").write_text("ok")
+
+    success, error = await pool.convert(str(tmp_path / "hang.docx"), str(tmp_path))
+    assert not success
+    assert "timed out" in error
+    # The worker is still usable after its office process was killed
+    assert await pool.convert(str(tmp_path / "ok.docx"), str(tmp_path)) == (True, str(tmp_path / "ok.pdf"))
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["restarts"] == 1
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pdf_conversion_pool_without_libreoffice(tmp_path):
+    pool = PdfConversionPool(workers=2, profiles_dir=str(tmp_path / "profiles"), soffice=str(tmp_path / "missing"))
+    (tmp_path / "a.docx").write_text("a")
+
+    success, error = await pool.convert(str(tmp_path / "a.docx"), str(tmp_path))
+    assert not success
+    assert "is not installed" in error
+    # Checked once at start, no workers are started for conversions that can not run
+    assert pool.installed is False
+    assert pool.stats()["failures"] == 1
+    assert pool._tasks == []
+    await pool.stop()
@@ -0,0 +1,39 @@
+import pytest
+
+from approaches.queryrewritepolicy import QueryRewritePolicy
+
+
+@pytest.mark.parametrize(
+    "question, has_history, expected",
+    [
+        ("What is included in the Northwind Health Plus plan?", False, (True, "bypass_first_turn")),
+        ("What is included in the Northwind Health Plus plan?", True, (True, "bypass_standalone")),
+        ("Does it include hearing?", True, (False, "refers_back")),
+        ("And what about part-time employees?", True, (False, "refers_back")),
+        ("Dental?", False, (False, "too_short")),
+        ("Welche Leistungen übernimmt der Plan für Zahnärzte?", False, (False, "language")),
+        ("¿Qué incluye el plan?", False, (False, "language")),
+        ("Cuantos dias de vacaciones tengo?", False, (False, "language")),
+        ("Tell me more about [Benefit_Options.pdf] please", False, (False, "markup")),
+        (" ".join(["word"] * 41), False, (False, "too_long")),
+    ],
+)
+def test_query_rewrite_policy_auto(question, has_history, expected):
+    assert QueryRewritePolicy("auto").decide(question, has_history) == expected
+
+
+def test_query_rewrite_policy_modes():
+    policy = QueryRewritePolicy()
+    question = "What is included in the Northwind Health Plus plan?"
+    assert policy.decide(question, False) == (False, "mode_always")
+    assert policy.decide(question, False, "first_turn") == (True, "bypass_first_turn")
+    assert policy.decide(question, True, "first_turn") == (False, "has_history")
+    assert policy.decide(question, True, "unknown") == (False, "mode_always")
+    stats = policy.stats()
+    assert stats["decisions"] == 4
+    assert stats["bypassed"] == 1
+    assert stats["bypass_rate"] == 0.25
+    assert stats["reason_mode_always"] == 2
+
+    with pytest.raises(ValueError):
+        QueryRewritePolicy("sometimes")
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from admin.service_registry import ServiceRegistry
+
+SERVICES = [
+    {"service": "HR", "index": "hr-index", "blob": "hr-content"},
+    {"service": "IT", "index": "it-index", "blob": "it-content"},
+]
+
+
+class MockConfigStore:
+    def __init__(self, services=None):
+        self.api_configuration = {"SERVICES": json.dumps(services or SERVICES)}
+        self.config_calls = 0
+        self.prompt_calls = 0
+
+    async def get_api_configuration(self):
+        self.config_calls += 1
+        return dict(self.api_configuration)
+
+    async def get_prompt_entity(self, search_criteria):
+        self.prompt_calls += 1
+        return {"document_rag_prompt": f"prompt for {search_criteria['service']}"}
+
+
+def create_registry(store: MockConfigStore) -> ServiceRegistry:
+    return ServiceRegistry(
+        config_loader=store.get_api_configuration,
+        prompt_loader=store.get_prompt_entity,
+        default_services="[]",
+    )
+
+
+@pytest.mark.asyncio
+async def test_registry_lookup_is_case_insensitive():
+    registry = create_registry(MockConfigStore())
+    assert await registry.refresh() is True
+    assert registry.version == 1
+    assert registry.get("hr")["index"] == "hr-index"
+    assert registry.get("It")["blob"] == "it-content"
+    assert registry.get("finance") is None
+    assert registry.get({}) is None
+
+
+@pytest.mark.asyncio
+async def test_registry_version_only_changes_with_content():
+    store = MockConfigStore()
+    registry = create_registry(store)
+    await registry.refresh()
+    assert await registry.refresh() is False
+    assert registry.version == 1
+
+    store.api_configuration["SERVICES"] = json.dumps(SERVICES + [{"service": "Finance", "index": "fin-index"}])
+    assert await registry.invalidate() is True
+    assert registry.version == 2
+    assert registry.get("finance")["index"] == "fin-index"
+
+
+@pytest.mark.asyncio
+async def test_registry_falls_back_to_default_services():
+    store = MockConfigStore()
+    store.api_configuration = {}
+    registry = ServiceRegistry(
+        config_loader=store.get_api_configuration,
+        prompt_loader=store.get_prompt_entity,
+        default_services=json.dumps([{"service": "Default"}]),
+    )
+    await registry.refresh()
+    assert registry.services == [{"service": "Default"}]
+
+
+@pytest.mark.asyncio
+async def test_registry_keeps_snapshot_on_errors():
+    store = MockConfigStore()
+    registry = create_registry(store)
+    await registry.refresh()
+
+    store.api_configuration = {"error": "An error occurred while retrieving API configuration.", "details": "boom"}
+    assert await registry.refresh() is False
+    store.api_configuration = {"SERVICES": "not json"}
+    assert await registry.refresh() is False
+    assert registry.version == 1
+    assert registry.get("hr") is not None
+
+
+@pytest.mark.asyncio
+async def test_registry_caches_prompts_until_invalidated():
+    store = MockConfigStore()
+    registry = create_registry(store)
+    await registry.refresh()
+
+    assert (await registry.get_prompt("HR"))["document_rag_prompt"] == "prompt for HR"
+    await registry.get_prompt("HR")
+    assert store.prompt_calls == 1
+
+    registry.invalidate_prompt("hr")
+    await registry.get_prompt("HR")
+    assert store.prompt_calls == 2
+
+    await registry.refresh()
+    await registry.get_prompt("HR")
+    assert store.prompt_calls == 3
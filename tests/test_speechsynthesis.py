@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from core.speechsynthesis import AudioCache, SpeechSynthesisError, SpeechSynthesisPool
+
+
+@pytest.mark.asyncio
+async def test_audio_cache_lru():
+    cache = AudioCache(max_bytes=10)
+    await cache.put("a", b"aaaa")
+    await cache.put("b", b"bbbb")
+    assert await cache.get("a") == b"aaaa"
+    # "b" is now least recently used and makes room for "c"
+    await cache.put("c", b"cccc")
+    assert await cache.get("b") is None
+    assert await cache.get("c") == b"cccc"
+    assert cache.stats()["bytes"] == 8
+
+
+@pytest.mark.asyncio
+async def test_audio_cache_disk(tmp_path):
+    key = AudioCache.make_key("en-US-AndrewMultilingualNeural", "Audio16Khz32KBitRateMonoMp3", "Hello")
+    cache = AudioCache(max_bytes=1024, directory=str(tmp_path), max_disk_bytes=1024)
+    await cache.put(key, b"mp3 audio")
+
+    # Another worker, or the same one after a restart, reads the audio from disk
+    other_cache = AudioCache(max_bytes=1024, directory=str(tmp_path), max_disk_bytes=1024)
+    assert await other_cache.get(key) == b"mp3 audio"
+    assert other_cache.stats()["disk_hits"] == 1
+    assert await other_cache.get(key) == b"mp3 audio"
+    assert other_cache.stats()["disk_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_speech_synthesis_pool(mock_speech_success):
+    pool = SpeechSynthesisPool("eastus", max_workers=2)
+    pool.auth_token = "aad#resource#token"
+    try:
+        results = await asyncio.gather(*(pool.synthesize("voice", f"text {i}") for i in range(4)))
+        for chunks in results:
+            assert [chunk async for chunk in chunks] == [b"mock_audio_data"]
+        # Synthesizers are reused, never more than one per worker
+        assert len(pool._idle["voice"]) <= 2
+    finally:
+        pool.close()
+
+
+@pytest.mark.asyncio
+async def test_speech_synthesis_pool_cancelled(mock_speech_cancelled):
+    pool = SpeechSynthesisPool("eastus")
+    pool.auth_token = "aad#resource#token"
+    try:
+        with pytest.raises(SpeechSynthesisError, match="Speech synthesis canceled"):
+            await pool.synthesize("voice", "text")
+    finally:
+        pool.close()
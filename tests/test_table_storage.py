@@ -0,0 +1,219 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import quart
+
+from admin import table_storage
+from admin.table_storage import (
+    APICONFIGURATION_TABLE,
+    CHATLOG_TABLE,
+    CONFIG_TABLE_CLIENTS,
+    TABLES,
+)
+
+from .mocks import MockTableClient, MockTableServiceClient
+
+
+@pytest.fixture
+def table_app():
+    app = quart.Quart(__name__)
+    app.config[CONFIG_TABLE_CLIENTS] = {table_name: MockTableClient(table_name) for table_name in TABLES}
+    return app
+
+
+@pytest.mark.asyncio
+async def test_setup_table_clients_creates_each_table_once():
+    table_service_client = MockTableServiceClient()
+    table_clients = await table_storage.setup_table_clients(table_service_client)
+    assert sorted(table_service_client.created_tables) == sorted(TABLES)
+    assert set(table_clients.keys()) == set(TABLES)
+    assert table_clients[CHATLOG_TABLE].table_name == CHATLOG_TABLE
+
+
+@pytest.mark.asyncio
+async def test_api_configuration_roundtrip(table_app):
+    async with table_app.app_context():
+        await table_storage.upsert_api_configuration("SERVICES", "[]")
+        assert await table_storage.get_api_configuration() == {"SERVICES": "[]"}
+        await table_storage.delete_api_configuration("SERVICES")
+        assert await table_storage.get_api_configuration() == {}
+        assert table_app.config[CONFIG_TABLE_CLIENTS][APICONFIGURATION_TABLE].entities == {}
+
+
+@pytest.mark.asyncio
+async def test_update_is_deleted(table_app):
+    async with table_app.app_context():
+        chatlog_client = table_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE]
+        await chatlog_client.upsert_entity({"PartitionKey": "HR", "RowKey": "1", "IsDeleted": 0})
+        await table_storage.update_is_deleted("HR", "1")
+        assert chatlog_client.entities[("HR", "1")]["IsDeleted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_index_generation(table_app):
+    async with table_app.app_context():
+        assert await table_storage.get_index_generation("hr-index") == "0"
+        generation = await table_storage.bump_index_generation("hr-index")
+        assert await table_storage.get_index_generation("hr-index") == generation
+        assert await table_storage.bump_index_generation("hr-index") != generation
+
+
+def chatlog(service, created_at, question, legacy=False):
+    entity = table_storage.build_chatlog_entity(service, "user", "chat", [{"user": question}], 0)
+    entity["CreatedAt"] = created_at
+    if legacy:
+        # Keys and properties of entries written before newest first keys
+        entity["RowKey"] = f"{created_at:%Y%m%d%H%M%S}_{question}"
+        del entity["CreatedAt"]
+    else:
+        entity["RowKey"] = table_storage.newest_first_row_key(created_at, question)
+    return entity
+
+
+@pytest.mark.asyncio
+async def test_get_chatlogs_pages_newest_first(table_app):
+    async with table_app.app_context():
+        chatlog_client = table_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE]
+        for day in range(1, 6):
+            await chatlog_client.upsert_entity(chatlog("HR", datetime(2025, 1, day, tzinfo=timezone.utc), f"new{day}"))
+        await chatlog_client.upsert_entity(chatlog("IT", datetime(2025, 1, 9, tzinfo=timezone.utc), "other"))
+        for day in (1, 2):
+            await chatlog_client.upsert_entity(
+                chatlog("HR", datetime(2024, 1, day, tzinfo=timezone.utc), f"old{day}", legacy=True)
+            )
+
+        questions = []
+        criteria = {"service": "HR", "page_size": 3, "include_chat_history": False}
+        while True:
+            page = await table_storage.get_chatlogs(criteria)
+            assert len(page["entries"]) <= 3
+            assert all("ChatHistory" not in entry for entry in page["entries"])
+            questions.extend(entry["RowKey"].split("_")[1] for entry in page["entries"])
+            if page["continuation_token"] is None:
+                break
+            criteria["continuation_token"] = page["continuation_token"]
+        assert questions == ["new5", "new4", "new3", "new2", "new1", "old2", "old1"]
+
+        entries = await table_storage.get_chatlogs({"service": "HR", "top": 2, "start_date": "2025-01-02T00:00:00Z"})
+        assert [entry["ChatHistory"] for entry in entries] == [[{"user": "new5"}], [{"user": "new4"}]]
+        entries = await table_storage.get_chatlogs({"service": "HR", "end_date": "2025-01-02T00:00:00Z"})
+        assert [entry["ChatHistory"] for entry in entries][:2] == [[{"user": "new2"}], [{"user": "new1"}]]
+
+
+async def read_all_pages(criteria):
+    questions = []
+    while True:
+        page = await table_storage.get_chatlogs(criteria)
+        assert len(page["entries"]) <= criteria["page_size"]
+        questions.extend(entry["RowKey"].split("_")[1] for entry in page["entries"])
+        if page["continuation_token"] is None:
+            return questions
+        criteria = {**criteria, "continuation_token": page["continuation_token"]}
+
+
+@pytest.mark.asyncio
+async def test_get_chatlogs_merges_services_newest_first(table_app):
+    async with table_app.app_context():
+        chatlog_client = table_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE]
+        for service, day in [("HR", 1), ("IT", 2), ("HR", 3), ("Sales", 4), ("IT", 5)]:
+            created_at = datetime(2025, 1, day, tzinfo=timezone.utc)
+            await chatlog_client.upsert_entity(chatlog(service, created_at, f"{service}{day}"))
+        await chatlog_client.upsert_entity(chatlog("IT", datetime(2024, 6, 1, tzinfo=timezone.utc), "IT0", legacy=True))
+        # A sparse service whose only entry is older than the first pages, it is read whole and left out of them
+        await chatlog_client.upsert_entity(chatlog("Ops", datetime(2024, 12, 1, tzinfo=timezone.utc), "Ops0"))
+
+        questions = await read_all_pages({"page_size": 2, "include_chat_history": False})
+        assert questions == ["IT5", "Sales4", "HR3", "IT2", "HR1", "Ops0", "IT0"]
+        entries = await table_storage.get_chatlogs({"top": 2})
+        assert [entry["Service"] for entry in entries] == ["IT", "Sales"]
+
+
+@pytest.mark.asyncio
+async def test_get_chatlogs_reuses_the_service_list(table_app):
+    async with table_app.app_context():
+        chatlog_client = table_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE]
+        for service in ["HR", "IT", "Sales"]:
+            await chatlog_client.upsert_entity(chatlog(service, datetime(2025, 1, 1, tzinfo=timezone.utc), service))
+        await table_storage.get_chatlogs({"page_size": 10})
+
+        chatlog_client.queries.clear()
+        await table_storage.get_chatlogs({"page_size": 10})
+        assert not any("PartitionKey gt" in query for query in chatlog_client.queries)
+
+
+@pytest.mark.asyncio
+async def test_get_chatlogs_pages_legacy_entries_in_windows(table_app):
+    async with table_app.app_context():
+        chatlog_client = table_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE]
+        for hour in range(0, 24 * 40, 7):
+            created_at = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=hour)
+            await chatlog_client.upsert_entity(chatlog("HR", created_at, f"{hour:04d}", legacy=True))
+
+        questions = await read_all_pages({"service": "HR", "page_size": 5, "include_chat_history": False})
+        assert questions == [f"{hour:04d}" for hour in reversed(range(0, 24 * 40, 7))]
+
+        # A page reads the legacy entries of a few days, not all of them
+        chatlog_client.queries.clear()
+        page = await table_storage.get_chatlogs(
+            {"service": "HR", "page_size": 5, "end_date": "2024-01-20T00:00:00Z", "include_chat_history": False}
+        )
+        assert [entry["RowKey"].split("_")[1] for entry in page["entries"]][0] == "0455"
+        assert len(chatlog_client.queries) < 10
+
+
+@pytest.mark.asyncio
+async def test_migrate_chatlog_row_keys(table_app):
+    async with table_app.app_context():
+        chatlog_client = table_app.config[CONFIG_TABLE_CLIENTS][CHATLOG_TABLE]
+        legacy = chatlog("HR", datetime(2024, 1, 1, 12, tzinfo=timezone.utc), "old", legacy=True)
+        await chatlog_client.upsert_entity(legacy)
+        await chatlog_client.upsert_entity(chatlog("HR", datetime(2025, 1, 1, tzinfo=timezone.utc), "new"))
+
+        assert await table_storage.migrate_chatlog_row_keys(chatlog_client) == 1
+        migrated_key = table_storage.newest_first_row_key(datetime(2024, 1, 1, 12, tzinfo=timezone.utc), "old")
+        assert ("HR", legacy["RowKey"]) not in chatlog_client.entities
+        assert chatlog_client.entities[("HR", migrated_key)]["CreatedAt"] == datetime(
+            2024, 1, 1, 12, tzinfo=timezone.utc
+        )
+        assert await table_storage.migrate_chatlog_row_keys(chatlog_client) == 0
+
+        # Clients keep referring to the entry by its former key
+        entries = await table_storage.get_chatlogs({"service": "HR"})
+        assert [entry["RowKey"] for entry in entries][1] == legacy["RowKey"]
+        await table_storage.update_is_deleted("HR", legacy["RowKey"])
+        assert chatlog_client.entities[("HR", migrated_key)]["IsDeleted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_feedback_entries_pages_summaries(table_app):
+    async with table_app.app_context():
+        feedback_client = table_app.config[CONFIG_TABLE_CLIENTS][table_storage.FEEDBACK_TABLE]
+        for i in range(5):
+            await table_storage.upsert_feedback_entity("HR", f"user{i % 2}", 1, f"good {i}", [{"user": f"q{i}"}], 0)
+        await table_storage.upsert_feedback_entity("HR", "o'brien", 0, "bad", [{"user": "q"}], 0)
+
+        entries = []
+        criteria = {"service": "HR", "user_name": "user0", "page_size": 2}
+        while True:
+            page = await table_storage.get_feedback_entries(criteria)
+            assert all("ChatHistory" not in entry for entry in page["entries"])
+            entries.extend(page["entries"])
+            if page["continuation_token"] is None:
+                break
+            criteria["continuation_token"] = page["continuation_token"]
+        assert sorted(entry["Feedback"] for entry in entries) == ["good 0", "good 2", "good 4"]
+
+        full = await table_storage.get_feedback_entry("HR", entries[0]["RowKey"])
+        assert full["ChatHistory"] == [{"user": entries[0]["Feedback"].replace("good ", "q")}]
+        assert await table_storage.get_feedback_entry("HR", "missing") is None
+
+        # Values are bound as parameters, property names are checked
+        [quoted] = await table_storage.get_feedback_entries({"user_name": "o'brien"})
+        assert quoted["ChatHistory"] == [{"user": "q"}]
+        invalid = await table_storage.get_feedback_entries({"UserName eq 'x' or IsDeleted": 1})
+        assert "error" in invalid
+        assert all("'" not in query for query in feedback_client.queries)
+
+        lines = [json.loads(line) async for line in table_storage.export_feedback_entries({"feedback_flag": 1})]
+        assert sorted(line["ChatHistory"][0]["user"] for line in lines) == ["q0", "q1", "q2", "q3", "q4"]